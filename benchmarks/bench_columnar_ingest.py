@@ -0,0 +1,62 @@
+""" Benchmark parsing a Telegraf-style write body point by point and column-wise """
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import logging
+import columnar
+import influxdb_exporter_main
+import lineprotocol
+from sanitize import replace_invalid_chars
+
+CPU_FIELDS = ("usage_user", "usage_system", "usage_idle", "usage_nice", "usage_iowait",
+              "usage_irq", "usage_softirq", "usage_steal", "usage_guest", "usage_guest_nice")
+MEM_FIELDS = ("total", "available", "used", "free", "cached", "buffered")
+
+
+class NullQueue:
+    def put_many(self, batch):
+        return 0
+
+
+def body(hosts, now):
+    """One scrape interval of the cpu (float fields, 8 cores) and mem (integer fields) plugins."""
+    lines = []
+    for h in range(hosts):
+        for core in range(8):
+            values = ",".join(f"{f}={(h * 7 + core * 3 + i) * 0.173:.3f}" for i, f in enumerate(CPU_FIELDS))
+            lines.append(f"cpu,cpu=cpu{core},host=host-{h} {values} {now}\n")
+        values = ",".join(f"{f}={(h + 1) * (i + 1) * 1048576}i" for i, f in enumerate(MEM_FIELDS))
+        lines.append(f"mem,host=host-{h} {values} {now}\n")
+    return "".join(lines).encode()
+
+
+def run(label, columns, data, chunk_size=64 * 1024):
+    c = influxdb_exporter_main.InfluxDBCollector(logging.getLogger("bench"))
+    c.ch = NullQueue()
+    if columns:
+        c.columns = columnar.ColumnParser(c.labelsets, replace_invalid_chars)
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    rates = []
+    # The first pass also fills the label set table and the parser caches.
+    for _ in range(3):
+        now = time.time_ns()
+        start = time.perf_counter()
+        if columns:
+            _, nsamples = c.parse_buffers_to_samples(lineprotocol.line_buffers(chunks), "ns", now)
+        else:
+            _, nsamples = c.parse_points_to_sample(lineprotocol.parse_stream(chunks, "ns", now))
+        rates.append(nsamples / (time.perf_counter() - start))
+    print(f"{label:<24} first pass {rates[0]:>9,.0f}  steady {max(rates[1:]):>9,.0f} samples/sec  samples={nsamples:,}")
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    data = body(hosts, time.time_ns())
+    run("point parser", False, data)
+    run(f"columnar ({'numpy' if columnar.numpy is not None else 'no numpy'})", True, data)
+
+
+if __name__ == "__main__":
+    main()
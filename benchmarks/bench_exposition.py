@@ -0,0 +1,67 @@
+""" Benchmark /metrics payload size and render time: one family per sample vs grouped families """
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import exposition
+import samplestore
+from series import InfluxDBSample
+
+
+def render_per_sample(store):
+    """The previous output: a HELP/TYPE header in front of every sample."""
+    out = []
+    for sample in store.values():
+        out.append(exposition.render_header(sample.name))
+        out.append(exposition.render_series(sample))
+    return "".join(out).encode()
+
+
+def render_grouped(store):
+    """One HELP/TYPE header per metric name, from the store's family index."""
+    out = []
+    for name, samples in store.families().items():
+        out.append(exposition.render_header(name))
+        out.extend(exposition.render_series(sample) for sample in samples)
+    return "".join(out).encode()
+
+
+def build(series, names):
+    store = samplestore.ShardedSampleStore(8, track_changes=True)
+    now = time.time()
+    store.upsert_many([
+        InfluxDBSample(f"telegraf_metric_{i % names}", now, float(i),
+                       (("host", f"host-{i // names % 1000}"), ("region", f"region-{i // names // 1000}")), now + 300)
+        for i in range(series)
+    ])
+    return store
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return body, best
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    names = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    store = build(series, names)
+    old, old_time = timed(lambda: render_per_sample(store))
+    new, new_time = timed(lambda: render_grouped(store))
+    cache = exposition.ExpositionCache(store)
+    cached, cold_time = timed(cache.render, repeat=1)
+    assert len(cached) == len(new)
+    print(f"{series} series over {names} metric names")
+    print(f"{'one family per sample':<24} {len(old) / 2**20:>8.1f} MiB  {old_time * 1000:>8.0f} ms")
+    print(f"{'grouped families':<24} {len(new) / 2**20:>8.1f} MiB  {new_time * 1000:>8.0f} ms")
+    print(f"{'grouped, cache cold':<24} {len(cached) / 2**20:>8.1f} MiB  {cold_time * 1000:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+""" Benchmark line protocol parsing throughput in points/sec """
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import lineprotocol
+
+
+def make_body(n):
+    """Build a Telegraf-like body with ``n`` points."""
+    lines = []
+    for i in range(n):
+        lines.append(
+            f"cpu,host=host{i % 100},region=us-east-{i % 4},cpu=cpu{i % 8} "
+            f"usage_user={i * 0.5},usage_system=1.25,usage_idle=97.5,threads={i % 64}i "
+            f"{1633085189000000000 + i}"
+        )
+    return "\n".join(lines).encode()
+
+
+def bench(label, parse, body, n, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in parse(body))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert count == n
+    print(f"{label:<32} {n / best:>14,.0f} points/sec")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    body = make_body(n)
+    bench("lineprotocol (bytes)", lambda b: lineprotocol.parse_points(b), body, n)
+    bench("lineprotocol (memoryview)", lambda b: lineprotocol.parse_points(memoryview(b)), body, n)
+    try:
+        import doqu
+        parse = getattr(doqu, "parse_points_with_precision")
+    except Exception as e:
+        print(f"{'doqu.parse_points_with_precision':<32} unavailable ({type(e).__name__}: {e})")
+    else:
+        bench("doqu.parse_points_with_precision", lambda b: parse(b, time.time(), "ns"), body, n)
+
+
+if __name__ == "__main__":
+    main()
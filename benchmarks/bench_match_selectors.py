@@ -0,0 +1,64 @@
+""" Benchmark filtered /metrics?match[]= scrapes: label index lookups vs scanning every series """
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import exposition
+import labelindex
+import samplestore
+from series import InfluxDBSample
+
+SELECTORS = ['metric_7{host="h42"}', 'metric_3{dc="dc2", host=~"h1.*"}', '{host="h99", dc!="dc0"}']
+
+
+def build(series):
+    store = samplestore.ShardedSampleStore(8, track_changes=True)
+    cache = exposition.ExpositionCache(store)
+    now = time.time()
+    hosts = series // 100
+    store.upsert_many([InfluxDBSample(f"metric_{m}", now, 1.0, (("dc", f"dc{h % 4}"), ("host", f"h{h}")), now + 300)
+                       for m in range(100) for h in range(hosts)])
+    cache.render()
+    return cache
+
+
+def scan(cache, selectors):
+    """What a filtered scrape costs without an index: test every series."""
+    matchers = [labelindex.parse_selector(s) for s in selectors]
+    found = 0
+    for name, samples in cache.snapshot().items():
+        for sample in samples:
+            values = dict(sample.labels)
+            values["__name__"] = name
+            if any(all(m.matches(values.get(m.label, "")) for m in ms) for ms in matchers):
+                found += 1
+    return found
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 500000]
+    for series in sizes:
+        cache = build(series)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        cache.render_selected(SELECTORS[:1])
+        index_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        indexed, (_, found) = timed(lambda: cache.render_selected(SELECTORS))
+        scanned, found_scan = timed(lambda: scan(cache, SELECTORS), repeat=3)
+        assert found == found_scan
+        print(f"series={series:<8,} matched={found:<4} index={indexed * 1000:7.3f}ms  scan={scanned * 1000:8.1f}ms  "
+              f"index memory={index_bytes / series:.0f} B/series")
+
+
+if __name__ == "__main__":
+    main()
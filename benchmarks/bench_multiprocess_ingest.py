@@ -0,0 +1,63 @@
+""" Benchmark ingest throughput of the multi-process mode against worker count """
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import config
+import lineprotocol
+import multiingest
+
+POINTS_PER_BODY = 5000
+
+
+def make_body(seed):
+    return "".join(
+        f"http,host=host-{(seed * POINTS_PER_BODY + i) % 5000},region=eu-{i % 7} requests={i}i,latency={i * 0.5}\n"
+        for i in range(POINTS_PER_BODY)).encode()
+
+
+def worker(number, conn, bodies):
+    """Parse ``bodies`` the way an ingest worker does and ship the samples."""
+    from unittest.mock import MagicMock
+    import influxdb_exporter_main
+    c = influxdb_exporter_main.InfluxDBCollector(MagicMock())
+    c.ch = multiingest.ShippingQueue(conn, number, config.ingestBatchSize, config.ingestShipLinger)
+    for i in range(bodies):
+        c.parse_points_to_sample(lineprotocol.parse_points(make_body(number * bodies + i)))
+    c.ch.flush()
+    time.sleep(1)
+
+
+def run(workers, bodies):
+    ctx = multiprocessing.get_context("spawn")
+    received = []
+    aggregator = multiingest.Aggregator(lambda samples: received.append(len(samples)))
+    procs = []
+    expected = workers * bodies * POINTS_PER_BODY * 2
+    for i in range(workers):
+        recv, send = ctx.Pipe(duplex=False)
+        procs.append(ctx.Process(target=worker, args=(i, send, bodies)))
+        aggregator.attach(i, recv)
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    while sum(received) < expected:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+    nbytes = sum(s.bytes for s in aggregator.stats.values())
+    print(f"{workers} worker(s)  {expected / elapsed:>10.0f} samples/sec  {nbytes / expected:>5.1f} bytes/sample shipped")
+
+
+def main():
+    bodies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{os.cpu_count()} CPU(s)")
+    for workers in (1, 2, 4):
+        run(workers, bodies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+""" Benchmark ingest-time aggregation: stored series, memory and scrape size with and without a sum rule """
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import exposition
+import preaggregate
+import samplestore
+from series import InfluxDBSample
+
+
+def ingest(rule, pods, nodes=20, fields=4):
+    store = samplestore.ShardedSampleStore(8, track_changes=True)
+    cache = exposition.ExpositionCache(store)
+    now = time.time()
+    inputs = [(f"container_{f}", (("node", f"n{p % nodes}"), ("pod", f"pod-{p}")))
+              for p in range(pods) for f in ("cpu", "mem", "rx", "tx")[:fields]]
+    start = time.perf_counter()
+    batch = []
+    for name, labels in inputs:
+        keep = True
+        if rule is not None:
+            batch.append(rule.add(name, labels, 1.0, now, now + 300))
+            keep = not rule.drop_raw
+        if keep:
+            batch.append(InfluxDBSample(name, now, 1.0, labels, now + 300))
+        if len(batch) >= 1000:
+            store.upsert_many(batch)
+            batch = []
+    store.upsert_many(batch)
+    elapsed = time.perf_counter() - start
+    body = cache.render()
+    return store, cache, body, len(inputs) / elapsed
+
+
+def run(make_rule, pods):
+    rule = make_rule()
+    store, _, body, rate = ingest(rule, pods)
+    # A second pass under tracemalloc counts the rule's own state too.
+    tracemalloc.start()
+    traced_rule = make_rule()
+    kept = ingest(traced_rule, pods)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept, traced_rule
+    label = "raw only" if rule is None else f"{rule.spec}{' drop_raw' if rule.drop_raw else ''}"
+    print(f"{label:<38} series={len(store):>8,}  memory={traced / 2**20:7.1f} MiB  "
+          f"scrape={len(body) / 2**20:6.2f} MiB  ingest={rate:>9,.0f} samples/sec")
+
+
+def main():
+    pods = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    run(lambda: None, pods)
+    run(lambda: preaggregate.Rule("sum", "container", ["pod"]), pods)
+    run(lambda: preaggregate.Rule("sum", "container", ["pod"], drop_raw=True), pods)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+""" Benchmark writer latency during scrapes: copying families under shard locks vs the exposition snapshot """
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import exposition
+import samplestore
+from series import InfluxDBSample
+
+
+def run(mode, series, batches=400, batch_size=500, shards=16):
+    store = samplestore.ShardedSampleStore(shards, track_changes=True)
+    cache = exposition.ExpositionCache(store)
+    now = time.time()
+    labels = [(("host", f"h{i}"),) for i in range(series)]
+    store.upsert_many([InfluxDBSample("metric", now, 0.0, l, now + 300) for l in labels])
+    cache.snapshot()
+
+    if mode == "locked":
+        def scrape():
+            return sum(len(samples) for samples in store.families().values())
+    else:
+        def scrape():
+            return sum(len(samples) for samples in cache.snapshot().values())
+
+    stop = threading.Event()
+    scrapes = [0]
+
+    def scraper():
+        while not stop.is_set():
+            scrape()
+            scrapes[0] += 1
+
+    times = []
+    thread = threading.Thread(target=scraper)
+    thread.start()
+    for b in range(batches):
+        start_at = (b * batch_size) % series
+        batch = [InfluxDBSample("metric", now, float(b), l, now + 300) for l in labels[start_at:start_at + batch_size]]
+        start = time.perf_counter()
+        store.upsert_many(batch)
+        times.append(time.perf_counter() - start)
+    stop.set()
+    thread.join()
+    times.sort()
+    p50 = times[len(times) // 2]
+    p99 = times[int(len(times) * 0.99)]
+    print(f"{mode:<9} series={series:<8,} write batch p50={p50 * 1000:6.2f}ms p99={p99 * 1000:6.2f}ms  scrapes={scrapes[0]}")
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 500000]
+    for series in sizes:
+        for mode in ("locked", "snapshot"):
+            run(mode, series)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+""" Benchmark bytes per series of the sample store """
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import samplestore
+from series import InfluxDBSample, LabelSetTable
+
+
+class DictSample:
+    """The previous representation: a plain object with its own labels dict and string ID."""
+    def __init__(self, name, timestamp, value, labels):
+        self.id = ""
+        self.name = name
+        self.labels = labels
+        self.value = value
+        self.timestamp = timestamp
+
+
+FIELDS = [f"field{f}" for f in range(10)]
+
+
+def points(n):
+    """Yield (measurement, tags, fields) points making up ``n`` series."""
+    for i in range(n // len(FIELDS)):
+        tags = [("host", f"host-{i % 10000}"), ("region", f"region-{i // 10000}"), ("service", "api")]
+        yield "http", tags, FIELDS
+
+
+def build_old(n):
+    samples = {}
+    now = time.time()
+    for measurement, tags, fields in points(n):
+        for field in fields:
+            name = measurement + "_" + field
+            sample = DictSample(name, now, 1.0, {})
+            for key, value in tags:
+                sample.labels[key] = value
+            parts = [name] + sum([[l, sample.labels[l]] for l in sorted(sample.labels)], [])
+            sample.id = ".".join(parts)
+            samples[sample.id] = sample
+    return samples
+
+
+def build_new(n):
+    store = samplestore.ShardedSampleStore(8)
+    labelsets = LabelSetTable(lambda s: s)
+    now = time.time()
+    batch = []
+    for measurement, tags, fields in points(n):
+        labels = labelsets.intern(tags)
+        expires = now + 300
+        for field in fields:
+            name = sys.intern(measurement + "_" + field)
+            batch.append(InfluxDBSample(name, now, 1.0, labels, expires))
+        if len(batch) >= 10000:
+            store.upsert_many(batch)
+            batch = []
+    store.upsert_many(batch)
+    return store, labelsets
+
+
+def measure(label, build, n):
+    gc.collect()
+    tracemalloc.start()
+    result = build(n)
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {used / 2**20:>8.1f} MiB  {used / n:>6.0f} bytes/series")
+    del result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    measure("dict samples + string IDs", build_old, n)
+    measure("slotted samples + handles", build_new, n)
+
+
+if __name__ == "__main__":
+    main()
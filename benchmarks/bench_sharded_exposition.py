@@ -0,0 +1,43 @@
+""" Benchmark hash-sharded /metrics scrapes: one partition of n against the full body while series keep changing """
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import exposition
+import samplestore
+from series import InfluxDBSample
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rounds = 10
+    store = samplestore.ShardedSampleStore(8, track_changes=True)
+    cache = exposition.ExpositionCache(store)
+    now = time.time()
+    labels = [(("host", f"host-{i % 1000}"), ("region", f"region-{i // 1000}")) for i in range(series)]
+    names = [f"telegraf_metric_{i % 50}" for i in range(series)]
+    store.upsert_many([InfluxDBSample(names[i], now, 0.0, labels[i], now + 300) for i in range(series)])
+    print(f"{series} series, 5% updated between scrapes, gzip payloads")
+    for count in (1, 4, 16):
+        shard = None if count == 1 else (0, count)
+        cache.payload(exposition.TEXT, "gzip", shard)
+        refresh = elapsed = 0.0
+        size = 0
+        for r in range(rounds):
+            step = 20
+            store.upsert_many([InfluxDBSample(names[i], now, float(r), labels[i], now + 300)
+                               for i in range(r % step, series, step)])
+            # Applying the changes is shared by all scrapers, whichever comes first.
+            start = time.perf_counter()
+            cache.refresh()
+            refresh += time.perf_counter() - start
+            start = time.perf_counter()
+            size = len(cache.payload(exposition.TEXT, "gzip", shard))
+            elapsed += time.perf_counter() - start
+        print(f"{'full body' if shard is None else f'shard 0 of {count}':<14} {size / 1024:>8.0f} KiB  "
+              f"render+compress {elapsed / rounds * 1000:>6.1f} ms  shared refresh {refresh / rounds * 1000:>6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
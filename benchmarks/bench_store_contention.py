@@ -0,0 +1,73 @@
+""" Benchmark sample store contention: single lock vs per-shard locks """
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import samplestore
+
+
+class Sample:
+    __slots__ = ("id", "timestamp", "value")
+
+    def __init__(self, id, timestamp, value):
+        self.id = id
+        self.timestamp = timestamp
+        self.value = value
+
+
+def run(shards, writers, series, rounds, batch_size=500):
+    store = samplestore.ShardedSampleStore(shards)
+    now = time.time()
+    batches = []
+    for w in range(writers):
+        ids = [f"metric_{w}.host.h{i}" for i in range(series)]
+        batches.append([[Sample(i, now, float(r)) for i in ids[b:b + batch_size]]
+                        for r in range(rounds) for b in range(0, series, batch_size)])
+
+    stop = threading.Event()
+    write_times = []
+    scrapes = [0]
+
+    def scraper():
+        while not stop.wait(0.005):
+            sum(1 for _ in store.values())
+            store.expire(now - 60)
+            scrapes[0] += 1
+
+    def writer(work):
+        times = []
+        for batch in work:
+            start = time.perf_counter()
+            store.upsert_many(batch)
+            times.append(time.perf_counter() - start)
+        write_times.extend(times)
+
+    threads = [threading.Thread(target=writer, args=(b,)) for b in batches]
+    scrape = threading.Thread(target=scraper)
+    start = time.perf_counter()
+    scrape.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    scrape.join()
+    total = writers * series * rounds
+    write_times.sort()
+    p99 = write_times[int(len(write_times) * 0.99)]
+    print(f"shards={shards:<3} writers={writers:<3} {total / elapsed:>12,.0f} upserts/sec  "
+          f"write batch p99={p99 * 1000:.2f}ms  scrapes={scrapes[0]}")
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for writers in (1, 4, 8):
+        for shards in (1, 16):
+            run(shards, writers, series, rounds=2)
+
+
+if __name__ == "__main__":
+    main()
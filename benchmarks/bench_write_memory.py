@@ -0,0 +1,49 @@
+""" Benchmark peak memory of decompressing and parsing one large /write body """
+import gzip
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import lineprotocol
+import writebody
+
+
+def make_body(n):
+    lines = (f"http,host=host-{i % 1000},region=eu-{i % 7} requests={i}i,latency={i * 0.5} {i}\n" for i in range(n))
+    return gzip.compress("".join(lines).encode(), 6)
+
+
+def buffered(body):
+    """The previous path: inflate the whole body, then parse it."""
+    buf = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+    return sum(1 for _ in lineprotocol.parse_points(buf))
+
+
+def streamed(body):
+    chunks = writebody.iter_decoded(io.BytesIO(body), "gzip", 1 << 40)
+    return sum(1 for _ in lineprotocol.parse_stream(chunks))
+
+
+def measure(label, parse, body):
+    tracemalloc.start()
+    start = time.perf_counter()
+    points = parse(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {points} points  peak {peak / 2**20:>7.1f} MiB  {points / elapsed:>10.0f} points/sec")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    body = make_body(n)
+    print(f"compressed body {len(body) / 2**20:.1f} MiB")
+    measure("buffered", buffered, body)
+    measure("streamed", streamed, body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+""" Series cardinality limits and heavy-hitter tracking """
+import threading
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+METRIC = "metric"
+GLOBAL = "global"
+
+
+class SpaceSaving:
+    """Approximate top-k counter (Metwally et al. space-saving algorithm).
+
+    Keeps at most ``k`` counters. An item that is not tracked replaces the
+    current minimum and inherits its count, so every reported count
+    overestimates the true one by at most the ``error`` stored with it, and
+    any item whose true count exceeds total/k is guaranteed to be present.
+    """
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+
+    def add(self, item, weight=1):
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self.counts) < self.k:
+            self.counts[item] = [weight, 0]
+        else:
+            victim = min(self.counts, key=lambda i: self.counts[i][0])
+            floor = self.counts.pop(victim)[0]
+            self.counts[item] = [floor + weight, floor]
+
+    def top(self, n=None):
+        """Return [(item, count, error)] ordered by descending count."""
+        ranked = sorted(((item, c, e) for item, (c, e) in self.counts.items()), key=lambda t: -t[1])
+        return ranked if n is None else ranked[:n]
+
+
+class CardinalityLimiter:
+    """Admits or rejects samples of new series against per-metric and global limits.
+
+    Existing series are always admitted. Counts come from the sample store,
+    read without taking its locks, plus the new series admitted since the
+    last ``reset_pending``, which covers series still in the ingest queue.
+    Call ``reset_pending`` after each expiry sweep, once those have landed;
+    until then a landed series is counted twice, which errs on the side of
+    rejecting. Rejection happens before a sample is allocated.
+
+    Every new series, admitted or not, feeds two space-saving top-k
+    tables: one of measurements and one of tag keys whose value had not
+    been seen recently, which is what a request ID or similar unbounded
+    tag looks like.
+    """
+    def __init__(self, store, per_metric=0, overrides=None, global_limit=0, top_k=20, recent_values=65536):
+        self.store = store
+        self.per_metric = per_metric
+        self.overrides = overrides or {}
+        self.global_limit = global_limit
+        self.limited = bool(per_metric or overrides or global_limit)
+        self.rejected = {METRIC: 0, GLOBAL: 0}
+        self.measurements = SpaceSaving(top_k) if top_k else None
+        self.tag_keys = SpaceSaving(top_k) if top_k else None
+        self._pending = {}
+        self._pending_total = 0
+        self._recent = {}
+        self._recent_max = recent_values
+        self._lock = threading.Lock()
+
+    def admit(self, name, labels, measurement):
+        """Return whether a sample for series (name, labels) may be stored."""
+        store = self.store
+        if store.contains(name, labels):
+            return True
+        pending = self._pending.get(name)
+        if pending is not None and labels in pending:
+            return True
+        if self.measurements is not None:
+            self._track(labels, measurement)
+        if not self.limited:
+            return True
+        with self._lock:
+            pending = self._pending.get(name)
+            if pending is None:
+                pending = self._pending[name] = set()
+            limit = self.overrides.get(name, self.per_metric)
+            if limit and store.series_count(name) + len(pending) >= limit:
+                self.rejected[METRIC] += 1
+                return False
+            if self.global_limit and len(store) + self._pending_total >= self.global_limit:
+                self.rejected[GLOBAL] += 1
+                return False
+            pending.add(labels)
+            self._pending_total += 1
+        return True
+
+    def reset_pending(self):
+        """Forget the series admitted since the last call; they are in the store by now."""
+        with self._lock:
+            self._pending = {}
+            self._pending_total = 0
+
+    def _track(self, labels, measurement):
+        recent = self._recent
+        with self._lock:
+            self.measurements.add(measurement)
+            if len(recent) >= self._recent_max:
+                recent.clear()
+            for pair in labels:
+                if pair not in recent:
+                    recent[pair] = None
+                    self.tag_keys.add(pair[0])
+
+
+class LimiterCollector:
+    """Exports rejected series and the cardinality heavy hitters of a CardinalityLimiter."""
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def collect(self):
+        limiter = self.limiter
+        rejected = CounterMetricFamily(
+            "influxdb_cardinality_rejected_samples", "Samples of new series rejected by a cardinality limit.", labels=["limit"])
+        measurements = GaugeMetricFamily(
+            "influxdb_cardinality_top_measurement_new_series",
+            "Approximate new series per measurement, for the top measurements (space-saving estimate).",
+            labels=["measurement"])
+        tag_keys = GaugeMetricFamily(
+            "influxdb_cardinality_top_tag_key_new_values",
+            "Approximate previously unseen values per tag key on new series, for the top tag keys.",
+            labels=["key"])
+        with limiter._lock:
+            for kind in (METRIC, GLOBAL):
+                rejected.add_metric([kind], limiter.rejected[kind])
+            if limiter.measurements is not None:
+                for item, count, _ in limiter.measurements.top():
+                    measurements.add_metric([item], count)
+                for item, count, _ in limiter.tag_keys.top():
+                    tag_keys.add_metric([item], count)
+        yield from (rejected, measurements, tag_keys)
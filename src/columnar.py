@@ -0,0 +1,245 @@
+""" Columnar parsing of line protocol buffers into name, label, value and timestamp columns """
+import itertools
+import re
+import sys
+from array import array
+import lineprotocol
+from lineprotocol import LineProtocolError
+from series import InfluxDBSample
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_LINE = re.compile(rb"[^\n]+")
+# Field sections the fast path splits itself: key=value pairs with exactly one "=" each
+_FIELDS = re.compile(r"[^=,]+=[^=,]+(?:,[^=,]+=[^=,]+)*")
+# Value text that is not a plain or "i"-suffixed number, and integers written as floats or
+# long enough to need the point parser's range check
+_NOT_NUMERIC = re.compile(r"[^0-9+\-.eEi_,]")
+_BAD_INTEGER = re.compile(r"[.eE][^,]*i(?:,|$)|\d{19,}i(?:,|$)")
+_INT64_MAX = 2 ** 63 - 1
+_MISSING = object()
+
+
+class ColumnBatch:
+    """The samples parsed from one buffer, one column per sample attribute.
+
+    ``points`` counts the points read, including those relabel rules dropped.
+    """
+    __slots__ = ("names", "labels", "values", "timestamps", "expires", "points")
+
+    def __init__(self, names, labels, values, timestamps, expires, points):
+        self.names = names
+        self.labels = labels
+        self.values = values
+        self.timestamps = timestamps
+        self.expires = expires
+        self.points = points
+
+    def __len__(self):
+        return len(self.names)
+
+    def samples(self):
+        """Build the batch's InfluxDBSamples in one pass over the columns."""
+        return list(map(InfluxDBSample, self.names, self.timestamps, self.values, self.labels, self.expires))
+
+
+class ColumnParser:
+    """Parses line protocol buffers column-wise for high-volume, fixed-schema feeds.
+
+    A line's series key (the text before the first space) is looked up in
+    a cache of (measurement, interned labels), or None for points relabel
+    rules drop, and its field keys in a cache of sample names, so a line
+    whose series and field set were seen before costs a few string splits.
+    Its value and timestamp text go into columns that are converted in
+    bulk once the buffer is read: float64 values, int64 timestamps scaled
+    from the write precision to nanoseconds, then seconds and expiry
+    deadlines repeated out to one per sample. NumPy does the conversion
+    when it is installed, ``array`` and ``map`` otherwise.
+
+    Lines with escapes, quotes, repeated field keys or a new series key
+    go through ``lineprotocol.parse_line`` and feed the same columns. A
+    buffer with value text the bulk conversion does not take (booleans,
+    unsigned integers, malformed numbers) is left to the point parser,
+    which also reports any error in it. Both caches are cleared when they
+    reach ``cache_size`` entries.
+    """
+    def __init__(self, labelsets, sanitize, relabeler=None, cache_size=1000000):
+        self.labelsets = labelsets
+        self.sanitize = sanitize
+        self.relabeler = relabeler
+        self.cache_size = cache_size
+        self._series = {}
+        self._names = {}
+
+    def parse(self, buf, multiplier, now, expiry, overrides, lineno=0):
+        """Parse the lines of ``buf`` into a ColumnBatch.
+
+        ``multiplier`` scales timestamps to nanoseconds and points without
+        one get ``now``. Each sample expires ``overrides.get(measurement,
+        expiry)`` seconds after its timestamp. Returns (batch, lineno) with
+        the number of the last line read; batch is None when the buffer has
+        to go to the point parser. Raises LineProtocolError for lines the
+        point parser rejects.
+        """
+        names = []
+        labels = []
+        values = []
+        stamps = []
+        counts = []
+        ttls = []
+        absolute = []
+        series = self._series
+        schemas = self._names
+        points = dropped = 0
+        for lineno, m in enumerate(_LINE.finditer(buf), lineno + 1):
+            try:
+                line = m.group().decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                raise LineProtocolError(lineno, f"invalid utf-8: {e}") from None
+            if not line or line[0] == "#":
+                continue
+            points += 1
+            key, _, rest = line.partition(" ")
+            fields_s, _, ts_s = rest.partition(" ")
+            resolved = _MISSING
+            if "\\" not in line and '"' not in line and " " not in ts_s and _FIELDS.fullmatch(fields_s):
+                resolved = series.get(key, _MISSING)
+            if resolved is None:
+                dropped += 1
+                continue
+            if resolved is not _MISSING:
+                measurement, point_labels = resolved
+                pairs = fields_s.replace(",", "=").split("=")
+                schema = (measurement, tuple(pairs[0::2]))
+                point_names = schemas.get(schema)
+                if point_names is None:
+                    point_names = self._schema(schema)
+            if resolved is _MISSING or point_names is None:
+                measurement = self._append_point(
+                    line, key, lineno, multiplier, now, names, labels, values, stamps, counts, absolute)
+                ttls.append(overrides.get(measurement, expiry))
+                continue
+            n = len(point_names)
+            names += point_names
+            labels += (point_labels,) * n
+            values += pairs[1::2]
+            if ts_s:
+                stamps.append(ts_s)
+            else:
+                absolute.append((len(stamps), now))
+                stamps.append("0")
+            counts.append(n)
+            ttls.append(overrides.get(measurement, expiry))
+
+        try:
+            columns = _convert(values, stamps, absolute, counts, ttls, multiplier)
+        except (ValueError, OverflowError):
+            return None, lineno
+        if dropped and self.relabeler is not None:
+            self.relabeler.dropped += dropped
+        return ColumnBatch(names, labels, *columns, points), lineno
+
+    def _resolve(self, measurement, tags):
+        """Return (measurement, labels) after relabelling, or None when the point is dropped."""
+        relabeler = self.relabeler
+        if relabeler is not None:
+            relabeled = relabeler.relabel(measurement, tuple(tags))
+            if relabeled is None:
+                return None
+            measurement, tags, _ = relabeled
+        return measurement, self.labelsets.intern(tags)
+
+    def _schema(self, schema):
+        """Return and cache the sample names for a (measurement, field keys) pair.
+
+        Returns None for repeated keys, where only the point parser keeps
+        just the last value.
+        """
+        measurement, fields = schema
+        if len(set(fields)) != len(fields):
+            return None
+        names = tuple(sys.intern(self.sanitize(measurement if field == "value" else measurement + "_" + field))
+                      for field in fields)
+        if len(self._names) >= self.cache_size:
+            self._names.clear()
+        self._names[schema] = names
+        return names
+
+    def _append_point(self, line, key, lineno, multiplier, now, names, labels, values, stamps, counts, absolute):
+        """Parse one line with the point parser and append its numeric fields to the columns.
+
+        Returns the measurement after relabelling, for the expiry lookup.
+        """
+        try:
+            measurement, tags, fields, ts = lineprotocol.parse_line(line, multiplier, now)
+        except ValueError as e:
+            raise LineProtocolError(lineno, str(e)) from None
+        # Without escapes the raw series key always parses the same way.
+        if "\\" in line:
+            resolved = self._resolve(measurement, tags)
+        else:
+            resolved = self._series.get(key, _MISSING)
+            if resolved is _MISSING:
+                resolved = self._resolve(measurement, tags)
+                if len(self._series) >= self.cache_size:
+                    self._series.clear()
+                self._series[key] = resolved
+        n = 0
+        if resolved is not None:
+            measurement, point_labels = resolved
+            for field, v in fields.items():
+                if isinstance(v, bool):
+                    v = 1.0 if v else 0.0
+                elif not isinstance(v, (float, int)):
+                    continue
+                names.append(self._schema((measurement, (field,)))[0])
+                labels.append(point_labels)
+                values.append(repr(v))
+                n += 1
+        absolute.append((len(stamps), ts))
+        stamps.append("0")
+        counts.append(n)
+        return measurement
+
+
+def _convert(values, stamps, absolute, counts, ttls, multiplier):
+    """Convert the text columns to per-sample values, timestamps in seconds and expiry deadlines.
+
+    ``stamps`` holds one timestamp per point in the write precision, with
+    ``absolute`` listing (point, nanoseconds) pairs that replace it. Raises
+    ValueError or OverflowError when the point parser has to decide.
+    """
+    text = ",".join(values)
+    if _NOT_NUMERIC.search(text) or _BAD_INTEGER.search(text):
+        raise ValueError("value text needs the point parser")
+    if "i" in text:
+        if text.endswith("i"):
+            text = text[:-1]
+        values = text.replace("i,", ",").split(",")
+    if numpy is not None:
+        values = numpy.array(values, dtype=numpy.float64)
+        raw = numpy.array(list(map(int, stamps)), dtype=numpy.int64)
+        limit = _INT64_MAX // multiplier
+        if len(raw) and (raw.max() > limit or raw.min() < -limit):
+            raise OverflowError("timestamp out of range")
+        ns = raw * multiplier
+        for i, t in absolute:
+            ns[i] = t
+        seconds = ns / 1e9
+        expires = seconds + numpy.array(ttls, dtype=numpy.float64)
+        counts = numpy.array(counts, dtype=numpy.int64)
+        return values.tolist(), numpy.repeat(seconds, counts).tolist(), numpy.repeat(expires, counts).tolist()
+    values = array("d", map(float, values))
+    ns = [t * multiplier for t in map(int, stamps)]
+    if ns and (max(ns) > _INT64_MAX or min(ns) < -_INT64_MAX):
+        raise OverflowError("timestamp out of range")
+    for i, t in absolute:
+        ns[i] = t
+    seconds = [t / 1e9 for t in ns]
+    expires = [t + ttl for t, ttl in zip(seconds, ttls)]
+    repeat = itertools.repeat
+    return (values, list(itertools.chain.from_iterable(map(repeat, seconds, counts))),
+            list(itertools.chain.from_iterable(map(repeat, expires, counts))))
@@ -1,9 +1,97 @@
+import os
+
 MAX_UDP_PAYLOAD = 64 * 1024
 listenAddress = ":18087"
+# asyncio HTTP server: open connection limit (503 beyond it), handler threads
+# for parsing, keep-alive idle and body read timeouts in seconds
+httpMaxConnections = 1024
+httpWorkers = 8
+# Separate handler threads for metricsPath and exporterMetricsPath, so /write
+# parsing keeping every httpWorkers thread busy cannot stall scrapes
+httpScrapeWorkers = 2
+httpIdleTimeout = 60
+httpReadTimeout = 30
 metricsPath = "/metrics"
 exporterMetricsPath = "/metrics/exporter"
+# Debug profiling endpoints under profilingPath, off by default: CPU sampling
+# for at most profilingMaxSeconds per request, and tracemalloc heap sessions
+# that stop on their own after profilingHeapMaxSeconds
+profilingEnabled = False
+profilingPath = "/debug/profile"
+profilingMaxSeconds = 60
+profilingHeapMaxSeconds = 600
+# Compression levels for metricsPath responses (zstd needs the zstandard package)
+metricsGzipLevel = 6
+metricsZstdLevel = 3
+# Largest accepted /write body in bytes, applied both before and after decompression
+maxWriteBodySize = 64 * 1024 * 1024
+# Bytes read and decompressed per step while streaming a /write body
+writeChunkSize = 64 * 1024
+# Longest line accepted in a /write body, in bytes; longer lines fail the request with 400
+maxWriteLineSize = 1024 * 1024
 sampleExpiry = 5 * 60
+# Per-measurement expiry in seconds, overriding sampleExpiry, e.g. {"cpu": 60}
+sampleExpiryOverrides = {}
+# Width of the expiry index buckets; expired samples linger at most this long
+expiryBucketSeconds = 5
+# Bounded queue between the parsers and the sample store.
+# Overflow policy is one of "block", "drop-newest" or "drop-oldest".
+ingestQueueCapacity = 100000
+ingestQueuePolicy = "block"
+ingestBatchSize = 1000
+# Parse /write bodies and UDP datagrams column-wise: repeated series keys and
+# field sets come from caches, and values and timestamps are converted in bulk
+# (with NumPy when it is installed). Buffers with boolean or unsigned fields
+# fall back to the point parser.
+columnarIngest = False
+# Approximate memory budget for stored series in bytes (0 disables). Beyond
+# it the least recently updated series are evicted, down to
+# memoryBudgetLowWater of the budget, on top of the time-based expiry.
+memoryBudgetBytes = 0
+memoryBudgetLowWater = 0.95
+# Threads draining the ingest queue and hash partitions of the sample store
+ingestWorkers = 4
+sampleStoreShards = 8
+# Removed series each store shard logs for the exposition cache between
+# scrapes; past it the next scrape rescans that shard instead
+removedLogLimit = 100000
+# Series limits per metric name and in total (0 disables), with per-metric
+# overrides such as {"http_requests": 50000}. Samples of new series beyond a
+# limit are dropped and counted. cardinalityTopK sets how many measurements
+# and tag keys are tracked as cardinality heavy hitters (0 disables). With
+# everything disabled the per-sample series lookup is skipped entirely.
+seriesLimitPerMetric = 0
+seriesLimitOverrides = {}
+seriesLimitGlobal = 0
+cardinalityTopK = 0
+# Ingest-time aggregation rules, each "<op> <measurement> without (<labels>)"
+# (or "by (...)") with op one of sum, max, min, count, or a dict such as
+# {"op": "sum", "measurement": "container_cpu", "without": ["pod"], "drop_raw": True}.
+# Every metric of the measurement gets a "<name>:<op>" series kept up to date
+# on each sample; drop_raw stops the input series from being stored.
+aggregationRules = []
+# Prometheus-style relabel rules applied to each point before samples are
+# built, as dicts with "action" (replace, keep, drop, labeldrop, labelkeep),
+# "source_labels", "regex", "target_label", "replacement" and "separator",
+# e.g. {"action": "drop", "source_labels": ["__measurement__"], "regex": "debug_.*"}.
+# __measurement__ and __field__ expose the measurement and field name.
+relabelRules = []
+# Distinct raw metric/label names whose sanitised form is cached
+sanitizeCacheSize = 65536
 bindAddress = ":9122"
+# Number of SO_REUSEPORT UDP sockets (one receive/parse worker each)
+udpListeners = os.cpu_count() or 1
+# Datagrams drained per receive call; each socket preallocates this many MAX_UDP_PAYLOAD buffers
+udpBatchSize = 32
+# Multi-process ingest: when above 0, this many worker processes own the UDP
+# listeners (and /write on ingestHttpAddress, if set) and ship parsed sample
+# batches to the main process every ingestBatchSize samples or ingestShipLinger seconds
+ingestProcesses = 0
+ingestHttpAddress = ""
+ingestShipLinger = 0.05
+# Seconds between the UDP, /write and decoding self-metrics each ingest worker
+# ships to the main process, which serves them labelled by worker
+ingestMetricsInterval = 5.0
 exportTimestamp = False
 destinationAddress = ":9122"
 prometheus_http_port = ":8000"
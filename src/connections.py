@@ -2,23 +2,81 @@
 import config
 import socket
 
+def split_host_port(address):
+    """Split a "host:port" listen address; an empty host binds all interfaces."""
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+""" BufferPool """
+class BufferPool:
+    """Preallocated receive buffers reused for every batch of datagrams."""
+    def __init__(self, count, size=config.MAX_UDP_PAYLOAD):
+        self.buffers = [bytearray(size) for _ in range(max(count, 1))]
+        self.views = [memoryview(buf) for buf in self.buffers]
+
+    def __len__(self):
+        return len(self.buffers)
+
 """ UDPConn"""
 class UDPConn:
-    def __init__(self, bind_address):
+    def __init__(self, bind_address, reuse_port=False):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind(bind_address)
 
-    def receive(self, buffer_size=1024):
+    def receive(self, buffer_size=config.MAX_UDP_PAYLOAD):
         data, address = self.sock.recvfrom(buffer_size)
-        data, address = self.sock.recvfrom(config.listenAddress)
         return data, address
 
+    def receive_batch(self, pool):
+        """Receive up to ``len(pool)`` datagrams into the pool's buffers.
+
+        Blocks for the first datagram, then drains whatever is already queued
+        without blocking. Returns memoryview slices over the pool buffers; they
+        are only valid until the pool is used again.
+        """
+        views = pool.views
+        n, _ = self.sock.recvfrom_into(views[0])
+        batch = [views[0][:n]]
+        if _MSG_DONTWAIT:
+            for view in views[1:]:
+                try:
+                    n = self.sock.recv_into(view, 0, _MSG_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                batch.append(view[:n])
+        return batch
+
     def send(self, message, destination_address):
         self.sock.sendto(message.encode(), destination_address)
 
     def close(self):
         self.sock.close()
 
+def listen_udp(address, count=1, reuse_port=False):
+    """Open ``count`` UDP sockets bound to the same address.
+
+    With more than one socket, or when ``reuse_port`` is set because other
+    processes bind the same address, SO_REUSEPORT is set so the kernel
+    spreads datagrams across them; platforms without it get a single socket.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        count = 1
+        reuse_port = False
+    bind_address = split_host_port(address)
+    conns = []
+    try:
+        for _ in range(max(count, 1)):
+            conns.append(UDPConn(bind_address, reuse_port=reuse_port or count > 1))
+    except OSError:
+        for conn in conns:
+            conn.close()
+        raise
+    return conns
+
 """ TCPConn """
 
 class TCPConn:
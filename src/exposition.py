@@ -0,0 +1,418 @@
+""" Incrementally maintained Prometheus text exposition of the sample store """
+import collections
+import functools
+import gzip
+import threading
+import zlib
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
+from prometheus_client.utils import INF, MINUS_INF
+import config
+from labelindex import LabelIndex, parse_selector
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HELP = "InfluxDB Metric"
+# Largest partition count a scrape may ask for, and how many partition
+# counts have their layouts kept up to date at once
+MAX_SHARDS = 256
+MAX_SHARD_LAYOUTS = 4
+
+TEXT = "text"
+OPENMETRICS = "openmetrics"
+CONTENT_TYPES = {TEXT: CONTENT_TYPE_LATEST, OPENMETRICS: OPENMETRICS_CONTENT_TYPE}
+
+IDENTITY = "identity"
+ENCODERS = {"gzip": lambda body: gzip.compress(body, config.metricsGzipLevel)}
+if zstandard is not None:
+    ENCODERS["zstd"] = lambda body: zstandard.ZstdCompressor(level=config.metricsZstdLevel).compress(body)
+# Preferred order when the client accepts several encodings with equal weight.
+ENCODING_PREFERENCE = ("zstd", "gzip", IDENTITY)
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@functools.lru_cache(maxsize=65536)
+def render_labels(labels):
+    """Render an interned label tuple as {k="v",...}; label sets are shared, so cache by tuple."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label_value(v)}"' for k, v in labels) + "}"
+
+
+def format_value(value):
+    """Format a sample value; Prometheus parses Python's shortest repr directly."""
+    if value != value:
+        return "NaN"
+    if value == INF:
+        return "+Inf"
+    if value == MINUS_INF:
+        return "-Inf"
+    return repr(value)
+
+
+def render_header(name, fmt=TEXT):
+    if fmt == OPENMETRICS:
+        return f"# HELP {name} {HELP}\n# TYPE {name} unknown\n"
+    return f"# HELP {name} {HELP}\n# TYPE {name} untyped\n"
+
+
+def render_series(sample, export_timestamp=False):
+    """Render one sample as a single exposition line."""
+    line = f"{sample.name}{render_labels(sample.labels)} {format_value(sample.value)}"
+    if export_timestamp:
+        line += f" {int(sample.timestamp * 1000)}"
+    return line + "\n"
+
+
+def _parse_weighted(header):
+    """Parse an Accept/Accept-Encoding header into {token: q}."""
+    weights = {}
+    for part in header.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+    return weights
+
+
+def negotiate_format(accept):
+    """Pick OpenMetrics when the scraper asks for it, the Prometheus text format otherwise."""
+    if not accept:
+        return TEXT
+    if _parse_weighted(accept).get("application/openmetrics-text", 0) > 0:
+        return OPENMETRICS
+    return TEXT
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best supported Content-Encoding for an Accept-Encoding header."""
+    if not accept_encoding:
+        return IDENTITY
+    weights = _parse_weighted(accept_encoding)
+    wildcard = weights.get("*", 0)
+    best, best_q = IDENTITY, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding != IDENTITY and encoding not in ENCODERS:
+            continue
+        q = weights.get(encoding, wildcard if encoding != IDENTITY else 0.001)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _openmetrics_line(line):
+    """Convert a text-format line with a millisecond timestamp to OpenMetrics seconds."""
+    head, _, ms = line.rstrip("\n").rpartition(" ")
+    return f"{head} {int(ms) / 1000}\n"
+
+
+class _Partition:
+    """Rendered lines, family chunks and bodies for one slice of the series.
+
+    ``put`` and ``drop`` record the touched families; ``commit`` marks them
+    dirty for every format and moves ``generation`` once per refresh.
+    """
+    def __init__(self):
+        self.lines = {}
+        self.generation = 0
+        self._chunks = {TEXT: {}, OPENMETRICS: {}}
+        self._dirty = {TEXT: set(), OPENMETRICS: set()}
+        self._bodies = {}
+        self._touched = set()
+
+    def put(self, name, sid, line):
+        lines = self.lines.get(name)
+        if lines is None:
+            lines = self.lines[name] = {}
+        lines[sid] = line
+        self._touched.add(name)
+
+    def drop(self, name, sid):
+        """Remove a series; returns whether it was present."""
+        lines = self.lines.get(name)
+        if lines is None or lines.pop(sid, None) is None:
+            return False
+        if not lines:
+            del self.lines[name]
+        self._touched.add(name)
+        return True
+
+    def commit(self):
+        """Publish the families touched since the last commit; returns them."""
+        touched = self._touched
+        if touched:
+            for names in self._dirty.values():
+                names.update(touched)
+            self._bodies.clear()
+            self.generation += 1
+            self._touched = set()
+        return touched
+
+    def body(self, fmt, render_chunk):
+        """Return the uncompressed body for ``fmt``, rebuilding only dirty family chunks."""
+        body = self._bodies.get(fmt)
+        if body is None:
+            chunks = self._chunks[fmt]
+            for name in self._dirty[fmt]:
+                lines = self.lines.get(name)
+                if lines:
+                    chunks[name] = render_chunk(fmt, name, lines)
+                else:
+                    chunks.pop(name, None)
+            self._dirty[fmt].clear()
+            body = b"".join(chunks[name] for name in sorted(chunks))
+            if fmt == OPENMETRICS:
+                body += b"# EOF\n"
+            self._bodies[fmt] = body
+        return body
+
+
+def series_shard(name, labels, count):
+    """Return the hash partition of a series out of ``count``.
+
+    A CRC-32 of the rendered series identity is stable across processes and
+    restarts, unlike ``hash``, so every replica splits series the same way.
+    """
+    return zlib.crc32((name + render_labels(labels)).encode()) % count
+
+
+class ExpositionCache:
+    """Keeps the rendered text of every series and re-renders only what changed.
+
+    Series are grouped into one family per metric name, so each name gets a
+    single HELP/TYPE header followed by all of its series. The store must be
+    created with ``track_changes=True``. Each scrape drains the per-shard
+    change logs, re-renders the dirty series and rebuilds only the family
+    chunks that changed; a scrape with no changes at all reuses the previous
+    body.
+
+    The same change logs maintain a copy-on-write view of the samples for
+    ``snapshot``: each family is an immutable tuple that is only rebuilt
+    when the family changed, so a snapshot costs a dict copy of the family
+    map and never holds a store lock.
+
+    Bodies are kept per exposition format and compressed payloads per
+    (format, encoding). Both are tagged with ``generation``, which moves
+    whenever the rendered data changes, so concurrent scrapers of an
+    unchanged store share a single render and compression pass. ``series``
+    counts the series rendered as of the last refresh.
+
+    ``render_selected`` answers ``match[]`` selectors from a LabelIndex
+    over the same series. It is built on the first filtered scrape and
+    kept up to date by every refresh from then on, so exporters that are
+    never scraped with selectors do not pay for it.
+
+    ``payload`` can also serve one of ``n`` hash partitions (see
+    ``series_shard``). The partitions for a given ``n`` are split out on
+    the first request for it and then maintained by every refresh like the
+    full body, so a partition scrape renders and compresses only its own
+    series. The layouts of the ``MAX_SHARD_LAYOUTS`` most recently used
+    partition counts are kept.
+    """
+    def __init__(self, store, export_timestamp=False):
+        self.store = store
+        self.export_timestamp = export_timestamp
+        self.series = 0
+        self._all = _Partition()
+        self._series = {}
+        self._families = {}
+        self._dirty_families = set()
+        self._index = None
+        self._layouts = collections.OrderedDict()
+        self._compressed = {}
+        self._compress_locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._all.generation
+
+    def refresh(self):
+        """Apply pending store changes; returns the number of series re-rendered or dropped."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        full = self._all
+        series = self._series
+        index = self._index
+        layouts = self._layouts
+        updated = 0
+        for shard in self.store.shards:
+            changes, removed, live = shard.drain_changes()
+            if live is not None:
+                removed = self._stale(shard, live)
+            for sid, (name, labels) in removed.items():
+                if full.drop(name, sid):
+                    samples = series[name]
+                    del samples[sid]
+                    if not samples:
+                        del series[name]
+                    self.series -= 1
+                    if index is not None:
+                        index.remove(sid, name, labels)
+                    for n, parts in layouts.items():
+                        parts[series_shard(name, labels, n)].drop(name, sid)
+            for sid, sample in changes.items():
+                name = sample.name
+                line = render_series(sample, self.export_timestamp)
+                full.put(name, sid, line)
+                samples = series.get(name)
+                if samples is None:
+                    samples = series[name] = {}
+                if sid not in samples:
+                    self.series += 1
+                    if index is not None:
+                        index.add(sid, name, sample.labels)
+                samples[sid] = sample
+                for n, parts in layouts.items():
+                    parts[series_shard(name, sample.labels, n)].put(name, sid, line)
+            updated += len(changes) + len(removed)
+        self._dirty_families.update(full.commit())
+        for parts in layouts.values():
+            for part in parts:
+                part.commit()
+        return updated
+
+    def _stale(self, shard, live):
+        """Return the cached series of ``shard`` not in ``live``, for a shard whose removal log overflowed."""
+        owner = self.store.shard_for
+        return {sid: (name, sample.labels)
+                for name, samples in self._series.items()
+                for sid, sample in samples.items()
+                if sid not in live and owner(sid) is shard}
+
+    def _layout(self, count):
+        """Return the ``count`` partitions, splitting them out on first use. Called with the lock held."""
+        parts = self._layouts.get(count)
+        if parts is not None:
+            self._layouts.move_to_end(count)
+            return parts
+        parts = [_Partition() for _ in range(count)]
+        for name, samples in self._series.items():
+            lines = self._all.lines[name]
+            for sid, sample in samples.items():
+                parts[series_shard(name, sample.labels, count)].put(name, sid, lines[sid])
+        for part in parts:
+            part.commit()
+        self._layouts[count] = parts
+        if len(self._layouts) > MAX_SHARD_LAYOUTS:
+            evicted, _ = self._layouts.popitem(last=False)
+            for key in [key for key in self._compressed if key[2] is not None and key[2][1] == evicted]:
+                del self._compressed[key]
+        return parts
+
+    def _render_chunk(self, fmt, name, lines):
+        if fmt == OPENMETRICS and self.export_timestamp:
+            body = "".join(_openmetrics_line(line) for line in lines.values())
+        else:
+            body = "".join(lines.values())
+        return (render_header(name, fmt) + body).encode()
+
+    def snapshot(self):
+        """Return a consistent {name: tuple of samples} view as of the latest store changes.
+
+        Samples are never modified once stored, so the view stays valid while
+        writers carry on; it is the caller's to iterate at leisure.
+        """
+        with self._lock:
+            self._refresh()
+            families = self._families
+            for name in self._dirty_families:
+                samples = self._series.get(name)
+                if samples:
+                    families[name] = tuple(samples.values())
+                else:
+                    families.pop(name, None)
+            self._dirty_families.clear()
+            return dict(families)
+
+    def render_selected(self, selectors, fmt=TEXT):
+        """Return (body, series) for the series matched by any of ``selectors``, uncompressed.
+
+        Raises ``labelindex.SelectorError`` for an invalid selector.
+        """
+        selectors = [parse_selector(selector) for selector in selectors]
+        with self._lock:
+            self._refresh()
+            index = self._index
+            if index is None:
+                index = self._index = LabelIndex()
+                for samples in self._series.values():
+                    for sid, sample in samples.items():
+                        index.add(sid, sample.name, sample.labels)
+            selected = set()
+            for matchers in selectors:
+                selected |= index.select(matchers)
+            families = {}
+            for sid in selected:
+                name = index.series[sid][0]
+                sids = families.get(name)
+                if sids is None:
+                    sids = families[name] = []
+                sids.append(sid)
+            parts = []
+            for name in sorted(families):
+                lines = self._all.lines[name]
+                parts.append(render_header(name, fmt))
+                if fmt == OPENMETRICS and self.export_timestamp:
+                    parts.extend(_openmetrics_line(lines[sid]) for sid in sorted(families[name]))
+                else:
+                    parts.extend(lines[sid] for sid in sorted(families[name]))
+        if fmt == OPENMETRICS:
+            parts.append("# EOF\n")
+        return "".join(parts).encode(), len(selected)
+
+    def render(self, fmt=TEXT, shard=None):
+        """Return the full uncompressed exposition body, or that of the (index, count) ``shard``, as bytes."""
+        with self._lock:
+            self._refresh()
+            return self._partition(shard).body(fmt, self._render_chunk)
+
+    def _partition(self, shard):
+        if shard is None:
+            return self._all
+        index, count = shard
+        if not 0 <= index < count <= MAX_SHARDS:
+            raise ValueError(f"invalid shard {index} of {count}")
+        return self._layout(count)[index]
+
+    def payload(self, fmt=TEXT, encoding=IDENTITY, shard=None):
+        """Return the body for ``fmt`` compressed with ``encoding``, compressing once per generation.
+
+        ``shard`` is an optional (index, count) pair selecting one hash partition.
+        """
+        with self._lock:
+            self._refresh()
+            part = self._partition(shard)
+            generation = part.generation
+            body = part.body(fmt, self._render_chunk)
+            if encoding == IDENTITY:
+                return body
+            key = (fmt, encoding, shard)
+            lock = self._compress_locks.get(key)
+            if lock is None:
+                lock = self._compress_locks[key] = threading.Lock()
+        with lock:
+            # A layout evicted and split out again restarts its generations.
+            cached = self._compressed.get(key)
+            if cached is not None and cached[0] is part and cached[1] >= generation:
+                return cached[2]
+            data = ENCODERS[encoding](body)
+            self._compressed[key] = (part, generation, data)
+            return data
@@ -0,0 +1,345 @@
+""" Minimal asyncio HTTP/1.1 server for the push, health and scrape endpoints """
+import asyncio
+import http
+import threading
+import urllib.parse
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+MAX_HEADER_LINES = 100
+# Longest request line or header line accepted, in bytes
+MAX_LINE = 64 * 1024
+
+
+class HTTPError(Exception):
+    """Abort the current request with ``status``."""
+    def __init__(self, status, msg=""):
+        super().__init__(msg or http.HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Headers(dict):
+    """Request headers with case-insensitive lookups."""
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class Request:
+    """A parsed request head.
+
+    ``form`` holds the first value of each query string parameter and
+    ``query`` every value, for repeated parameters such as ``match[]``.
+    """
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        path, _, query = target.partition("?")
+        self.path = urllib.parse.unquote(path)
+        self.query = urllib.parse.parse_qs(query, keep_blank_values=True)
+        self.form = {k: v[0] for k, v in self.query.items()}
+        self.body = b""
+        self.executor = None
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.1":
+            self.keep_alive = connection != "close"
+        else:
+            self.keep_alive = connection == "keep-alive"
+
+
+class Response:
+    """Collects the status, headers and body written by a handler."""
+    def __init__(self, status=200):
+        self.status = status
+        self.headers = {}
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data.encode() if isinstance(data, str) else data)
+
+    def send_response(self):
+        """Kept for handlers written against http.server; the response is sent when the handler returns."""
+
+
+class BodyStream:
+    """Reads one request body off the connection.
+
+    Handles Content-Length and chunked bodies and sends ``100 Continue``
+    only once the handler actually starts reading, so a request rejected
+    from its headers never has its body uploaded.
+    """
+    def __init__(self, reader, writer, length, chunked, expect_continue, timeout):
+        self._reader = reader
+        self._writer = writer
+        self._remaining = length
+        self._chunked = chunked
+        self._chunk_left = 0
+        self._continue = expect_continue
+        self._timeout = timeout
+        self.done = not chunked and not length
+
+    async def _wait(self, aw):
+        try:
+            return await asyncio.wait_for(aw, self._timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, "timed out reading request body") from None
+
+    async def _readline(self):
+        line = await self._wait(self._reader.readline())
+        if not line.endswith(b"\n"):
+            raise HTTPError(400, "truncated chunked body")
+        return line
+
+    async def _read_some(self, n):
+        data = await self._wait(self._reader.read(n))
+        if not data:
+            raise HTTPError(400, "truncated request body")
+        return data
+
+    async def read(self, n):
+        """Return up to ``n`` bytes of the body, or b"" once it is exhausted."""
+        if self.done:
+            return b""
+        if self._continue:
+            self._continue = False
+            self._writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await self._writer.drain()
+        if not self._chunked:
+            data = await self._read_some(min(n, self._remaining))
+            self._remaining -= len(data)
+            self.done = not self._remaining
+            return data
+        if not self._chunk_left:
+            line = await self._readline()
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise HTTPError(400, "invalid chunk size") from None
+            if size == 0:
+                # Skip trailers up to the terminating empty line.
+                while (await self._readline()).strip():
+                    pass
+                self.done = True
+                return b""
+            self._chunk_left = size
+        data = await self._read_some(min(n, self._chunk_left))
+        self._chunk_left -= len(data)
+        if not self._chunk_left:
+            await self._readline()
+        return data
+
+
+class SyncBody:
+    """File-like view of a BodyStream for handlers running in the executor."""
+    def __init__(self, stream, loop):
+        self._stream = stream
+        self._loop = loop
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            chunks = []
+            while True:
+                data = self.read(MAX_LINE)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+        return asyncio.run_coroutine_threadsafe(self._stream.read(n), self._loop).result()
+
+
+class HTTPServer:
+    """Routes exact request paths to ``handler(w, r)`` callables.
+
+    Handlers run in ``executor`` so parsing and compression never block the
+    event loop, and read the request body incrementally through ``r.body``.
+    A worker thread stays busy for as long as its client uploads, so routes
+    that must answer while slow writers hold every worker (scrapes) can
+    be given an executor of their own. Handlers registered with
+    ``inline=True`` are cheap and run on the loop; they must not read the
+    body. Coroutine handlers run on the loop too, and await ``r.body.read(n)``
+    themselves, passing CPU-bound work to ``r.executor``, so a slow upload
+    costs no thread. Connections are kept alive between
+    requests, and beyond ``max_connections`` new ones are answered with 503.
+    """
+    def __init__(self, logger, max_connections=1024, executor=None, idle_timeout=60, read_timeout=30):
+        self.logger = logger
+        self.max_connections = max_connections
+        self.executor = executor
+        self.idle_timeout = idle_timeout
+        self.read_timeout = read_timeout
+        self.routes = {}
+        self.default = (_not_found, True, None)
+        self.connections = 0
+        self.rejected = 0
+        self.responses = {}
+        self._stats_lock = threading.Lock()
+        self._server = None
+
+    def route(self, path, handler, inline=False, executor=None):
+        """Serve ``path`` with ``handler``, in ``executor`` if given instead of the shared one."""
+        self.routes[path] = (handler, inline, executor)
+
+    def route_default(self, handler, inline=False):
+        """Serve every path without its own route with ``handler``."""
+        self.default = (handler, inline, None)
+
+    async def start(self, host, port, reuse_port=False):
+        self._server = await asyncio.start_server(
+            self._serve, host or None, port, limit=MAX_LINE, reuse_port=reuse_port or None)
+        return self._server
+
+    async def serve_forever(self, host, port, reuse_port=False):
+        server = await self.start(host, port, reuse_port)
+        async with server:
+            await server.serve_forever()
+
+    async def _serve(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            try:
+                await self._send(writer, "GET", Response(503), False)
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            while await self._handle_one(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_head(self, reader):
+        """Read a request head; returns None when the client closes an idle connection."""
+        line = b"\r\n"
+        try:
+            # Tolerate stray empty lines between pipelined requests.
+            while line in (b"\r\n", b"\n"):
+                line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if not line:
+                return None
+            parts = line.decode("latin-1").split()
+            if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+                raise HTTPError(400, "malformed request line")
+            headers = Headers()
+            for _ in range(MAX_HEADER_LINES):
+                line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+                if line in (b"\r\n", b"\n"):
+                    return Request(parts[0], parts[1], parts[2], headers)
+                name, sep, value = line.decode("latin-1").partition(":")
+                if not sep:
+                    raise HTTPError(400, "malformed header line")
+                name = name.strip().lower()
+                value = value.strip()
+                if name in headers:
+                    value = headers[name] + ", " + value
+                dict.__setitem__(headers, name, value)
+        except ValueError:
+            # StreamReader raises ValueError for lines longer than MAX_LINE.
+            raise HTTPError(431) from None
+        raise HTTPError(431)
+
+    def _body_stream(self, request, reader, writer):
+        te = request.headers.get("Transfer-Encoding", "").lower()
+        if te and te != "chunked":
+            raise HTTPError(501, f"unsupported transfer encoding {te!r}")
+        length = 0
+        if not te:
+            cl = request.headers.get("Content-Length", "0")
+            if not cl.isdigit():
+                raise HTTPError(400, "invalid Content-Length")
+            length = int(cl)
+        expect = request.headers.get("Expect", "").lower() == "100-continue" and request.version == "HTTP/1.1"
+        return BodyStream(reader, writer, length, bool(te), expect, self.read_timeout)
+
+    async def _handle_one(self, reader, writer):
+        """Serve one request; returns whether the connection can be reused."""
+        try:
+            request = await self._read_head(reader)
+            if request is None:
+                return False
+            stream = self._body_stream(request, reader, writer)
+        except HTTPError as e:
+            await self._send(writer, "GET", _error(e), False)
+            return False
+
+        handler, inline, executor = self.routes.get(request.path, self.default)
+        response = Response()
+        loop = asyncio.get_running_loop()
+        request.body = SyncBody(stream, loop)
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                request.body = stream
+                request.executor = executor or self.executor
+                await handler(response, request)
+            elif inline:
+                handler(response, request)
+            else:
+                await loop.run_in_executor(executor or self.executor, handler, response, request)
+        except HTTPError as e:
+            response = _error(e)
+        except Exception as err:
+            self.logger.error("msg", "Error handling request", "path", request.path, "err", err)
+            response = Response(500)
+        # An unread body would be parsed as the next request, so close instead.
+        keep_alive = request.keep_alive and stream.done
+        await self._send(writer, request.method, response, keep_alive)
+        return keep_alive
+
+    async def _send(self, writer, method, response, keep_alive):
+        status = response.status
+        with self._stats_lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+        body = b"".join(response.chunks)
+        try:
+            phrase = http.HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ""
+        head = [f"HTTP/1.1 {status} {phrase}"]
+        head.extend(f"{k}: {v}" for k, v in response.headers.items() if k.lower() != "content-length")
+        if status != 204 and status != 304:
+            head.append(f"Content-Length: {len(body)}")
+        head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if body and method != "HEAD" and status != 204 and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+
+def _not_found(w, r):
+    w.status = 404
+
+
+def _error(e):
+    response = Response(e.status)
+    response.headers["Content-Type"] = "text/plain; charset=utf-8"
+    response.write(str(e) + "\n")
+    return response
+
+
+class ServerCollector:
+    """Exports connection and response counts of an HTTPServer."""
+    def __init__(self, server):
+        self.server = server
+
+    def collect(self):
+        server = self.server
+        yield GaugeMetricFamily(
+            "influxdb_http_connections", "Open HTTP connections.", value=server.connections)
+        yield CounterMetricFamily(
+            "influxdb_http_connections_rejected", "HTTP connections rejected at the connection limit.",
+            value=server.rejected)
+        responses = CounterMetricFamily(
+            "influxdb_http_responses", "HTTP responses sent by status code.", labels=["code"])
+        with server._stats_lock:
+            counts = sorted(server.responses.items())
+        for code, count in counts:
+            responses.add_metric([str(code)], count)
+        yield responses
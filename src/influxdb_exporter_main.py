@@ -1,20 +1,34 @@
-import gzip
+import argparse
+import asyncio
+import concurrent.futures
 import json
+import labelindex
+import logging
+import multiprocessing
 import prometheus_client.core
-import string
 import threading
 import time
 import prometheus_client
-from prometheus_client import Gauge, Counter, REGISTRY, CollectorRegistry, push_to_gateway, Summary
-from prometheus_client.utils import INF
-import logging
-import kingpin
-import json
-import os
-import fmt
-import http
+import prometheus_client.openmetrics.exposition
+from prometheus_client import Gauge, Counter, Histogram, REGISTRY, CollectorRegistry
+import sys
+import cardinality
+import columnar
 import connections, config
-import doqu
+import ingestqueue
+import httpserver
+import kvlog
+import lineprotocol
+import multiingest
+import preaggregate
+import profiling
+import relabel
+import writebody
+import exposition
+import samplestore
+import sanitize
+from sanitize import replace_invalid_chars
+from series import InfluxDBSample, LabelSetTable
 
 
 lastPush = Gauge(
@@ -25,18 +39,136 @@ udpParseErrors = Counter(
     "influxdb_udp_parse_errors_total",
     "Current total udp parse errors."
 )
-influxDbRegistry = REGISTRY
+udpSocketPackets = Counter(
+    "influxdb_udp_socket_packets_total",
+    "Total udp packets received per listener socket.",
+    ["socket"]
+)
+udpSocketBytes = Counter(
+    "influxdb_udp_socket_bytes_total",
+    "Total udp payload bytes received per listener socket.",
+    ["socket"]
+)
+udpSocketParseErrors = Counter(
+    "influxdb_udp_socket_parse_errors_total",
+    "Total udp parse errors per listener socket.",
+    ["socket"]
+)
+udpSocketErrors = Counter(
+    "influxdb_udp_socket_errors_total",
+    "Total udp datagrams that failed with an unexpected error per listener socket.",
+    ["socket"]
+)
+ingestQueueDepth = Gauge(
+    "influxdb_ingest_queue_depth",
+    "Samples waiting in the ingest queue."
+)
+ingestQueueHighWater = Gauge(
+    "influxdb_ingest_queue_high_water_mark",
+    "Highest ingest queue depth seen since start."
+)
+ingestQueueCapacity = Gauge(
+    "influxdb_ingest_queue_capacity",
+    "Configured capacity of the ingest queue."
+)
+columnarFallbackBuffers = Counter(
+    "influxdb_columnar_fallback_buffers_total",
+    "Write buffers and datagrams the columnar parser handed to the point parser."
+)
+ingestDroppedSamples = Counter(
+    "influxdb_ingest_dropped_samples_total",
+    "Samples dropped because the ingest queue was full."
+)
+# Buckets for the self-instrumentation histograms, sized for sub-millisecond hot paths
+latencyBuckets = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+countBuckets = (1, 10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+storeWriteSeconds = Histogram(
+    "influxdb_store_write_seconds",
+    "Time to write one ingest batch into the sample store, including waiting for shard locks.",
+    buckets=latencyBuckets
+)
+storeLockWaitSeconds = Histogram(
+    "influxdb_store_lock_wait_seconds",
+    "Time spent waiting for a contended sample store shard lock.",
+    buckets=latencyBuckets
+)
+expirySweepSeconds = Histogram(
+    "influxdb_store_expiry_sweep_seconds",
+    "Duration of each expiry sweep of the sample store.",
+    buckets=latencyBuckets
+)
+expiredSeries = Counter(
+    "influxdb_store_expired_series_total",
+    "Series removed from the sample store by expiry sweeps."
+)
+writeRequestBytes = Histogram(
+    "influxdb_write_request_bytes",
+    "Body size of each write request in bytes, before decompression.",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+)
+writeDecompressSeconds = Histogram(
+    "influxdb_write_decompress_seconds",
+    "Time spent decompressing each write request body.",
+    buckets=latencyBuckets
+)
+writeParseSeconds = Histogram(
+    "influxdb_write_parse_seconds",
+    "Time spent parsing each write request body into queued samples, excluding reading and decompressing it.",
+    buckets=latencyBuckets
+)
+writeRequestPoints = Histogram(
+    "influxdb_write_request_points",
+    "Points parsed from each successful write request.",
+    buckets=countBuckets
+)
+writeRequestSamples = Histogram(
+    "influxdb_write_request_samples",
+    "Samples queued from each successful write request.",
+    buckets=countBuckets
+)
+collectSeconds = Histogram(
+    "influxdb_collect_seconds",
+    "Time to produce the pushed series for one scrape, by handler.",
+    ["handler"],
+    buckets=latencyBuckets
+)
+collectSeries = Gauge(
+    "influxdb_collect_series",
+    "Pushed series emitted by the latest scrape, by handler.",
+    ["handler"]
+)
+storeSeries = Gauge(
+    "influxdb_store_series",
+    "Series currently held in the sample store."
+)
+storeEstimatedBytes = Gauge(
+    "influxdb_store_estimated_bytes",
+    "Approximate memory used by the stored series in bytes."
+)
+storeMemoryBudget = Gauge(
+    "influxdb_store_memory_budget_bytes",
+    "Configured memory budget for stored series in bytes, 0 when unlimited."
+)
+storeEvictedSeries = Counter(
+    "influxdb_store_evicted_series_total",
+    "Series evicted, least recently updated first, to stay within the memory budget."
+)
+REGISTRY.register(sanitize.CacheCollector())
+decodeCollector = writebody.DecodeCollector()
+REGISTRY.register(decodeCollector)
+# Self-metrics updated wherever points are received and parsed. Ingest worker
+# processes ship their copies to the main process, which serves them with a
+# worker label (see multiingest.WorkerMetricsCollector).
+workerMetrics = (
+    lastPush, udpParseErrors, udpSocketPackets, udpSocketBytes, udpSocketParseErrors, udpSocketErrors,
+    columnarFallbackBuffers, writeRequestBytes, writeDecompressSeconds, writeParseSeconds,
+    writeRequestPoints, writeRequestSamples, decodeCollector,
+)
+# Pushed samples are kept apart from the exporter's own metrics, which
+# exporterMetricsPath serves from the default REGISTRY.
+influxDbRegistry = CollectorRegistry()
 
 """ We use the prometheus_client library to define metrics """
-class InfluxDBSample:
-    """Represents a sample from InfluxDB."""
-    def __init__(self, name, timestamp, value, labels):
-        self.ID = ""
-        self.Name = ""
-        self.Labels = {}
-        self.Value = 0.0
-        self.Timestamp = time.time()
-
 class InfluxV2Health:
     """Represents health information for InfluxDB v2."""
     def __init__(self):
@@ -55,137 +187,420 @@ class ErrorResponse:
 class InfluxDBCollector:
     """Collector for InfluxDB metrics."""
     def __init__(self, logger):
-        self.samples = {}
-        self.mu = threading.Lock()
-        # self.mu = threading.sync.Mutex()
-        self.ch = []
+        self.samples = samplestore.ShardedSampleStore(
+            config.sampleStoreShards, config.expiryBucketSeconds, track_changes=True,
+            memory_budget=config.memoryBudgetBytes, low_water=config.memoryBudgetLowWater,
+            on_lock_wait=storeLockWaitSeconds.observe, removed_limit=config.removedLogLimit)
+        self.exposition = exposition.ExpositionCache(self.samples, config.exportTimestamp)
+        self.labelsets = LabelSetTable(replace_invalid_chars)
+        self.limiter = None
+        if config.seriesLimitPerMetric or config.seriesLimitOverrides or config.seriesLimitGlobal or config.cardinalityTopK:
+            self.limiter = cardinality.CardinalityLimiter(
+                self.samples, config.seriesLimitPerMetric, config.seriesLimitOverrides,
+                config.seriesLimitGlobal, config.cardinalityTopK)
+        self.rules = preaggregate.RuleSet(config.aggregationRules) if config.aggregationRules else None
+        self.relabeler = relabel.Relabeler(config.relabelRules) if config.relabelRules else None
+        self.columns = None
+        # Relabel rules on __field__ need each field as a point of its own.
+        if config.columnarIngest and not (self.relabeler is not None and self.relabeler.per_field):
+            self.columns = columnar.ColumnParser(self.labelsets, replace_invalid_chars, self.relabeler)
+        self.ch = ingestqueue.IngestQueue(config.ingestQueueCapacity, config.ingestQueuePolicy)
         self.logger = logger
-        self.conn = None
-        # self.conn = connections.UDPConn()
+        ingestQueueDepth.set_function(self.ch.__len__)
+        ingestQueueHighWater.set_function(lambda: self.ch.high_water)
+        ingestQueueCapacity.set(self.ch.capacity)
+        storeSeries.set_function(self.samples.__len__)
+        storeEstimatedBytes.set_function(lambda: self.samples.estimated_bytes)
+        storeMemoryBudget.set(config.memoryBudgetBytes)
+        self.conns = []
+        self.workers = []
+        self.aggregator = None
 
     @classmethod
     def new_influxdb_collector(cls, logger):
         """Create a new InfluxDBCollector instance."""
         c = cls(logger)
-        threading.Thread(target=c.process_samples).start()
+        for i in range(config.ingestWorkers):
+            threading.Thread(target=c.process_samples, name=f"ingest-{i}", daemon=True).start()
+        threading.Thread(target=c.expire_samples, name="expiry", daemon=True).start()
         return c
 
-    def influxdb_post(self, w, r):
+    def serve_udp(self, conn, socket_id):
+        """Receive and parse datagrams from one UDP socket."""
+        packets = udpSocketPackets.labels(socket_id)
+        nbytes = udpSocketBytes.labels(socket_id)
+        parse_errors = udpSocketParseErrors.labels(socket_id)
+        errors = udpSocketErrors.labels(socket_id)
+        pool = connections.BufferPool(config.udpBatchSize)
+        while True:
+            try:
+                batch = conn.receive_batch(pool)
+            except OSError as err:
+                self.logger.warning("msg", "Failed to read UDP message", "socket", socket_id, "err", err)
+                continue
+            packets.inc(len(batch))
+            now = time.time_ns()
+            for data in batch:
+                nbytes.inc(len(data))
+                try:
+                    if self.columns is not None:
+                        self.parse_buffers_to_samples((data,), "ns", now)
+                    else:
+                        self.parse_points_to_sample(lineprotocol.parse_points(data, "ns", now))
+                except lineprotocol.LineProtocolError as err:
+                    self.logger.error("msg", "Error parsing udp packet", "socket", socket_id, "err", err)
+                    udpParseErrors.inc()
+                    parse_errors.inc()
+                except Exception as err:
+                    self.logger.error("msg", "Failed to handle udp packet", "socket", socket_id, "err", repr(err))
+                    errors.inc()
+
+    def start_udp_listeners(self, address, count, reuse_port=False):
+        """Open ``count`` SO_REUSEPORT sockets on ``address`` with a worker thread each."""
+        self.conns = connections.listen_udp(address, count, reuse_port)
+        for i, conn in enumerate(self.conns):
+            threading.Thread(target=self.serve_udp, args=(conn, str(i)), name=f"udp-{i}", daemon=True).start()
+        return self.conns
+
+    def start_ingest_workers(self, count):
+        """Hand the UDP listeners and parsing to ``count`` worker processes.
+
+        Each worker ships its parsed samples over a pipe; one aggregator
+        thread per worker feeds them into this process's ingest queue.
+        """
+        ctx = multiprocessing.get_context("spawn")
+        self.aggregator = multiingest.Aggregator(self._admit_batch, self.labelsets.intern, self.logger)
+        for i in range(count):
+            recv, send = ctx.Pipe(duplex=False)
+            worker = ctx.Process(
+                target=run_ingest_worker, args=(i, send, config.bindAddress, config.ingestHttpAddress),
+                name=f"ingest-worker-{i}", daemon=True)
+            worker.start()
+            send.close()
+            self.aggregator.attach(i, recv)
+            self.workers.append(worker)
+        return self.aggregator
+
+    async def influxdb_post(self, w, r):
         """Handle the InfluxDB metrics POST request."""
         lastPush.set(float(time.time()))
 
-        buf = []
-        ce = r.headers.get("Content-Encoding")
-        if ce == "gzip":
-            gunzip = gzip.GzipFile(fileobj=r.body)
-            buf = gunzip.read()
-        else:
-            buf = r.body
+        length = r.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > config.maxWriteBodySize:
+            json_error_response(w, f"request body exceeds {config.maxWriteBodySize} bytes", 413)
+            return
 
         precision = "ns"
         if "precision" in r.form:
             precision = r.form.get("precision")
 
+        stats = writebody.BodyStats()
         try:
-            points =  doqu. parse_points_with_precision(buf, time.time(), precision)
-        except Exception as e:
-            json_error_response(w, f"error parsing request: {e}", 400)
+            decoder = writebody.BodyDecoder(
+                r.headers.get("Content-Encoding"), config.maxWriteBodySize, config.writeChunkSize, stats)
+        except writebody.UnsupportedEncoding as e:
+            json_error_response(w, str(e), 415)
             return
 
-        self.parse_points_to_sample(points)
+        # The body is read and decompressed chunk by chunk on the event loop,
+        # and only buffers of whole lines go to the executor to be parsed and
+        # queued, so a slow client holds no worker thread and a large write
+        # never sits in memory whole.
+        loop = asyncio.get_running_loop()
+        now = time.time_ns()
+        npoints = nsamples = lineno = 0
+        start = time.perf_counter()
+        try:
+            lineprotocol.precision_multiplier(precision)
+            async for buf in self._line_buffers(r.body, decoder, stats):
+                points, samples, lineno = await loop.run_in_executor(
+                    r.executor, self._parse_buffer, buf, precision, now, lineno)
+                npoints += points
+                nsamples += samples
+            writeRequestPoints.observe(npoints)
+            writeRequestSamples.observe(nsamples)
+        except writebody.BodyTooLarge as e:
+            json_error_response(w, str(e), 413)
+            return
+        except writebody.DecodeError as e:
+            json_error_response(w, f"error decompressing request: {e}", 400)
+            return
+        except lineprotocol.LineProtocolError as e:
+            json_error_response(w, f"error parsing request: {e}", 400)
+            return
+        finally:
+            decoder.close()
+            self._observe_write(stats, time.perf_counter() - start)
 
         w.status = 204
         w.send_response()
 
+    @staticmethod
+    async def _line_buffers(body, decoder, stats):
+        """Read ``body``, decode it and yield buffers of whole lines, timing the reads in ``stats``."""
+        lines = lineprotocol.LineSplitter(config.maxWriteLineSize)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            data = await body.read(config.writeChunkSize)
+            stats.read_seconds += clock() - start
+            for piece in decoder.decode(data) if data else decoder.finish():
+                buf = lines.feed(piece)
+                if buf is not None:
+                    yield buf
+            if not data:
+                break
+        buf = lines.close()
+        if buf is not None:
+            yield buf
+
+    @staticmethod
+    def _observe_write(stats, elapsed):
+        """Record the size and stage timings of one write body."""
+        writeRequestBytes.observe(stats.bytes_in)
+        writeDecompressSeconds.observe(stats.seconds)
+        writeParseSeconds.observe(max(elapsed - stats.seconds - stats.read_seconds, 0.0))
+
     def parse_points_to_sample(self, points):
-        """Parse InfluxDB points and convert them to samples."""
-        for s in points:
-            fields = s.fields()
+        """Turn (name, tags, fields, ts) points into queued samples; returns (points read, samples queued)."""
+        npoints = nsamples = 0
+        batch = []
+        batch_size = config.ingestBatchSize
+        overrides = config.sampleExpiryOverrides
+        limiter = self.limiter
+        rules = self.rules
+        relabeler = self.relabeler
+        if relabeler is not None and relabeler.per_field:
+            points = self._relabel_fields(relabeler, points)
+            relabeler = None
+        for measurement, tags, fields, ts in points:
+            npoints += 1
+            if relabeler is not None:
+                relabeled = relabeler.relabel(measurement, tuple(tags))
+                if relabeled is None:
+                    continue
+                measurement, tags, _ = relabeled
+            timestamp = ts / 1e9
+            expires = timestamp + overrides.get(measurement, config.sampleExpiry)
+            labels = self.labelsets.intern(tags)
             for field, v in fields.items():
                 value = None
-                if isinstance(v, float):
+                if isinstance(v, bool):
+                    value = 1.0 if v else 0.0
+                elif isinstance(v, float):
                     value = v
                 elif isinstance(v, int):
                     value = float(v)
-                elif isinstance(v, bool):
-                    value = 1 if v else 0
                 else:
                     continue
 
-                name = s.name if field == "value" else s.name + "_" + field
-                name = replace_invalid_chars(name)
-
-                sample = influxDBSample(
-                    name=name,
-                    timestamp=s.time,
-                    value=value,
-                    labels={},
-                )
-
-                for tag in s.tags:
-                    key = tag.key
-                    value = tag.value
-                    if key == "__name__":
-                        continue
-                    key = replace_invalid_chars(key)
-                    sample.labels[key] = value
-
-                label_names = sorted(sample.labels)
-                parts = [name] + sum([[l, sample.labels[l]] for l in label_names], [])
-                sample.id = ".".join(parts)
+                name = measurement if field == "value" else measurement + "_" + field
+                name = sys.intern(replace_invalid_chars(name))
+                if rules is not None and not self._aggregate(rules, batch, name, labels, value, timestamp, expires):
+                    continue
+                if limiter is not None and not limiter.admit(name, labels, measurement):
+                    continue
 
-                self.ch.put(sample)
+                batch.append(InfluxDBSample(name, timestamp, value, labels, expires))
+
+            if len(batch) >= batch_size:
+                nsamples += len(batch)
+                self._enqueue(batch)
+                batch = []
+        nsamples += len(batch)
+        self._enqueue(batch)
+        return npoints, nsamples
+
+    def parse_buffers_to_samples(self, buffers, precision, now):
+        """Parse line-aligned line protocol ``buffers`` column-wise and queue their samples.
+
+        Each buffer becomes one batch (see ``columnar.ColumnParser``); a
+        buffer the columnar parser hands back goes through
+        ``parse_points_to_sample`` instead. Batches then pass aggregation
+        rules and cardinality limits as ingest worker batches do, so heavy
+        hitters are tracked by metric name. Returns the number of points
+        read and samples queued.
+        """
+        npoints = nsamples = lineno = 0
+        for buf in buffers:
+            points, samples, lineno = self._parse_buffer(buf, precision, now, lineno)
+            npoints += points
+            nsamples += samples
+        return npoints, nsamples
+
+    def _parse_buffer(self, buf, precision, now, lineno):
+        """Parse and queue one line-aligned buffer whose lines are numbered from ``lineno + 1``.
+
+        Returns the number of points read, samples queued and the last line.
+        """
+        if self.columns is not None:
+            multiplier = lineprotocol.precision_multiplier(precision)
+            batch, last = self.columns.parse(
+                buf, multiplier, now, config.sampleExpiry, config.sampleExpiryOverrides, lineno)
+            if batch is not None:
+                return batch.points, self._admit_batch(batch.samples()), last
+            columnarFallbackBuffers.inc()
+        last = lineno
+
+        def points():
+            nonlocal last
+            last = yield from lineprotocol.parse_points(buf, precision, now, lineno)
+
+        npoints, nsamples = self.parse_points_to_sample(points())
+        return npoints, nsamples, last
+
+    @staticmethod
+    def _relabel_fields(relabeler, points):
+        """Relabel each field of each point, for rules that read or write ``__field__``.
+
+        Yields one point per distinct (measurement, tags) the fields of a
+        point end up under, so those points count once per such group.
+        """
+        for measurement, tags, fields, ts in points:
+            tags = tuple(tags)
+            groups = {}
+            for field, v in fields.items():
+                relabeled = relabeler.relabel(measurement, tags, field)
+                if relabeled is None:
+                    continue
+                m, t, f = relabeled
+                groups.setdefault((m, t), {})[f] = v
+            for (m, t), group in groups.items():
+                yield m, t, group, ts
+
+    @staticmethod
+    def _aggregate(rules, batch, name, labels, value, timestamp, expires):
+        """Fold a sample into the matching aggregation rules, appending their outputs to ``batch``.
+
+        Returns whether the raw sample should still be stored.
+        """
+        keep = True
+        for rule in rules.rules_for(name):
+            batch.append(rule.add(name, labels, value, timestamp, expires))
+            keep = keep and not rule.drop_raw
+        return keep
+
+    def _admit_batch(self, batch):
+        """Queue samples parsed by an ingest worker through aggregation and limits; returns the number queued."""
+        rules = self.rules
+        if rules is not None:
+            raw, batch = batch, []
+            for s in raw:
+                if self._aggregate(rules, batch, s.name, s.labels, s.value, s.timestamp, s.expires):
+                    batch.append(s)
+        limiter = self.limiter
+        if limiter is not None:
+            batch = [s for s in batch if limiter.admit(s.name, s.labels, s.name)]
+        self._enqueue(batch)
+        return len(batch)
+
+    def _enqueue(self, batch):
+        dropped = self.ch.put_many(batch)
+        if dropped:
+            ingestDroppedSamples.inc(dropped)
 
     def process_samples(self):
-        """Process collected samples."""
+        """Drain the ingest queue into the sample store, evicting series beyond the memory budget."""
+        while True:
+            number, batch = self.ch.get_numbered_batch(config.ingestBatchSize)
+            if batch:
+                start = time.perf_counter()
+                self.samples.upsert_many(batch, number)
+                evicted = self.samples.enforce_budget()
+                storeWriteSeconds.observe(time.perf_counter() - start)
+                if evicted:
+                    storeEvictedSeries.inc(evicted)
+
+    def expire_samples(self):
+        """Drop expired samples every expiry bucket."""
         ticker = threading.Event()
         while True:
-            if ticker.wait(60):
-                age_limit = time.time() - sampleExpiry.total_seconds()
-                with self.mu:
-                    self.samples = {k: v for k, v in self.samples.items() if v.timestamp >= age_limit}
+            if not ticker.wait(config.expiryBucketSeconds):
+                start = time.perf_counter()
+                expired = self.samples.expire(time.time())
+                expirySweepSeconds.observe(time.perf_counter() - start)
+                expiredSeries.inc(expired)
+                if self.rules is not None:
+                    self._enqueue(self.rules.expire(time.time()))
+                if self.limiter is not None:
+                    self.limiter.reset_pending()
 
     def collect(self):
-        """Collect metrics."""
-        yield lastPush
-
-        with self.mu:
-            samples = list(self.samples.values())
-
-        age_limit = time.time() - sampleExpiry.total_seconds()
-        for sample in samples:
-            if sample.timestamp < age_limit:
-                continue
-
-            metric = prometheus_client.core.Metric(
-                sample.name,
-                "InfluxDB Metric",
-                [],
-                sample.labels,
-                prometheus_client.core.UntypedMetricFamily,
-                sample.value,
-            )
-
-            if exportTimestamp:
-                metric = prometheus_client.core.Metric(sample.timestamp, metric)
-
+        """Collect metrics, one family per metric name, from a snapshot of the store."""
+        start = time.perf_counter()
+        series = 0
+        yield from lastPush.collect()
+
+        for name, samples in self.exposition.snapshot().items():
+            metric = prometheus_client.core.Metric(name, exposition.HELP, "untyped")
+            for sample in samples:
+                timestamp = sample.timestamp if config.exportTimestamp else None
+                metric.add_sample(name, dict(sample.labels), sample.value, timestamp)
+            series += len(samples)
             yield metric
+        collectSeconds.labels("collect").observe(time.perf_counter() - start)
+        collectSeries.labels("collect").set(series)
 
     def describe(self):
         """Describe the metrics."""
-        yield lastPush
-
-def replace_invalid_chars(s):
-    """Replace invalid characters in a string."""
-    for i, char in enumerate(s):
-        char_int = ord(char)
-        if not (97 <= char_int <= 122 or 65 <= char_int <= 90 or 48 <= char_int <= 57 or char_int == 95):
-            s = s[:i] + "_" + s[i+1:]
-
-    if 48 <= ord(s[0]) <= 57:
-        s = "_" + s
+        yield from lastPush.describe()
+
+    def metrics_handler(self, w, r):
+        """Serve metricsPath from the exposition cache, honouring Accept, Accept-Encoding, match[] and shard."""
+        start = time.perf_counter()
+        fmt = exposition.negotiate_format(r.headers.get("Accept", ""))
+        encoding = exposition.negotiate_encoding(r.headers.get("Accept-Encoding", ""))
+        selectors = r.query.get("match[]")
+        if selectors:
+            self._selected_metrics(w, selectors, fmt, encoding)
+            collectSeconds.labels("match").observe(time.perf_counter() - start)
+            return
+        shard = _shard_param(r)
+        if shard is not None and shard[0] != 0:
+            head = b""
+        elif fmt == exposition.OPENMETRICS:
+            head = prometheus_client.openmetrics.exposition.generate_latest(lastPush)[:-len(b"# EOF\n")]
+        else:
+            head = prometheus_client.generate_latest(lastPush)
+        if encoding != exposition.IDENTITY:
+            if head:
+                head = exposition.ENCODERS[encoding](head)
+            w.headers["Content-Encoding"] = encoding
+        w.headers["Content-Type"] = exposition.CONTENT_TYPES[fmt]
+        w.headers["Vary"] = "Accept, Accept-Encoding"
+        w.status = 200
+        w.write(head + self.exposition.payload(fmt, encoding, shard))
+        if shard is None:
+            collectSeconds.labels("metrics").observe(time.perf_counter() - start)
+            collectSeries.labels("metrics").set(self.exposition.series)
+        else:
+            collectSeconds.labels("shard").observe(time.perf_counter() - start)
 
-    return s
+    def _selected_metrics(self, w, selectors, fmt, encoding):
+        try:
+            body, series = self.exposition.render_selected(selectors, fmt)
+        except labelindex.SelectorError as e:
+            raise httpserver.HTTPError(400, str(e)) from None
+        if encoding != exposition.IDENTITY:
+            body = exposition.ENCODERS[encoding](body)
+            w.headers["Content-Encoding"] = encoding
+        w.headers["Content-Type"] = exposition.CONTENT_TYPES[fmt]
+        w.headers["Vary"] = "Accept, Accept-Encoding"
+        w.status = 200
+        w.write(body)
+        collectSeries.labels("match").set(series)
+
+def _shard_param(r):
+    """Return the (index, count) partition asked for with shard=i&of=n, or None."""
+    if "shard" not in r.form and "of" not in r.form:
+        return None
+    try:
+        index, count = int(r.form.get("shard", "")), int(r.form.get("of", ""))
+    except ValueError:
+        raise httpserver.HTTPError(400, "shard and of must both be integers") from None
+    if not 0 <= index < count <= exposition.MAX_SHARDS:
+        raise httpserver.HTTPError(400, f"shard must be in [0, of) and of in [1, {exposition.MAX_SHARDS}]")
+    return index, count
 
 def json_error_response(w, err, code):
     """Send a JSON error response."""
@@ -202,82 +617,167 @@ def init():
     # influxDbRegistry.MustRegister(version.NewCollector("influxdb_exporter"))
     # influxDbRegistry.MustRegister(udpParseErrors)
 
-def main():
-    """Main function for the InfluxDB exporter."""
-    """ Entry point for the influxDB exporter. It initializes configurations, sets up logging, creates the influxDB collector. Registers it.
-    sets up UDP listener, and configures various end points. Finally, it starts the HTTP server and logs any errors"""
-    promlogConfig = promlog.Config()
-    kingpin.CommandLine().add_flags(promlogConfig)
-    kingpin.HelpFlag().short('h')
-    kingpin.Parse()
-
-    logger = promlog.New(promlogConfig)
-    logger.info("msg", "Starting influxdb_exporter", "version", version.Info())
-    logger.info("msg", "Build context", "context", version.BuildContext())
-
-    c = InfluxDBCollector.new_influxdb_collector(logger)
-    influxDbRegistry.register(c)
-
-    addr = net.ResolveUDPAddr("udp", bindAddress)
-    try:
-        conn = net.ListenUDP("udp", addr)
-    except Exception as err:
-        fmt.Printf("Failed to set up UDP listener at address %s: %s", addr, err)
-        os.Exit(1)
-
-    c.conn = conn
-    c.serveUdp()
-
-    http.HandleFunc("/write", c.influxdb_post)
-    http.HandleFunc("/api/v2/write", c.influxdb_post)
+def run_ingest_worker(worker, conn, udp_address, http_address):
+    """Entry point of an ingest worker process.
+
+    Parses UDP datagrams (and /write requests when ``http_address`` is set)
+    with the same code as the single-process exporter, but its queue ships
+    sample batches to the main process instead of a local store.
+    """
+    logger = kvlog.KeyValueLogger(f"influxdb_exporter.worker{worker}")
+    c = InfluxDBCollector(logger)
+    c.limiter = None
+    c.rules = None
+    c.ch = multiingest.ShippingQueue(
+        conn, worker, config.ingestBatchSize, config.ingestShipLinger,
+        lambda: [family for metric in workerMetrics for family in metric.collect()], config.ingestMetricsInterval)
+    c.start_udp_listeners(udp_address, 1, reuse_port=True)
+    if not http_address:
+        threading.Event().wait()
+    server = httpserver.HTTPServer(
+        logger, config.httpMaxConnections,
+        concurrent.futures.ThreadPoolExecutor(config.httpWorkers, thread_name_prefix="http"),
+        config.httpIdleTimeout, config.httpReadTimeout)
+    server.route("/write", c.influxdb_post)
+    server.route("/api/v2/write", c.influxdb_post)
+    host, port = connections.split_host_port(http_address)
+    asyncio.run(server.serve_forever(host, port, reuse_port=True))
+
+def new_http_server(c, logger):
+    """Route the push, query, health and metrics endpoints to an asyncio HTTP server."""
+    server = httpserver.HTTPServer(
+        logger, config.httpMaxConnections,
+        concurrent.futures.ThreadPoolExecutor(config.httpWorkers, thread_name_prefix="http"),
+        config.httpIdleTimeout, config.httpReadTimeout)
+    server.route("/write", c.influxdb_post)
+    server.route("/api/v2/write", c.influxdb_post)
 
     def query_handler(w, r):
         """Handler for the /query endpoint."""
+        w.headers["Content-Type"] = "application/json"
         w.write('{"results": []}')
-    http.HandleFunc("/query", query_handler)
+    server.route("/query", query_handler, inline=True)
 
     def api_query_handler(w, r):
         """Handler for the /api/v2/query endpoint."""
         w.write('')
-    http.HandleFunc("/api/v2/query", api_query_handler)
+    server.route("/api/v2/query", api_query_handler, inline=True)
 
     def ping_handler(w, r):
         """Handler for the /ping endpoint."""
-        verbose = r.URL.Query().Get("verbose")
+        verbose = r.form.get("verbose", "")
 
         if verbose != "" and verbose != "0" and verbose != "false":
-            b, _ = json.dumps.get("version")
-            w.Write(b)
+            w.headers["Content-Type"] = "application/json"
+            w.write(json.dumps({"version": config.Influxdb_Version}))
         else:
-            w.Header().Set("X-Influxdb-Version", config.Influxdb_Version)
-            w.WriteHeader(http.StatusNoContent)
-    http.HandleFunc("/ping", ping_handler)
+            w.headers["X-Influxdb-Version"] = config.Influxdb_Version
+            w.status = 204
+    server.route("/ping", ping_handler, inline=True)
 
     def health_handler(w, r):
         """Handler for the /health endpoint."""
-        health = {
-            "Checks": [],
-            "Version": version.Version,
-            "Status": "pass",
-            "Commit": version.Revision
-        }
-        w.WriteHeader(http.StatusOK)
-        json.NewEncoder(w).Encode(health)
-    http.HandleFunc("/health", health_handler)
-
-    http.Handle(metricsPath, promhttp.HandlerFor(influxDbRegistry, promhttp.HandlerOpts()))
-    http.Handle(exporterMetricsPath, promhttp.Handler())
+        health = InfluxV2Health()
+        health.Name = "influxdb_exporter"
+        health.Message = "ready for queries and writes"
+        health.Status = "pass"
+        health.Version = config.Influxdb_Version
+        w.headers["Content-Type"] = "application/json; charset=utf-8"
+        w.write(json.dumps(vars(health)))
+    server.route("/health", health_handler, inline=True)
+
+    scrapes = concurrent.futures.ThreadPoolExecutor(config.httpScrapeWorkers, thread_name_prefix="scrape")
+    server.route(config.metricsPath, c.metrics_handler, executor=scrapes)
+
+    def exporter_metrics_handler(w, r):
+        """Serve the exporter's own metrics from the default registry."""
+        encoder, content_type = prometheus_client.exposition.choose_encoder(r.headers.get("Accept", ""))
+        body = encoder(REGISTRY)
+        encoding = exposition.negotiate_encoding(r.headers.get("Accept-Encoding", ""))
+        if encoding != exposition.IDENTITY:
+            body = exposition.ENCODERS[encoding](body)
+            w.headers["Content-Encoding"] = encoding
+        w.headers["Content-Type"] = content_type
+        w.headers["Vary"] = "Accept, Accept-Encoding"
+        w.write(body)
+    server.route(config.exporterMetricsPath, exporter_metrics_handler, executor=scrapes)
+    # Without the flag the routes do not exist, so profiling costs nothing.
+    if config.profilingEnabled:
+        profiling.register(server, config.profilingPath, config.profilingMaxSeconds, config.profilingHeapMaxSeconds)
 
     def default_handler(w, r):
         """Default handler for other endpoints."""
-        w.Write([]byte('<html>\n<head><title>InfluxDB Exporter</title></head>\n<body>\n<h1>InfluxDB Exporter</h1>\n<p><a href="' \
-                       + metricsPath + '">Metrics</a></p>\n<p><a href="' + exporterMetricsPath + '">Exporter Metrics</a></p>\n</body>\n</html>'))
-    http.HandleFunc("/", default_handler)
+        w.headers["Content-Type"] = "text/html; charset=utf-8"
+        w.write('<html>\n<head><title>InfluxDB Exporter</title></head>\n<body>\n<h1>InfluxDB Exporter</h1>\n<p><a href="'
+                + config.metricsPath + '">Metrics</a></p>\n<p><a href="' + config.exporterMetricsPath
+                + '">Exporter Metrics</a></p>\n</body>\n</html>')
+    server.route_default(default_handler, inline=True)
+    REGISTRY.register(httpserver.ServerCollector(server))
+
+    return server
+
+def parse_flags(argv=None):
+    """Parse the command line, overriding the matching config defaults."""
+    parser = argparse.ArgumentParser(description="Exports InfluxDB line protocol pushes as Prometheus metrics.")
+    parser.add_argument("--web.listen-address", dest="listen_address", default=config.listenAddress,
+                        help="Address on which to expose metrics and accept /write requests.")
+    parser.add_argument("--web.telemetry-path", dest="metrics_path", default=config.metricsPath,
+                        help="Path under which to expose the pushed metrics.")
+    parser.add_argument("--web.exporter-telemetry-path", dest="exporter_metrics_path",
+                        default=config.exporterMetricsPath,
+                        help="Path under which to expose the exporter's own metrics.")
+    parser.add_argument("--udp.bind-address", dest="bind_address", default=config.bindAddress,
+                        help="Address on which to listen for UDP line protocol.")
+    parser.add_argument("--udp.listeners", dest="udp_listeners", type=int, default=config.udpListeners,
+                        help="Number of SO_REUSEPORT UDP sockets.")
+    parser.add_argument("--log.level", dest="log_level", choices=sorted(kvlog.LEVELS), default="info",
+                        help="Only log messages at or above this level.")
+    args = parser.parse_args(argv)
+    config.listenAddress = args.listen_address
+    config.metricsPath = args.metrics_path
+    config.exporterMetricsPath = args.exporter_metrics_path
+    config.bindAddress = args.bind_address
+    config.udpListeners = args.udp_listeners
+    return args
+
+
+def main(argv=None):
+    """Main function for the InfluxDB exporter."""
+    args = parse_flags(argv)
+    logging.basicConfig(level=kvlog.LEVELS[args.log_level], format="ts=%(asctime)s level=%(levelname)s %(message)s")
+    logger = kvlog.KeyValueLogger("influxdb_exporter")
+    logger.info("msg", "Starting influxdb_exporter", "influxdb_version", config.Influxdb_Version)
 
+    c = InfluxDBCollector.new_influxdb_collector(logger)
+    influxDbRegistry.register(c)
+    if c.limiter is not None:
+        REGISTRY.register(cardinality.LimiterCollector(c.limiter))
+    if c.rules is not None:
+        REGISTRY.register(preaggregate.RuleCollector(c.rules))
+    if c.relabeler is not None:
+        REGISTRY.register(relabel.RelabelCollector(c.relabeler))
+
+    if config.ingestProcesses > 0:
+        aggregator = c.start_ingest_workers(config.ingestProcesses)
+        REGISTRY.register(multiingest.AggregatorCollector(aggregator))
+        for metric in workerMetrics:
+            REGISTRY.unregister(metric)
+        REGISTRY.register(multiingest.WorkerMetricsCollector(aggregator, workerMetrics))
+    else:
+        try:
+            c.start_udp_listeners(config.bindAddress, config.udpListeners)
+        except OSError as err:
+            logger.error("msg", "Failed to set up UDP listener", "address", config.bindAddress, "err", err)
+            sys.exit(1)
+
+    server = new_http_server(c, logger)
+    host, port = connections.split_host_port(config.listenAddress)
+    logger.info("msg", "Listening", "address", config.listenAddress, "udp", config.bindAddress)
     try:
-        http.ListenAndServe(listenAddress, None)
-    except Exception as err:
+        asyncio.run(server.serve_forever(host, port))
+    except OSError as err:
         logger.error("msg", "Error starting HTTP server", "err", err)
-        os.Exit(1)
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
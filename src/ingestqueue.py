@@ -0,0 +1,120 @@
+""" Bounded batch handoff between the parsers and the sample store """
+import collections
+import threading
+import time
+
+BLOCK = "block"
+DROP_NEWEST = "drop-newest"
+DROP_OLDEST = "drop-oldest"
+POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+
+class IngestQueue:
+    """Fixed-capacity ring buffer of samples with a configurable overflow policy.
+
+    Producers hand over whole batches with ``put_many``; the consumer drains
+    batches with ``get_batch``, or with ``get_numbered_batch`` when several
+    consumers need to know the order batches left the queue in. ``depth``,
+    ``high_water`` and ``dropped`` are kept for the exporter's own metrics.
+    """
+    def __init__(self, capacity, policy=BLOCK):
+        if capacity < 1:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy!r}, expected one of {POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self.high_water = 0
+        self.dropped = 0
+        self._taken = 0
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def put_many(self, items):
+        """Enqueue ``items`` according to the overflow policy.
+
+        Returns the number of samples dropped by this call.
+        """
+        if not items:
+            return 0
+        with self._lock:
+            if self.policy == BLOCK:
+                dropped = self._put_blocking(items)
+            elif self.policy == DROP_NEWEST:
+                room = self.capacity - len(self._items)
+                dropped = max(len(items) - room, 0)
+                self._items.extend(items[:room] if dropped else items)
+            else:
+                overflow = len(self._items) + len(items) - self.capacity
+                dropped = max(overflow, 0)
+                if overflow >= len(self._items):
+                    self._items.clear()
+                    self._items.extend(items[len(items) - self.capacity:])
+                else:
+                    for _ in range(overflow):
+                        self._items.popleft()
+                    self._items.extend(items)
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            self.dropped += dropped
+            self._not_empty.notify()
+        return dropped
+
+    def _put_blocking(self, items):
+        """Add ``items`` in chunks as room frees up. Called with the lock held."""
+        start = 0
+        while start < len(items):
+            room = self.capacity - len(self._items)
+            while room <= 0:
+                self._not_empty.notify()
+                self._not_full.wait()
+                room = self.capacity - len(self._items)
+            chunk = items[start:start + room]
+            self._items.extend(chunk)
+            start += len(chunk)
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+        return 0
+
+    def get_batch(self, max_items, timeout=None):
+        """Dequeue up to ``max_items`` samples, waiting up to ``timeout`` seconds for the first."""
+        with self._lock:
+            return self._take(max_items, timeout)
+
+    def get_numbered_batch(self, max_items, timeout=None):
+        """Like ``get_batch`` but return (number, batch); non-empty batches are numbered 0, 1, 2... in queue order.
+
+        Batches taken with ``get_batch`` are not numbered.
+        """
+        with self._lock:
+            batch = self._take(max_items, timeout)
+            if not batch:
+                return None, batch
+            number = self._taken
+            self._taken += 1
+            return number, batch
+
+    def _take(self, max_items, timeout):
+        """Pop up to ``max_items`` samples, waiting up to ``timeout`` seconds for the first; lock held."""
+        if not self._items and timeout != 0:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+        n = min(max_items, len(self._items))
+        popleft = self._items.popleft
+        batch = [popleft() for _ in range(n)]
+        if batch:
+            self._not_full.notify_all()
+        return batch
@@ -0,0 +1,26 @@
+""" Key/value logging on top of the standard logging module """
+import logging
+
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warn": logging.WARNING, "error": logging.ERROR}
+
+
+class KeyValueLogger:
+    """Logs ``logger.info("msg", "Starting", "key", value)`` calls as ``msg=Starting key=value`` lines."""
+    def __init__(self, name):
+        self._log = logging.getLogger(name)
+
+    def _emit(self, level, kv):
+        if self._log.isEnabledFor(level):
+            self._log.log(level, " ".join(f"{k}={v}" for k, v in zip(kv[::2], kv[1::2])))
+
+    def debug(self, *kv):
+        self._emit(logging.DEBUG, kv)
+
+    def info(self, *kv):
+        self._emit(logging.INFO, kv)
+
+    def warning(self, *kv):
+        self._emit(logging.WARNING, kv)
+
+    def error(self, *kv):
+        self._emit(logging.ERROR, kv)
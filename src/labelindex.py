@@ -0,0 +1,173 @@
+""" Inverted index from metric names and label pairs to series handles, for match[] selectors """
+import re
+
+NAME_LABEL = "__name__"
+
+EQUAL = "="
+NOT_EQUAL = "!="
+REGEX = "=~"
+NOT_REGEX = "!~"
+
+_METRIC_NAME = re.compile(r"\s*([a-zA-Z_:][a-zA-Z0-9_:]*)\s*")
+_MATCHER = re.compile(
+    r"""\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')\s*""")
+_ESCAPES = {"n": "\n", "t": "\t"}
+
+
+class SelectorError(ValueError):
+    """A match[] selector that cannot be parsed or would select every series."""
+
+
+class Matcher:
+    """One ``label op "value"`` condition; regular expressions are anchored at both ends."""
+    __slots__ = ("label", "op", "value", "regex")
+
+    def __init__(self, label, op, value):
+        self.label = label
+        self.op = op
+        self.value = value
+        self.regex = None
+        if op in (REGEX, NOT_REGEX):
+            try:
+                self.regex = re.compile(value)
+            except re.error as e:
+                raise SelectorError(f"invalid regular expression {value!r}: {e}") from None
+
+    def matches(self, value):
+        if self.op == EQUAL:
+            return value == self.value
+        if self.op == NOT_EQUAL:
+            return value != self.value
+        if self.op == REGEX:
+            return self.regex.fullmatch(value) is not None
+        return self.regex.fullmatch(value) is None
+
+    def __repr__(self):
+        return f"{self.label}{self.op}{self.value!r}"
+
+
+def _unquote(text):
+    return re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+
+
+def parse_selector(text):
+    """Parse a series selector such as ``cpu{host="a",dc=~"eu-.*"}`` into a list of Matchers.
+
+    Like Prometheus, at least one matcher must not match the empty string,
+    so a selector can never mean "every series".
+    """
+    matchers = []
+    pos = 0
+    m = _METRIC_NAME.match(text)
+    if m:
+        matchers.append(Matcher(NAME_LABEL, EQUAL, m.group(1)))
+        pos = m.end()
+    if pos < len(text):
+        if text[pos] != "{":
+            raise SelectorError(f"unexpected {text[pos]!r} at position {pos} of selector {text!r}")
+        pos += 1
+        while True:
+            m = _MATCHER.match(text, pos)
+            if m is None:
+                break
+            matchers.append(Matcher(m.group(1), m.group(2), _unquote(m.group(3))))
+            pos = m.end()
+            if text.startswith(",", pos):
+                pos += 1
+            else:
+                break
+        rest = text[pos:].strip()
+        if rest != "}":
+            raise SelectorError(f"invalid label matchers in selector {text!r}")
+    if not any(not matcher.matches("") for matcher in matchers):
+        raise SelectorError(f"selector {text!r} must contain a matcher that does not match the empty string")
+    return matchers
+
+
+class LabelIndex:
+    """Posting lists of series handles, maintained incrementally.
+
+    ``postings`` maps a label name to a value to the set of handles having
+    that pair; the metric name is indexed under ``__name__``. Equality
+    matchers select postings, as do the other matchers that cannot match
+    the empty string when there is no equality matcher (they walk the
+    label's distinct values, not its series). The sets are intersected
+    smallest first and the remaining matchers filter the candidates. The
+    cost of a selection therefore follows the size of the smallest posting
+    list involved, not the number of series stored.
+    """
+    def __init__(self):
+        self.postings = {}
+        self.series = {}
+
+    def __len__(self):
+        return len(self.series)
+
+    def add(self, sid, name, labels):
+        self.series[sid] = (name, labels)
+        postings = self.postings
+        for key, value in ((NAME_LABEL, name),) + labels:
+            values = postings.get(key)
+            if values is None:
+                values = postings[key] = {}
+            handles = values.get(value)
+            if handles is None:
+                handles = values[value] = set()
+            handles.add(sid)
+
+    def remove(self, sid, name, labels):
+        if self.series.pop(sid, None) is None:
+            return
+        postings = self.postings
+        for key, value in ((NAME_LABEL, name),) + labels:
+            values = postings[key]
+            handles = values[value]
+            handles.discard(sid)
+            if not handles:
+                del values[value]
+                if not values:
+                    del postings[key]
+
+    def _postings(self, matcher):
+        values = self.postings.get(matcher.label, {})
+        if matcher.op == EQUAL:
+            return values.get(matcher.value, set())
+        found = set()
+        for value, handles in values.items():
+            if matcher.matches(value):
+                found |= handles
+        return found
+
+    def select(self, matchers):
+        """Return the set of handles matching every matcher."""
+        selecting = []
+        filtering = []
+        unions = []
+        for matcher in matchers:
+            if matcher.matches(""):
+                filtering.append(matcher)
+            elif matcher.op == EQUAL:
+                selecting.append(self._postings(matcher))
+            else:
+                unions.append(matcher)
+        # Other matchers union the postings of every matching value, which can
+        # be far larger than the result, so they only select when nothing else does.
+        if selecting:
+            filtering.extend(unions)
+        else:
+            selecting = [self._postings(matcher) for matcher in unions]
+        if not selecting:
+            raise SelectorError("a selector needs a matcher that does not match the empty string")
+        selecting.sort(key=len)
+        candidates = selecting[0].intersection(*selecting[1:])
+        if not filtering:
+            return candidates
+        series = self.series
+        selected = set()
+        for sid in candidates:
+            name, labels = series[sid]
+            values = dict(labels)
+            values[NAME_LABEL] = name
+            if all(m.matches(values.get(m.label, "")) for m in filtering):
+                selected.add(sid)
+        return selected
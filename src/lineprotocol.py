@@ -0,0 +1,305 @@
+""" Streaming parser for the InfluxDB line protocol """
+import re
+import time
+
+# Multipliers from the write precision to nanoseconds. Both the v1 ("n", "u")
+# and v2 ("ns", "us") spellings are accepted.
+PRECISION_MULTIPLIERS = {
+    "ns": 1,
+    "n": 1,
+    "us": 1000,
+    "u": 1000,
+    "ms": 1000 * 1000,
+    "s": 1000 * 1000 * 1000,
+    "m": 60 * 1000 * 1000 * 1000,
+    "h": 60 * 60 * 1000 * 1000 * 1000,
+}
+
+# Longest line the streaming parsers carry over between chunks, in bytes
+MAX_LINE_SIZE = 1024 * 1024
+
+_LINE = re.compile(rb"[^\n]+")
+_KEY_ESCAPE = re.compile(r"\\([,= ])")
+_STRING_ESCAPE = re.compile(r'\\(["\\])')
+_BOOLS = {
+    "t": True, "T": True, "true": True, "True": True, "TRUE": True,
+    "f": False, "F": False, "false": False, "False": False, "FALSE": False,
+}
+_NUMBER_START = frozenset("+-.0123456789")
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+_UINT64_MAX = 2 ** 64 - 1
+
+
+class LineProtocolError(ValueError):
+    """Raised when a line cannot be parsed."""
+    def __init__(self, lineno, msg):
+        super().__init__(f"line {lineno}: {msg}")
+        self.lineno = lineno
+
+
+def parse_points(buf, precision="ns", now=None, lineno=0):
+    """Lazily parse a line protocol buffer into (name, tags, fields, ts) tuples.
+
+    ``buf`` may be ``bytes``, ``bytearray`` or a ``memoryview``; lines are
+    located in place and only decoded one at a time. ``tags`` is a list of
+    (key, value) pairs, ``fields`` a dict and ``ts`` an int in nanoseconds.
+    Points without a timestamp get ``now`` (nanoseconds, defaults to the
+    current time). Error messages number lines from ``lineno + 1``.
+    """
+    multiplier = precision_multiplier(precision)
+    if now is None:
+        now = time.time_ns()
+    return _iter_points(buf, multiplier, now, lineno)
+
+
+def precision_multiplier(precision):
+    """Return the factor from ``precision`` to nanoseconds, raising LineProtocolError if it is unknown."""
+    multiplier = PRECISION_MULTIPLIERS.get(precision)
+    if multiplier is None:
+        raise LineProtocolError(0, f"invalid precision {precision!r}")
+    return multiplier
+
+
+def parse_stream(chunks, precision="ns", now=None, max_line=MAX_LINE_SIZE):
+    """Lazily parse line protocol arriving as an iterable of byte chunks.
+
+    Chunks may split lines anywhere; the incomplete tail of each chunk is
+    carried over to the next one, so only one chunk and one partial line are
+    held at a time. Yields the same tuples as ``parse_points``, and raises
+    LineProtocolError for lines longer than ``max_line`` bytes.
+    """
+    multiplier = precision_multiplier(precision)
+    if now is None:
+        now = time.time_ns()
+    return _iter_stream(chunks, multiplier, now, max_line)
+
+
+def line_buffers(chunks, max_line=MAX_LINE_SIZE):
+    """Regroup byte chunks split anywhere into buffers holding whole lines.
+
+    The incomplete tail of each chunk is carried over to the next one and
+    joined once its line ends, so only one chunk and one partial line are
+    held at a time. A partial line longer than ``max_line`` bytes raises
+    LineProtocolError. A buffer is only valid until the next one is requested.
+    """
+    lines = LineSplitter(max_line)
+    for chunk in chunks:
+        buf = lines.feed(chunk)
+        if buf is not None:
+            yield buf
+    buf = lines.close()
+    if buf is not None:
+        yield buf
+
+
+class LineSplitter:
+    """The push form of ``line_buffers``, for callers that receive chunks rather than pull them.
+
+    ``feed`` returns a buffer of the whole lines completed by a chunk, or
+    None, and ``close`` the unterminated last line, if any. ``lineno`` counts
+    the newlines seen so far.
+    """
+    def __init__(self, max_line=MAX_LINE_SIZE):
+        self.max_line = max_line
+        self.pending = []
+        self.size = 0
+        self.lineno = 0
+
+    def feed(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        size = self.size
+        cut = chunk.rfind(b"\n") + 1
+        if cut == 0:
+            self.size = size + len(chunk)
+            if self.size > self.max_line:
+                raise LineProtocolError(self.lineno + 1, f"line exceeds {self.max_line} bytes")
+            self.pending.append(chunk)
+            return None
+        if self.pending:
+            if size + chunk.index(b"\n") > self.max_line:
+                raise LineProtocolError(self.lineno + 1, f"line exceeds {self.max_line} bytes")
+            self.pending.append(chunk)
+            chunk = b"".join(self.pending)
+            cut += size
+        self.lineno += chunk.count(b"\n", 0, cut)
+        self.size = len(chunk) - cut
+        if self.size > self.max_line:
+            raise LineProtocolError(self.lineno + 1, f"line exceeds {self.max_line} bytes")
+        self.pending = [chunk[cut:]] if self.size else []
+        return memoryview(chunk)[:cut]
+
+    def close(self):
+        if not self.pending:
+            return None
+        buf = b"".join(self.pending)
+        self.pending = []
+        self.size = 0
+        return buf
+
+
+def _iter_stream(chunks, multiplier, now, max_line):
+    lineno = 0
+    for buf in line_buffers(chunks, max_line):
+        lineno = yield from _iter_points(buf, multiplier, now, lineno)
+
+
+def _iter_points(buf, multiplier, now, lineno=0):
+    """Yield the points in ``buf``; returns the number of the last line seen."""
+    for lineno, m in enumerate(_LINE.finditer(buf), lineno + 1):
+        try:
+            line = m.group().decode("utf-8").strip()
+        except UnicodeDecodeError as e:
+            raise LineProtocolError(lineno, f"invalid utf-8: {e}") from None
+        if not line or line[0] == "#":
+            continue
+        try:
+            yield parse_line(line, multiplier, now)
+        except LineProtocolError:
+            raise
+        except ValueError as e:
+            raise LineProtocolError(lineno, str(e)) from None
+    return lineno
+
+
+def parse_line(line, multiplier=1, now=0):
+    """Parse a single decoded line into a (name, tags, fields, ts) tuple."""
+    if "\\" in line or '"' in line:
+        key, fields_s, ts_s = _split_sections(line)
+    else:
+        key, _, rest = line.partition(" ")
+        fields_s, _, ts_s = rest.partition(" ")
+        if " " in ts_s:
+            raise ValueError("unexpected data after timestamp")
+
+    if not fields_s:
+        raise ValueError("missing fields")
+
+    if "\\" in key:
+        parts = _split_unescaped(key, ",")
+        name = _KEY_ESCAPE.sub(r"\1", parts[0])
+        tags = [_tag(p, True) for p in parts[1:]]
+    else:
+        parts = key.split(",")
+        name = parts[0]
+        tags = [_tag(p, False) for p in parts[1:]]
+    if not name:
+        raise ValueError("missing measurement")
+
+    fields = {}
+    if '"' in fields_s or "\\" in fields_s:
+        for p in _split_unescaped(fields_s, ",", quotes=True):
+            k, v = _split_pair(p, True)
+            fields[k] = _field_value(v)
+    else:
+        for p in fields_s.split(","):
+            k, sep, v = p.partition("=")
+            if not k or not sep or not v:
+                raise ValueError(f"invalid field {p!r}")
+            fields[k] = _field_value(v)
+
+    if ts_s:
+        ts = int(ts_s) * multiplier
+        if not _INT64_MIN <= ts <= _INT64_MAX:
+            raise ValueError(f"timestamp {ts_s!r} out of range")
+    else:
+        ts = now
+    return name, tags, fields, ts
+
+
+def _tag(p, escaped):
+    """Parse a single key=value tag."""
+    if escaped:
+        return _split_pair(p, True)
+    k, sep, v = p.partition("=")
+    if not k or not sep or not v:
+        raise ValueError(f"invalid tag {p!r}")
+    return k, v
+
+
+def _split_pair(p, unescape):
+    """Split key=value on the first unescaped equals sign."""
+    i = _find_unescaped(p, "=", 0, False)
+    if i <= 0 or i == len(p) - 1:
+        raise ValueError(f"invalid key/value pair {p!r}")
+    k = p[:i]
+    if unescape:
+        k = _KEY_ESCAPE.sub(r"\1", k)
+    v = p[i + 1:]
+    if v[0] != '"' and "\\" in v:
+        v = _KEY_ESCAPE.sub(r"\1", v)
+    return k, v
+
+
+def _field_value(v):
+    """Convert a field value literal to float, int, bool or str."""
+    c = v[-1]
+    if v[0] == '"':
+        if len(v) < 2 or c != '"':
+            raise ValueError(f"unterminated string {v!r}")
+        v = v[1:-1]
+        return _STRING_ESCAPE.sub(r"\1", v) if "\\" in v else v
+    if c == "i":
+        n = int(v[:-1])
+        if not _INT64_MIN <= n <= _INT64_MAX:
+            raise ValueError(f"integer {v!r} out of range")
+        return n
+    if c == "u":
+        n = int(v[:-1])
+        if not 0 <= n <= _UINT64_MAX:
+            raise ValueError(f"unsigned integer {v!r} out of range")
+        return n
+    b = _BOOLS.get(v)
+    if b is not None:
+        return b
+    if v[0] not in _NUMBER_START:
+        raise ValueError(f"invalid field value {v!r}")
+    return float(v)
+
+
+def _find_unescaped(s, ch, start, quotes):
+    """Return the index of the first unescaped ``ch`` at or after ``start``."""
+    in_quotes = False
+    i = start
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if c == "\\":
+            i += 2
+            continue
+        if quotes and c == '"':
+            in_quotes = not in_quotes
+        elif c == ch and not in_quotes:
+            return i
+        i += 1
+    if in_quotes:
+        raise ValueError("unterminated string")
+    return -1
+
+
+def _split_unescaped(s, ch, quotes=False):
+    """Split ``s`` on unescaped (and optionally unquoted) ``ch``."""
+    out = []
+    start = 0
+    while True:
+        i = _find_unescaped(s, ch, start, quotes)
+        if i < 0:
+            out.append(s[start:])
+            return out
+        out.append(s[start:i])
+        start = i + 1
+
+
+def _split_sections(line):
+    """Split a line that needs escape handling into key, fields and timestamp."""
+    i = _find_unescaped(line, " ", 0, False)
+    if i < 0:
+        return line, "", ""
+    j = _find_unescaped(line, " ", i + 1, True)
+    if j < 0:
+        return line[:i], line[i + 1:], ""
+    ts = line[j + 1:]
+    if " " in ts:
+        raise ValueError("unexpected data after timestamp")
+    return line[:i], line[i + 1:j], ts
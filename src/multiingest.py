@@ -0,0 +1,238 @@
+""" Multi-process ingest: parser worker processes shipping sample batches to the store owner """
+import array
+import pickle
+import sys
+import threading
+import time
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from series import InfluxDBSample
+
+
+def encode_batch(samples, worker, seq, first_at):
+    """Pack samples into one compact message.
+
+    Names and label sets are sent once per batch and referenced by index;
+    values and timestamps travel as packed double arrays.
+    """
+    names = {}
+    labelsets = {}
+    name_idx = array.array("I")
+    label_idx = array.array("I")
+    values = array.array("d")
+    timestamps = array.array("d")
+    expires = array.array("d")
+    for s in samples:
+        i = names.get(s.name)
+        if i is None:
+            i = names[s.name] = len(names)
+        name_idx.append(i)
+        # Label tuples are interned by the worker, so identity is enough.
+        entry = labelsets.get(id(s.labels))
+        if entry is None:
+            entry = labelsets[id(s.labels)] = (len(labelsets), s.labels)
+        label_idx.append(entry[0])
+        values.append(s.value)
+        timestamps.append(s.timestamp)
+        expires.append(s.expires)
+    return pickle.dumps(
+        (worker, seq, first_at, list(names), [labels for _, labels in labelsets.values()],
+         name_idx, label_idx, values, timestamps, expires),
+        pickle.HIGHEST_PROTOCOL)
+
+
+def decode_batch(data, intern_labels=tuple):
+    """Unpack a message; returns (worker, seq, first_at, samples).
+
+    ``intern_labels`` maps each received label tuple to the canonical one,
+    e.g. ``LabelSetTable.intern``; it is called once per distinct set.
+    """
+    worker, seq, first_at, names, labelsets, name_idx, label_idx, values, timestamps, expires = pickle.loads(data)
+    names = [sys.intern(name) for name in names]
+    labelsets = [intern_labels(labels) for labels in labelsets]
+    samples = [InfluxDBSample(names[n], ts, value, labelsets[l], exp)
+               for n, l, value, ts, exp in zip(name_idx, label_idx, values, timestamps, expires)]
+    return worker, seq, first_at, samples
+
+
+# Leading byte of a metrics message; batch messages are pickles, which never start with it.
+METRICS_TAG = b"M"
+
+
+def encode_metrics(families):
+    """Pack a worker's self-metric families (prometheus_client Metric objects) into one message."""
+    return METRICS_TAG + pickle.dumps(families, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_metrics(data):
+    return pickle.loads(memoryview(data)[len(METRICS_TAG):])
+
+
+class ShippingQueue:
+    """Stands in for the IngestQueue inside a worker process.
+
+    ``put_many`` buffers samples and ships them over ``conn`` (a
+    multiprocessing Connection) once ``batch_size`` have accumulated or
+    ``linger`` seconds after the first buffered sample, whichever comes
+    first. A full pipe blocks the parsers, which pushes back onto the
+    sockets instead of growing memory.
+
+    With ``metrics``, a callable returning the worker's self-metric
+    families, their current values are shipped every ``metrics_interval``
+    seconds for the main process to serve (see ``WorkerMetricsCollector``).
+    """
+    def __init__(self, conn, worker, batch_size, linger, metrics=None, metrics_interval=5.0):
+        self.conn = conn
+        self.worker = worker
+        self.batch_size = batch_size
+        self.linger = linger
+        self.metrics = metrics
+        self.metrics_interval = metrics_interval
+        self._items = []
+        self._first_at = 0.0
+        self._seq = 0
+        self._metrics_due = 0.0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._flush_loop, name="ship", daemon=True).start()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_many(self, items):
+        if not items:
+            return 0
+        with self._lock:
+            if not self._items:
+                self._first_at = time.time()
+            self._items.extend(items)
+            if len(self._items) >= self.batch_size:
+                self._send()
+        return 0
+
+    def _send(self):
+        """Ship the buffered samples. Called with the lock held, which keeps batches in order."""
+        self._seq += 1
+        batch, self._items = self._items, []
+        self.conn.send_bytes(encode_batch(batch, self.worker, self._seq, self._first_at))
+
+    def flush(self):
+        with self._lock:
+            if self._items:
+                self._send()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.linger)
+            with self._lock:
+                if self._items and time.time() - self._first_at >= self.linger:
+                    self._send()
+            if self.metrics is not None and time.time() >= self._metrics_due:
+                self._metrics_due = time.time() + self.metrics_interval
+                data = encode_metrics(self.metrics())
+                with self._lock:
+                    self.conn.send_bytes(data)
+
+
+class WorkerStats:
+    """What the aggregator has received from one worker."""
+    __slots__ = ("up", "batches", "samples", "bytes", "lag", "seq")
+
+    def __init__(self):
+        self.up = 1
+        self.batches = self.samples = self.bytes = self.seq = 0
+        self.lag = 0.0
+
+
+class Aggregator:
+    """Receives worker batches and feeds them into the store's ingest queue.
+
+    One thread per worker connection decodes its batches and calls
+    ``sink(samples)``. ``lag`` is the time from the first sample of the
+    latest batch being buffered in the worker until it was handed to the
+    sink. ``metrics`` holds the self-metric families each worker shipped last.
+    """
+    def __init__(self, sink, intern_labels=tuple, logger=None):
+        self.sink = sink
+        self.intern_labels = intern_labels
+        self.logger = logger
+        self.stats = {}
+        self.metrics = {}
+
+    def attach(self, worker, conn):
+        self.stats[worker] = WorkerStats()
+        threading.Thread(target=self._receive, args=(worker, conn), name=f"aggregate-{worker}", daemon=True).start()
+
+    def _receive(self, worker, conn):
+        stats = self.stats[worker]
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError) as err:
+                stats.up = 0
+                if self.logger is not None:
+                    self.logger.error("msg", "Ingest worker connection closed", "worker", worker, "err", err)
+                return
+            if data[:len(METRICS_TAG)] == METRICS_TAG:
+                self.metrics[worker] = decode_metrics(data)
+                continue
+            _, seq, first_at, samples = decode_batch(data, self.intern_labels)
+            self.sink(samples)
+            stats.lag = time.time() - first_at
+            stats.seq = seq
+            stats.batches += 1
+            stats.samples += len(samples)
+            stats.bytes += len(data)
+
+
+class AggregatorCollector:
+    """Exports per-worker throughput and lag of an Aggregator."""
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+
+    def collect(self):
+        up = GaugeMetricFamily(
+            "influxdb_ingest_worker_up", "Whether the ingest worker connection is open.", labels=["worker"])
+        batches = CounterMetricFamily(
+            "influxdb_ingest_worker_batches", "Sample batches received from each ingest worker.", labels=["worker"])
+        samples = CounterMetricFamily(
+            "influxdb_ingest_worker_samples", "Samples received from each ingest worker.", labels=["worker"])
+        nbytes = CounterMetricFamily(
+            "influxdb_ingest_worker_bytes", "Encoded batch bytes received from each ingest worker.", labels=["worker"])
+        lag = GaugeMetricFamily(
+            "influxdb_ingest_worker_lag_seconds",
+            "Seconds from a worker buffering the first sample of its latest batch to the aggregator queueing it.",
+            labels=["worker"])
+        for worker, stats in sorted(self.aggregator.stats.items()):
+            labels = [str(worker)]
+            up.add_metric(labels, stats.up)
+            batches.add_metric(labels, stats.batches)
+            samples.add_metric(labels, stats.samples)
+            nbytes.add_metric(labels, stats.bytes)
+            lag.add_metric(labels, stats.lag)
+        yield from (up, batches, samples, nbytes, lag)
+
+
+
+class WorkerMetricsCollector:
+    """Serves self-metrics that ingest workers update in their own processes.
+
+    Yields the families of ``collectors`` as this process sees them, with
+    the series each worker last shipped added under a ``worker`` label.
+    Register it in place of those collectors.
+    """
+    def __init__(self, aggregator, collectors):
+        self.aggregator = aggregator
+        self.collectors = collectors
+
+    def collect(self):
+        families = {}
+        for collector in self.collectors:
+            for family in collector.collect():
+                families[family.name] = family
+        for worker, shipped in sorted(self.aggregator.metrics.items()):
+            for family in shipped:
+                merged = families.get(family.name)
+                if merged is None:
+                    merged = families[family.name] = Metric(family.name, family.documentation, family.type, family.unit)
+                merged.samples.extend(
+                    s._replace(labels={**s.labels, "worker": str(worker)}) for s in family.samples)
+        yield from families.values()
@@ -0,0 +1,240 @@
+""" Ingest-time aggregation rules collapsing series over dropped labels """
+import math
+import re
+import sys
+import threading
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sanitize import replace_invalid_chars
+from series import InfluxDBSample
+
+SUM = "sum"
+MAX = "max"
+MIN = "min"
+COUNT = "count"
+OPS = (SUM, MAX, MIN, COUNT)
+
+# Input label sets whose output label set is cached per rule
+GROUPING_CACHE_SIZE = 1000000
+_RULE = re.compile(r"^\s*(\w+)\s+(\S+)\s+(without|by)\s*\(([^)]*)\)\s*$")
+
+
+class RuleError(ValueError):
+    """An aggregation rule that cannot be parsed."""
+
+
+class _Group:
+    """The latest value of every input series folded into one output series.
+
+    ``total + error`` is the sum of the members' values; ``error`` carries
+    the rounding lost by the running ``total`` (see ``_accumulate``).
+    """
+    __slots__ = ("members", "total", "error", "extreme", "timestamp", "expires")
+
+    def __init__(self):
+        self.members = {}
+        self.total = 0.0
+        self.error = 0.0
+        self.extreme = None
+        self.timestamp = 0.0
+        self.expires = 0.0
+
+
+def _accumulate(group, x):
+    """Add ``x`` to the group's total with Neumaier's compensated summation."""
+    total = group.total
+    t = total + x
+    if abs(total) >= abs(x):
+        group.error += (total - t) + x
+    else:
+        group.error += (x - t) + total
+    group.total = t
+
+
+class Rule:
+    """Aggregates the series of one measurement ``without`` (or ``by``) some labels.
+
+    A rule covers the metric names derived from its measurement: the
+    measurement itself (the ``value`` field) and ``<measurement>_<field>``.
+    Each input series keeps only its latest value and expiry; the output
+    series ``<name>:<op>`` carries the op over those values and is updated
+    incrementally on every input sample. Sums and counts are O(1) per
+    sample, with sums compensated so that replacing large values does not
+    leave rounding drift behind; max and min rescan a group only when its
+    current extreme moves the wrong way. ``expire`` forgets input series past their
+    deadline. With ``drop_raw`` the input series are not stored at all.
+    """
+    def __init__(self, op, measurement, labels, by=False, drop_raw=False):
+        if op not in OPS:
+            raise RuleError(f"unknown aggregation {op!r}, expected one of {', '.join(OPS)}")
+        self.op = op
+        self._better = max if op == MAX else min if op == MIN else None
+        self.measurement = replace_invalid_chars(measurement)
+        self.labels = frozenset(replace_invalid_chars(label) for label in labels)
+        self.by = by
+        self.drop_raw = drop_raw
+        self.spec = f"{op} {measurement} {'by' if by else 'without'} ({', '.join(sorted(labels))})"
+        self.samples = 0
+        self.groups = {}
+        self._labelsets = {}
+        self._names = {}
+        self._grouping = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Rule({self.spec!r})"
+
+    def matches(self, name):
+        m = self.measurement
+        return name == m or (name.startswith(m) and name[len(m)] == "_")
+
+    def _output_labels(self, labels):
+        """Return the interned output label set for an input label set, caching the mapping."""
+        out = self._grouping.get(labels)
+        if out is None:
+            if self.by:
+                out = tuple(pair for pair in labels if pair[0] in self.labels)
+            else:
+                out = tuple(pair for pair in labels if pair[0] not in self.labels)
+            out = self._labelsets.setdefault(out, out)
+            if len(self._grouping) >= GROUPING_CACHE_SIZE:
+                self._grouping.clear()
+            self._grouping[labels] = out
+        return out
+
+    def _value(self, group):
+        if self.op == SUM:
+            return group.total + group.error
+        if self.op == COUNT:
+            return float(len(group.members))
+        return group.extreme
+
+    def _rescan(self, group):
+        values = [value for value, _ in group.members.values()]
+        group.total = math.fsum(values)
+        group.error = 0.0
+        if values:
+            group.extreme = max(values) if self.op == MAX else min(values)
+
+    def add(self, name, labels, value, timestamp, expires):
+        """Fold in one input sample; returns the updated output sample."""
+        out_name = self._names.get(name)
+        if out_name is None:
+            out_name = self._names[name] = sys.intern(name + ":" + self.op)
+        key = (out_name, self._output_labels(labels))
+        with self._lock:
+            self.samples += 1
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _Group()
+            members = group.members
+            old = members.get(labels)
+            members[labels] = (value, expires)
+            old_value = None if old is None else old[0]
+            _accumulate(group, value)
+            if old_value:
+                _accumulate(group, -old_value)
+            if self._better is not None:
+                better = self._better
+                if group.extreme is None or better(value, group.extreme) == value:
+                    group.extreme = value
+                elif old_value == group.extreme:
+                    self._rescan(group)
+            group.timestamp = max(group.timestamp, timestamp)
+            group.expires = max(group.expires, expires)
+            return InfluxDBSample(key[0], group.timestamp, self._value(group), key[1], group.expires)
+
+    def expire(self, now):
+        """Forget input series that expired before ``now``; returns the output samples that changed."""
+        changed = []
+        with self._lock:
+            for key, group in list(self.groups.items()):
+                members = group.members
+                stale = [labels for labels, (_, expires) in members.items() if expires < now]
+                if not stale:
+                    continue
+                for labels in stale:
+                    del members[labels]
+                if not members:
+                    # The output series expires from the store on its own.
+                    del self.groups[key]
+                    continue
+                self._rescan(group)
+                changed.append(InfluxDBSample(key[0], group.timestamp, self._value(group), key[1], group.expires))
+        return changed
+
+    def series(self):
+        """Return (input series, output series) currently tracked."""
+        with self._lock:
+            return sum(len(group.members) for group in self.groups.values()), len(self.groups)
+
+
+def parse_rule(spec):
+    """Build a Rule from ``"sum <measurement> without (pod, container)"`` or an equivalent dict.
+
+    Dicts take ``op``, ``measurement``, ``without`` or ``by`` (a list of
+    label names) and an optional ``drop_raw``.
+    """
+    if isinstance(spec, str):
+        m = _RULE.match(spec)
+        if m is None:
+            raise RuleError(f"invalid aggregation rule {spec!r}, expected '<op> <measurement> without (<labels>)'")
+        labels = [label.strip() for label in m.group(4).split(",") if label.strip()]
+        return Rule(m.group(1), m.group(2), labels, m.group(3) == "by")
+    try:
+        by = "by" in spec
+        return Rule(spec["op"], spec["measurement"], spec["by"] if by else spec.get("without", ()), by,
+                    bool(spec.get("drop_raw", False)))
+    except KeyError as e:
+        raise RuleError(f"aggregation rule {spec!r} lacks {e.args[0]!r}") from None
+
+
+class RuleSet:
+    """The configured rules, looked up per metric name with the result cached."""
+    def __init__(self, rules, cache_size=65536):
+        self.rules = [rule if isinstance(rule, Rule) else parse_rule(rule) for rule in rules]
+        self._by_name = {}
+        self._cache_size = cache_size
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def rules_for(self, name):
+        rules = self._by_name.get(name)
+        if rules is None:
+            rules = tuple(rule for rule in self.rules if rule.matches(name))
+            if len(self._by_name) >= self._cache_size:
+                self._by_name.clear()
+            self._by_name[name] = rules
+        return rules
+
+    def expire(self, now):
+        changed = []
+        for rule in self.rules:
+            changed.extend(rule.expire(now))
+        return changed
+
+
+class RuleCollector:
+    """Exports how much each aggregation rule reduces the series it covers."""
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+
+    def collect(self):
+        samples = CounterMetricFamily(
+            "influxdb_aggregation_input_samples", "Samples folded into each aggregation rule.", labels=["rule"])
+        inputs = GaugeMetricFamily(
+            "influxdb_aggregation_input_series", "Input series currently tracked by each aggregation rule.",
+            labels=["rule"])
+        outputs = GaugeMetricFamily(
+            "influxdb_aggregation_output_series", "Aggregated series produced by each aggregation rule.",
+            labels=["rule"])
+        ratio = GaugeMetricFamily(
+            "influxdb_aggregation_reduction_ratio", "Input series per aggregated series for each aggregation rule.",
+            labels=["rule"])
+        for rule in self.ruleset.rules:
+            n_in, n_out = rule.series()
+            samples.add_metric([rule.spec], rule.samples)
+            inputs.add_metric([rule.spec], n_in)
+            outputs.add_metric([rule.spec], n_out)
+            ratio.add_metric([rule.spec], n_in / n_out if n_out else 0.0)
+        yield from (samples, inputs, outputs, ratio)
@@ -0,0 +1,251 @@
+""" On-demand CPU sampling and tracemalloc heap profiles for the debug endpoints """
+import collections
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from httpserver import HTTPError
+
+COLLAPSED = "collapsed"
+PSTATS = "pstats"
+HEAP_GROUPS = ("lineno", "filename", "traceback")
+# Allocations made by tracemalloc and the import machinery are noise in every report
+_HEAP_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class CPUProfile:
+    """Stacks sampled from every thread, root first, with how often each was seen.
+
+    A stack is a tuple of (filename, first line, function) keys, so samples
+    anywhere in one function merge.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+
+    def add(self, thread_name, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[(thread_name, tuple(stack))] += 1
+
+    def collapsed(self):
+        """Render in the collapsed stack format read by flamegraph.pl and speedscope."""
+        lines = []
+        for (thread_name, stack), count in sorted(self.stacks.items()):
+            frames = [thread_name.replace(";", ":")]
+            frames.extend(f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack)
+            lines.append(f"{';'.join(frames)} {count}\n")
+        return "".join(lines).encode()
+
+    def pstats(self):
+        """Render as a marshalled stats dict, as written by cProfile and loaded by ``pstats.Stats``.
+
+        Call counts are sample counts, and times are samples multiplied by
+        the sampling interval.
+        """
+        stats = {}
+        interval = self.interval
+
+        def entry(key):
+            e = stats.get(key)
+            if e is None:
+                e = stats[key] = [0, 0, 0.0, 0.0, {}]
+            return e
+
+        for (_, stack), count in self.stacks.items():
+            if not stack:
+                continue
+            seconds = count * interval
+            leaf = entry(stack[-1])
+            leaf[2] += seconds
+            seen = set()
+            for i, key in enumerate(stack):
+                e = entry(key)
+                if key not in seen:
+                    seen.add(key)
+                    e[0] += count
+                    e[1] += count
+                    e[3] += seconds
+                if i:
+                    caller = stack[i - 1]
+                    nc, cc, tt, ct = e[4].get(caller, (0, 0, 0.0, 0.0))
+                    tt += seconds if i == len(stack) - 1 else 0.0
+                    e[4][caller] = (nc + count, cc + count, tt, ct + seconds)
+        return marshal.dumps({key: (cc, nc, tt, ct, callers) for key, (cc, nc, tt, ct, callers) in stats.items()})
+
+
+_cpu_lock = threading.Lock()
+
+
+def sample_cpu(seconds, interval=0.01):
+    """Sample the stacks of all other threads every ``interval`` for ``seconds``.
+
+    Nothing is installed in the interpreter; the profile is taken by this
+    thread alone, so there is no cost before or after. Only one profile
+    runs at a time; a concurrent request raises HTTPError 409.
+    """
+    if not _cpu_lock.acquire(False):
+        raise HTTPError(409, "a CPU profile is already running")
+    try:
+        profile = CPUProfile(interval)
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    profile.add(names.get(ident, str(ident)), frame)
+            profile.samples += 1
+            time.sleep(interval)
+        return profile
+    finally:
+        _cpu_lock.release()
+
+
+class HeapTracer:
+    """Starts and stops tracemalloc and reports snapshots by allocation site.
+
+    Tracing only runs between ``start`` and ``stop``, and stops on its own
+    after ``max_seconds`` so a forgotten session does not keep slowing
+    every allocation. ``diff`` compares against the previous ``diff`` or,
+    for the first one, against the snapshot taken at ``start``.
+    """
+    def __init__(self, max_seconds):
+        self.max_seconds = max_seconds
+        self._baseline = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                raise HTTPError(409, "tracemalloc is already tracing")
+            tracemalloc.start(frames)
+            self._baseline = self._take()
+            self._timer = threading.Timer(self.max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._baseline = None
+            tracemalloc.stop()
+
+    def _take(self):
+        return tracemalloc.take_snapshot().filter_traces(_HEAP_FILTERS)
+
+    def _check(self):
+        if not tracemalloc.is_tracing():
+            raise HTTPError(409, "tracemalloc is not tracing; start it first")
+
+    def snapshot(self, group="lineno", top=50):
+        """Return a text report of the largest live allocation sites."""
+        with self._lock:
+            self._check()
+            stats = self._take().statistics(group)
+        total = sum(s.size for s in stats)
+        return _report(f"# live traced memory: {total / 1024:.1f} KiB in {len(stats)} sites\n", stats[:top])
+
+    def diff(self, group="lineno", top=50):
+        """Return a text report of the allocation sites that changed most since the baseline."""
+        with self._lock:
+            self._check()
+            current = self._take()
+            stats = current.compare_to(self._baseline, group)
+            self._baseline = current
+        change = sum(s.size_diff for s in stats)
+        return _report(f"# traced memory change: {change / 1024:+.1f} KiB\n", stats[:top])
+
+
+def _report(header, stats):
+    lines = [header]
+    for stat in stats:
+        lines.append(f"{stat}\n")
+        if len(stat.traceback) > 1:
+            lines.extend(f"    {line}\n" for line in stat.traceback.format())
+    return "".join(lines).encode()
+
+
+def _number(r, key, default, cast=float):
+    value = r.form.get(key)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise HTTPError(400, f"invalid {key} {value!r}") from None
+
+
+def register(server, path, max_seconds, heap_max_seconds):
+    """Route the profiling endpoints under ``path`` on ``server``.
+
+    ``{path}/cpu?seconds=&interval=&format=collapsed|pstats`` samples every
+    thread for at most ``max_seconds``. ``{path}/heap/start?frames=``,
+    ``{path}/heap?top=&group=``, ``{path}/heap/diff?top=&group=`` and
+    ``{path}/heap/stop`` drive a tracemalloc session.
+    """
+    heap = HeapTracer(heap_max_seconds)
+
+    def cpu_handler(w, r):
+        seconds = min(max(_number(r, "seconds", 10.0), 0.0), max_seconds)
+        interval = min(max(_number(r, "interval", 0.01), 0.001), 1.0)
+        fmt = r.form.get("format", COLLAPSED)
+        if fmt not in (COLLAPSED, PSTATS):
+            raise HTTPError(400, f"unknown profile format {fmt!r}")
+        profile = sample_cpu(seconds, interval)
+        if fmt == PSTATS:
+            w.headers["Content-Type"] = "application/octet-stream"
+            w.headers["Content-Disposition"] = 'attachment; filename="cpu.pstats"'
+            w.write(profile.pstats())
+        else:
+            w.headers["Content-Type"] = "text/plain; charset=utf-8"
+            w.write(profile.collapsed())
+
+    def heap_options(r):
+        group = r.form.get("group", "lineno")
+        if group not in HEAP_GROUPS:
+            raise HTTPError(400, f"unknown heap grouping {group!r}")
+        return group, max(_number(r, "top", 50, int), 1)
+
+    def heap_start_handler(w, r):
+        heap.start(min(max(_number(r, "frames", 1, int), 1), 64))
+        w.headers["Content-Type"] = "text/plain; charset=utf-8"
+        w.write(f"tracemalloc started, stopping after {heap.max_seconds}s at the latest\n")
+
+    def heap_stop_handler(w, r):
+        heap.stop()
+        w.headers["Content-Type"] = "text/plain; charset=utf-8"
+        w.write("tracemalloc stopped\n")
+
+    def heap_handler(w, r):
+        w.headers["Content-Type"] = "text/plain; charset=utf-8"
+        w.write(heap.snapshot(*heap_options(r)))
+
+    def heap_diff_handler(w, r):
+        w.headers["Content-Type"] = "text/plain; charset=utf-8"
+        w.write(heap.diff(*heap_options(r)))
+
+    server.route(path + "/cpu", cpu_handler)
+    server.route(path + "/heap/start", heap_start_handler)
+    server.route(path + "/heap/stop", heap_stop_handler)
+    server.route(path + "/heap", heap_handler)
+    server.route(path + "/heap/diff", heap_diff_handler)
+    return heap
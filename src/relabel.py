@@ -0,0 +1,157 @@
+""" Prometheus-style relabel rules applied to points before samples are built """
+import re
+import threading
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+MEASUREMENT_LABEL = "__measurement__"
+FIELD_LABEL = "__field__"
+
+REPLACE = "replace"
+KEEP = "keep"
+DROP = "drop"
+LABELDROP = "labeldrop"
+LABELKEEP = "labelkeep"
+ACTIONS = (REPLACE, KEEP, DROP, LABELDROP, LABELKEEP)
+
+_DROPPED = object()
+_GROUP_REF = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+
+class RelabelError(ValueError):
+    """A relabel rule that cannot be compiled."""
+
+
+def _replacement_template(replacement, regex):
+    """Turn Prometheus ``$1``/``${name}`` references into a template for ``Match.expand``.
+
+    Raises RelabelError for references to groups ``regex`` does not have.
+    """
+    def group(m):
+        ref = m.group(1) or m.group(2)
+        if ref.isdigit() and int(ref) > regex.groups or not ref.isdigit() and ref not in regex.groupindex:
+            raise RelabelError(f"replacement {replacement!r} refers to unknown group {m.group()!r}")
+        return "\\g<" + ref + ">"
+    return _GROUP_REF.sub(group, replacement.replace("\\", "\\\\"))
+
+
+class RelabelRule:
+    """One compiled rule with Prometheus relabel_config semantics.
+
+    Labels are the point's tags plus ``__measurement__`` and, for rules
+    evaluated per field, ``__field__``. ``regex`` is anchored at both ends
+    and source label values are joined with ``separator``.
+    """
+    def __init__(self, action=REPLACE, source_labels=(), regex="(.*)", target_label="", replacement="$1",
+                 separator=";"):
+        if action not in ACTIONS:
+            raise RelabelError(f"unknown relabel action {action!r}, expected one of {', '.join(ACTIONS)}")
+        if action == REPLACE and not target_label:
+            raise RelabelError("a replace rule needs a target_label")
+        if action in (KEEP, DROP) and not source_labels:
+            raise RelabelError(f"a {action} rule needs source_labels")
+        try:
+            self.regex = re.compile(f"(?:{regex})\\Z")
+        except re.error as e:
+            raise RelabelError(f"invalid relabel regex {regex!r}: {e}") from None
+        self.action = action
+        self.source_labels = tuple(source_labels)
+        self.separator = separator
+        self.target_label = target_label
+        self.replacement = _replacement_template(replacement, self.regex) if action == REPLACE else replacement
+        self.uses_field = FIELD_LABEL in self.source_labels or target_label == FIELD_LABEL
+
+    def apply(self, labels):
+        """Apply the rule to the ``labels`` dict in place; returns False when the point is dropped."""
+        action = self.action
+        if action == LABELDROP or action == LABELKEEP:
+            keep = action == LABELKEEP
+            for name in [n for n in labels if n not in (MEASUREMENT_LABEL, FIELD_LABEL)]:
+                if (self.regex.match(name) is not None) != keep:
+                    del labels[name]
+            return True
+        value = self.separator.join(labels.get(name, "") for name in self.source_labels)
+        m = self.regex.match(value)
+        if action == KEEP:
+            return m is not None
+        if action == DROP:
+            return m is None
+        if m is not None:
+            result = m.expand(self.replacement)
+            if result:
+                labels[self.target_label] = result
+            else:
+                labels.pop(self.target_label, None)
+        return True
+
+
+class Relabeler:
+    """Runs relabel rules over points, caching the outcome per distinct input.
+
+    The outcome depends on tag values as well as keys, so it is cached on
+    (measurement, raw tag tuple), plus the field when any rule reads or
+    writes ``__field__``; the common case is then one dict lookup and a
+    dropped point costs nothing more. The cache is cleared when it reaches
+    ``cache_size`` entries. Labels left starting with ``__`` are removed
+    once all rules have run.
+    """
+    def __init__(self, rules, cache_size=1000000):
+        self.rules = [rule if isinstance(rule, RelabelRule) else RelabelRule(**rule) for rule in rules]
+        self.per_field = any(rule.uses_field for rule in self.rules)
+        self.cache_size = cache_size
+        self.dropped = 0
+        self.misses = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def relabel(self, measurement, tags, field=None):
+        """Return (measurement, tags, field) after relabelling, or None when the point is dropped.
+
+        ``tags`` must be a tuple of (key, value) pairs. ``field`` is only
+        looked at when the rules use ``__field__``.
+        """
+        key = (measurement, tags, field)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._evaluate(measurement, tags, field)
+            with self._lock:
+                self.misses += 1
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+                self._cache[key] = result
+        if result is _DROPPED:
+            self.dropped += 1
+            return None
+        return result
+
+    def _evaluate(self, measurement, tags, field):
+        labels = dict(tags)
+        labels[MEASUREMENT_LABEL] = measurement
+        if field is not None:
+            labels[FIELD_LABEL] = field
+        for rule in self.rules:
+            if not rule.apply(labels):
+                return _DROPPED
+        measurement = labels.get(MEASUREMENT_LABEL, "")
+        if not measurement:
+            return _DROPPED
+        field = labels.get(FIELD_LABEL, field)
+        tags = tuple((k, v) for k, v in labels.items() if not k.startswith("__"))
+        return measurement, tags, field
+
+
+class RelabelCollector:
+    """Exports drop and cache counters of a Relabeler."""
+    def __init__(self, relabeler):
+        self.relabeler = relabeler
+
+    def collect(self):
+        relabeler = self.relabeler
+        yield CounterMetricFamily(
+            "influxdb_relabel_dropped",
+            "Points (or fields, with rules on __field__) dropped by relabel rules.",
+            value=relabeler.dropped)
+        yield CounterMetricFamily(
+            "influxdb_relabel_cache_misses", "Relabel outcomes computed rather than found in the cache.",
+            value=relabeler.misses)
+        yield GaugeMetricFamily(
+            "influxdb_relabel_cache_entries", "Relabel outcomes currently cached.", value=len(relabeler._cache))
@@ -0,0 +1,328 @@
+""" Hash-partitioned sample store with a lock per shard """
+import collections
+import threading
+import time
+
+# Approximate bytes held per series beyond its name and label text: the
+# slotted sample and its floats, the index, expiry bucket and LRU entries,
+# and the rendered line plus its copies in the exposition cache's chunks and
+# body. Measured with tracemalloc on a 200k series store.
+SERIES_OVERHEAD = 700
+
+
+def series_bytes(name, labels):
+    """Estimate the memory one series costs the exporter."""
+    return SERIES_OVERHEAD + len(name) + sum(len(k) + len(v) for k, v in labels)
+
+
+class TimedLock:
+    """A lock that reports how long each contended acquisition waited to ``on_wait(seconds)``.
+
+    Uncontended acquisitions cost one extra non-blocking attempt and are
+    not reported.
+    """
+    __slots__ = ("_lock", "_on_wait")
+
+    def __init__(self, on_wait):
+        self._lock = threading.Lock()
+        self._on_wait = on_wait
+
+    def __enter__(self):
+        lock = self._lock
+        if not lock.acquire(False):
+            start = time.perf_counter()
+            lock.acquire()
+            self._on_wait(time.perf_counter() - start)
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class Shard:
+    """One partition of the store: a series handle -> sample dict and its lock.
+
+    ``index`` maps metric name -> label tuple -> integer series handle; the
+    two levels avoid allocating a key tuple per series. Handles are
+    ``local_number * shard_count + shard_number`` so the owning shard can be
+    recovered from the handle alone.
+
+    ``buckets`` is the expiry index: it maps a time bucket number to a dict
+    keyed by the series handles whose ``expires`` deadline falls in that
+    bucket, so a sweep only touches the series that are actually due.
+
+    ``bytes`` is the estimated footprint of the shard's series (see
+    ``series_bytes``). When LRU tracking is on, ``lru`` orders handles from
+    least to most recently updated.
+
+    When change tracking is on, ``changes`` maps every handle written since
+    the last ``drain_changes`` to its new sample and ``removed`` maps every
+    expired or evicted handle to its (name, labels), so readers can catch up
+    without rescanning the shard. Handles are never reused, so the two never
+    overlap. Once ``removed`` holds ``removed_limit`` handles it is dropped
+    (set to None) rather than grown, and the next reader rescans the shard.
+
+    With ``on_lock_wait`` the lock is a ``TimedLock`` reporting contention.
+
+    ``turn`` is the number of the next numbered write the shard accepts
+    (see ``ShardedSampleStore.upsert_many``), guarded by ``turn_changed``.
+    """
+    def __init__(self, number, count, track_changes=False, track_lru=False, on_lock_wait=None,
+                 removed_limit=100000):
+        self.lock = TimedLock(on_lock_wait) if on_lock_wait is not None else threading.Lock()
+        self.samples = {}
+        self.index = {}
+        self.buckets = {}
+        self.bytes = 0
+        self.lru = collections.OrderedDict() if track_lru else None
+        self.changes = {} if track_changes else None
+        self.removed = {} if track_changes else None
+        self.removed_limit = removed_limit
+        self.turn = 0
+        self.turn_changed = threading.Condition(threading.Lock())
+        self._next_handle = number
+        self._stride = count
+
+    def new_handle(self):
+        """Allocate a series handle. Called with the lock held."""
+        h = self._next_handle
+        self._next_handle += self._stride
+        return h
+
+    def __len__(self):
+        return len(self.samples)
+
+    def drain_changes(self):
+        """Return and reset the changes and removals recorded since the last call.
+
+        Returns (changes, removed, live). ``live`` is None unless the removal
+        log overflowed; it is then the set of handles still stored, and every
+        other handle the reader holds for this shard is gone.
+        """
+        with self.lock:
+            changes, self.changes = self.changes, {}
+            removed, self.removed = self.removed, {}
+            live = set(self.samples) if removed is None else None
+        return changes, removed or {}, live
+
+
+class ShardedSampleStore:
+    """Samples keyed by series handle, split over ``shards`` independently locked dicts.
+
+    Writers only lock the shards their samples hash to, and scrapes and
+    expiry sweeps hold one shard at a time, so ingest from several threads
+    does not serialise on a single lock. Every sample carries an absolute
+    ``expires`` deadline (seconds since the epoch) which is indexed in
+    ``bucket_seconds`` wide buckets.
+
+    With a ``memory_budget`` (bytes, 0 for none) each shard keeps its series
+    in least-recently-updated order and ``enforce_budget`` evicts from the
+    cold end of any shard over its even share of the budget, down to
+    ``low_water`` of that share.
+
+    ``on_lock_wait(seconds)`` is called after every contended shard lock
+    acquisition with the time spent waiting. ``removed_limit`` caps each
+    shard's log of removals between two ``drain_changes`` calls (see
+    ``Shard``), so expiry and eviction free memory even without scrapes.
+    """
+    def __init__(self, shards=1, bucket_seconds=5, track_changes=False, memory_budget=0, low_water=0.95,
+                 on_lock_wait=None, removed_limit=100000):
+        if shards < 1:
+            raise ValueError(f"shards must be positive, got {shards}")
+        if bucket_seconds <= 0:
+            raise ValueError(f"bucket_seconds must be positive, got {bucket_seconds}")
+        self.shards = [Shard(i, shards, track_changes, memory_budget > 0, on_lock_wait, removed_limit)
+                       for i in range(shards)]
+        self.bucket_seconds = bucket_seconds
+        self.memory_budget = memory_budget
+        self.low_water = low_water
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    @property
+    def estimated_bytes(self):
+        return sum(shard.bytes for shard in self.shards)
+
+    def shard_for(self, series_id):
+        """Return the shard owning the series handle ``series_id``."""
+        return self.shards[series_id % len(self.shards)]
+
+    def get(self, series_id):
+        shard = self.shard_for(series_id)
+        with shard.lock:
+            return shard.samples.get(series_id)
+
+    def lookup(self, name, labels):
+        """Return the current sample for a series key, or None."""
+        shard = self.shards[hash((name, labels)) % len(self.shards)]
+        with shard.lock:
+            h = shard.index.get(name, {}).get(labels)
+            return None if h is None else shard.samples.get(h)
+
+    def contains(self, name, labels):
+        """Whether the series exists. Reads without locking, so it may lag concurrent writers."""
+        shard = self.shards[hash((name, labels)) % len(self.shards)]
+        series = shard.index.get(name)
+        return series is not None and labels in series
+
+    def series_count(self, name):
+        """Number of series named ``name``, read without locking."""
+        count = 0
+        for shard in self.shards:
+            series = shard.index.get(name)
+            if series is not None:
+                count += len(series)
+        return count
+
+    def upsert_many(self, samples, number=None):
+        """Insert or replace ``samples``, taking each shard's lock once.
+
+        Each sample's ``id`` is set to its series handle. Writers that pass
+        consecutive ``number``s from 0 (see ``IngestQueue.get_numbered_batch``)
+        are applied to every shard in number order, so a series always ends
+        up with the value of the latest write even when the writes come from
+        several threads; each must be made exactly once.
+        """
+        n = len(self.shards)
+        if n == 1:
+            groups = [samples]
+        else:
+            groups = [[] for _ in range(n)]
+            for sample in samples:
+                groups[hash((sample.name, sample.labels)) % n].append(sample)
+        for shard, group in zip(self.shards, groups):
+            if number is None:
+                if group:
+                    self._upsert(shard, group)
+                continue
+            with shard.turn_changed:
+                while shard.turn != number:
+                    shard.turn_changed.wait()
+            try:
+                if group:
+                    self._upsert(shard, group)
+            finally:
+                with shard.turn_changed:
+                    shard.turn += 1
+                    shard.turn_changed.notify_all()
+
+    def _upsert(self, shard, samples):
+        width = self.bucket_seconds
+        with shard.lock:
+            d = shard.samples
+            index = shard.index
+            buckets = shard.buckets
+            changes = shard.changes
+            lru = shard.lru
+            for sample in samples:
+                series = index.get(sample.name)
+                if series is None:
+                    series = index[sample.name] = {}
+                sid = series.get(sample.labels)
+                if sid is None:
+                    sid = series[sample.labels] = shard.new_handle()
+                    shard.bytes += series_bytes(sample.name, sample.labels)
+                sample.id = sid
+                if changes is not None:
+                    changes[sid] = sample
+                b = int(sample.expires // width)
+                old = d.get(sid)
+                d[sid] = sample
+                if lru is not None:
+                    if old is None:
+                        lru[sid] = None
+                    else:
+                        lru.move_to_end(sid)
+                if old is not None:
+                    old_b = int(old.expires // width)
+                    if old_b == b:
+                        continue
+                    old_bucket = buckets.get(old_b)
+                    if old_bucket is not None:
+                        old_bucket.pop(sid, None)
+                bucket = buckets.get(b)
+                if bucket is None:
+                    buckets[b] = bucket = {}
+                bucket[sid] = None
+
+    def _unlink(self, shard, sid, sample):
+        """Drop a removed series from the index and LRU and log the removal. Called with the lock held."""
+        if shard.changes is not None:
+            shard.changes.pop(sid, None)
+            removed = shard.removed
+            if removed is not None:
+                if len(removed) < shard.removed_limit:
+                    removed[sid] = (sample.name, sample.labels)
+                else:
+                    shard.removed = None
+        series = shard.index[sample.name]
+        del series[sample.labels]
+        if not series:
+            del shard.index[sample.name]
+        if shard.lru is not None:
+            shard.lru.pop(sid, None)
+        shard.bytes -= series_bytes(sample.name, sample.labels)
+
+    def expire(self, now):
+        """Drop samples whose bucket ended before ``now``; returns the number removed.
+
+        Work is proportional to the number of expiring series, not the store size.
+        """
+        limit = int(now // self.bucket_seconds)
+        removed = 0
+        for shard in self.shards:
+            with shard.lock:
+                due = [b for b in shard.buckets if b < limit]
+                d = shard.samples
+                for b in due:
+                    for sid in shard.buckets.pop(b):
+                        self._unlink(shard, sid, d.pop(sid))
+                        removed += 1
+        return removed
+
+    def enforce_budget(self):
+        """Evict least-recently-updated series while over the memory budget; returns the number evicted."""
+        if not self.memory_budget:
+            return 0
+        share = self.memory_budget / len(self.shards)
+        target = share * self.low_water
+        width = self.bucket_seconds
+        evicted = 0
+        for shard in self.shards:
+            if shard.bytes <= share:
+                continue
+            with shard.lock:
+                lru = shard.lru
+                d = shard.samples
+                while shard.bytes > target and lru:
+                    sid, _ = lru.popitem(last=False)
+                    sample = d.pop(sid)
+                    b = int(sample.expires // width)
+                    bucket = shard.buckets.get(b)
+                    if bucket is not None:
+                        bucket.pop(sid, None)
+                        if not bucket:
+                            del shard.buckets[b]
+                    self._unlink(shard, sid, sample)
+                    evicted += 1
+        return evicted
+
+    def families(self):
+        """Return samples grouped by metric name, walking one shard at a time."""
+        families = {}
+        for shard in self.shards:
+            with shard.lock:
+                d = shard.samples
+                for name, series in shard.index.items():
+                    family = families.get(name)
+                    if family is None:
+                        family = families[name] = []
+                    family.extend(d[h] for h in series.values())
+        return families
+
+    def values(self):
+        """Iterate all samples, copying one shard at a time under its lock."""
+        for shard in self.shards:
+            with shard.lock:
+                samples = list(shard.samples.values())
+            yield from samples
@@ -0,0 +1,46 @@
+""" Metric and label name sanitising with a bounded cache """
+import functools
+import re
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import config
+
+_VALID = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+_ASCII_TABLE = str.maketrans({chr(c): "_" for c in range(128) if chr(c) not in _VALID})
+_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def sanitize_name(s):
+    """Replace every character outside [a-zA-Z0-9_] with "_" and prefix a leading digit with "_"."""
+    if s.isascii():
+        s = s.translate(_ASCII_TABLE)
+    else:
+        s = _INVALID.sub("_", s)
+    if s and "0" <= s[0] <= "9":
+        s = "_" + s
+    return s
+
+
+# Metric and tag names repeat constantly, so the sanitised form is cached
+# keyed on the raw name. lru_cache is implemented in C and thread-safe.
+replace_invalid_chars = functools.lru_cache(maxsize=config.sanitizeCacheSize)(sanitize_name)
+
+
+class CacheCollector:
+    """Exports hit/miss/eviction counters of the name sanitising cache."""
+    def __init__(self, cached=replace_invalid_chars):
+        self.cached = cached
+
+    def collect(self):
+        info = self.cached.cache_info()
+        yield CounterMetricFamily(
+            "influxdb_sanitize_cache_hits", "Name sanitising cache hits.", value=info.hits)
+        yield CounterMetricFamily(
+            "influxdb_sanitize_cache_misses", "Name sanitising cache misses.", value=info.misses)
+        # Entries only ever leave the cache by eviction, so every miss that is
+        # no longer resident was evicted.
+        yield CounterMetricFamily(
+            "influxdb_sanitize_cache_evictions", "Name sanitising cache evictions.",
+            value=info.misses - info.currsize)
+        yield GaugeMetricFamily(
+            "influxdb_sanitize_cache_entries", "Names currently held in the sanitising cache.",
+            value=info.currsize)
@@ -0,0 +1,64 @@
+""" Compact series representation: slotted samples and interned label sets """
+import sys
+
+
+class InfluxDBSample:
+    """Represents a sample from InfluxDB.
+
+    ``labels`` is an interned, sorted tuple of (name, value) pairs shared by
+    every sample with the same tag set. ``id`` is the integer series handle
+    assigned by the sample store.
+    """
+    __slots__ = ("id", "name", "labels", "value", "timestamp", "expires")
+
+    def __init__(self, name, timestamp, value, labels, expires=float("inf")):
+        self.id = None
+        self.name = name
+        self.labels = labels
+        self.value = value
+        self.timestamp = timestamp
+        self.expires = expires
+
+    def __repr__(self):
+        return f"InfluxDBSample({self.name!r}, {self.timestamp!r}, {self.value!r}, {self.labels!r})"
+
+
+class LabelSetTable:
+    """Interns label sets so identical tag sets share one tuple.
+
+    Lookups are keyed on the raw (key, value) tag pairs as they arrive from the
+    parser, so a hit skips sanitising, de-duplicating and sorting the tags.
+    Label names and values are ``sys.intern``-ed. The table is only a cache:
+    when it grows past ``max_size`` it is cleared, which costs sharing but
+    never correctness because samples hold their own reference to the tuple.
+    """
+    def __init__(self, sanitize, max_size=1000000):
+        self.sanitize = sanitize
+        self.max_size = max_size
+        self._by_raw = {}
+        self._canonical = {}
+
+    def __len__(self):
+        return len(self._canonical)
+
+    def intern(self, tags):
+        """Return the canonical label tuple for an iterable of raw tag pairs."""
+        raw = tuple(tags)
+        labels = self._by_raw.get(raw)
+        if labels is None:
+            labels = self._build(raw)
+        return labels
+
+    def _build(self, raw):
+        pairs = {}
+        for key, value in raw:
+            if key == "__name__":
+                continue
+            pairs[sys.intern(self.sanitize(key))] = sys.intern(value)
+        labels = tuple(sorted(pairs.items()))
+        if len(self._by_raw) >= self.max_size:
+            self._by_raw.clear()
+            self._canonical.clear()
+        labels = self._canonical.setdefault(labels, labels)
+        self._by_raw[raw] = labels
+        return labels
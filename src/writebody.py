@@ -0,0 +1,479 @@
+""" Streaming, size-limited reading and decompression of /write request bodies """
+import threading
+import time
+import zlib
+from prometheus_client.core import CounterMetricFamily
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+IDENTITY = "identity"
+
+
+class BodyTooLarge(Exception):
+    """The request body, compressed or decompressed, exceeded the configured limit."""
+    def __init__(self, limit):
+        super().__init__(f"request body exceeds {limit} bytes")
+        self.limit = limit
+
+
+class DecodeError(ValueError):
+    """The request body could not be decompressed."""
+
+
+class UnsupportedEncoding(DecodeError):
+    """The Content-Encoding has no registered decoder."""
+    def __init__(self, encoding):
+        super().__init__(f"unsupported content encoding {encoding!r}")
+        self.encoding = encoding
+
+
+def iter_chunks(body, chunk_size):
+    """Yield ``body`` in pieces of at most ``chunk_size`` bytes.
+
+    ``body`` is either a bytes-like object or a file-like object with a
+    ``read(n)`` method, which is read incrementally.
+    """
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        view = memoryview(body)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+        return
+    while True:
+        data = body.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+class _Identity:
+    def __init__(self, chunk_size, max_size):
+        pass
+
+    def decompress(self, data):
+        return (data,) if data else ()
+
+    def flush(self):
+        return ()
+
+
+class _Inflate:
+    """Incrementally decompress a zlib-family stream of concatenated members.
+
+    Output is produced at most ``chunk_size`` bytes at a time, so a small
+    compressed body cannot expand into one huge buffer.
+    """
+    def __init__(self, chunk_size, wbits, fmt):
+        self.chunk_size = chunk_size
+        self.wbits = wbits
+        self.fmt = fmt
+        self.d = zlib.decompressobj(wbits)
+        self.in_member = False
+
+    def decompress(self, data):
+        try:
+            while data:
+                self.in_member = True
+                out = self.d.decompress(data, self.chunk_size)
+                if out:
+                    yield out
+                if self.d.eof:
+                    # Concatenated members are valid; start on the next one.
+                    data = self.d.unused_data
+                    self.d = zlib.decompressobj(self.wbits)
+                    self.in_member = False
+                else:
+                    data = self.d.unconsumed_tail
+        except zlib.error as e:
+            raise DecodeError(f"invalid {self.fmt} data: {e}") from None
+
+    def flush(self):
+        # Output held back by the chunk_size cap is released without more input.
+        try:
+            while self.in_member and not self.d.eof:
+                out = self.d.decompress(b"", self.chunk_size)
+                if not out:
+                    break
+                yield out
+        except zlib.error as e:
+            raise DecodeError(f"invalid {self.fmt} data: {e}") from None
+        if self.in_member and not self.d.eof:
+            raise DecodeError(f"unexpected end of {self.fmt} data")
+
+
+def _gunzip(chunk_size, max_size):
+    return _Inflate(chunk_size, zlib.MAX_WBITS | 16, "gzip")
+
+
+def _deflate(chunk_size, max_size):
+    # HTTP "deflate" is the zlib format (RFC 1950), not a raw deflate stream.
+    return _Inflate(chunk_size, zlib.MAX_WBITS, "deflate")
+
+
+_ZSTD_MAGIC = 0xFD2FB528
+# Skippable frames use magics 0x184D2A50 to 0x184D2A5F.
+_ZSTD_SKIPPABLE = 0x184D2A50
+
+
+class _ZstdFrames:
+    """Follows the frame and block headers of a zstd stream to tell whether it ends mid-frame.
+
+    ``stream_reader`` returns whatever a truncated frame decodes to without
+    an error, so the end of the body is checked against the frame layout.
+    """
+    def __init__(self):
+        self.head = b""
+        self.need = 4
+        self.state = self._magic
+        self.skip = 0
+        self.checksum = 0
+
+    @property
+    def in_frame(self):
+        return self.state != self._magic or bool(self.head) or self.skip > 0
+
+    def feed(self, data):
+        pos = 0
+        while pos < len(data):
+            if self.skip:
+                step = min(self.skip, len(data) - pos)
+                self.skip -= step
+                pos += step
+                continue
+            take = self.need - len(self.head)
+            self.head += bytes(data[pos:pos + take])
+            pos += take
+            if len(self.head) < self.need:
+                return
+            head, self.head = self.head, b""
+            self.state(head)
+
+    def _expect(self, need, state):
+        self.need = need
+        self.state = state
+
+    def _magic(self, head):
+        magic = int.from_bytes(head, "little")
+        if magic & 0xFFFFFFF0 == _ZSTD_SKIPPABLE:
+            self._expect(4, self._skippable)
+        elif magic == _ZSTD_MAGIC:
+            self._expect(1, self._descriptor)
+        else:
+            raise DecodeError("invalid zstd data: unknown frame magic")
+
+    def _skippable(self, head):
+        self.skip = int.from_bytes(head, "little")
+        self._expect(4, self._magic)
+
+    def _descriptor(self, head):
+        fhd = head[0]
+        single_segment = fhd >> 5 & 1
+        self.checksum = fhd >> 2 & 1
+        size = (0, 1, 2, 4)[fhd & 3] + (single_segment, 2, 4, 8)[fhd >> 6] + (not single_segment)
+        if size:
+            self._expect(size, self._frame_header)
+        else:
+            self._expect(3, self._block)
+
+    def _frame_header(self, head):
+        self._expect(3, self._block)
+
+    def _block(self, head):
+        header = int.from_bytes(head, "little")
+        block_type = header >> 1 & 3
+        if block_type == 3:
+            raise DecodeError("invalid zstd data: reserved block type")
+        # RLE blocks carry a single byte repeated Block_Size times.
+        self.skip = 1 if block_type == 1 else header >> 3
+        if header & 1:
+            self.skip += 4 * self.checksum
+            self._expect(4, self._magic)
+
+
+class _Starved(Exception):
+    """Raised to ``stream_reader`` when the pushed input runs out mid-body."""
+
+
+class _ZstdInput:
+    def __init__(self):
+        self.data = b""
+        self.eof = False
+
+    def read(self, n):
+        if not self.data:
+            if self.eof:
+                return b""
+            raise _Starved
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+
+class _Unzstd:
+    """Decompress zstd frames at most ``chunk_size`` bytes at a time.
+
+    Unlike zlib, zstd decompressobj has no output cap and a zstd block can
+    expand ~32768x, so output is pulled with ``stream_reader(...).read1``
+    instead. The reader asks for input only when it has no output to give,
+    and is interrupted with ``_Starved`` until the next piece is pushed.
+    """
+    def __init__(self, chunk_size, max_size):
+        self.chunk_size = chunk_size
+        self.input = _ZstdInput()
+        self.reader = zstandard.ZstdDecompressor().stream_reader(self.input, read_across_frames=True)
+        self.frames = _ZstdFrames()
+
+    def decompress(self, data):
+        self.frames.feed(data)
+        self.input.data += bytes(data)
+        try:
+            yield from self._read()
+        except _Starved:
+            pass
+
+    def flush(self):
+        self.input.eof = True
+        yield from self._read()
+        if self.frames.in_frame:
+            raise DecodeError("unexpected end of zstd data")
+
+    def _read(self):
+        try:
+            while True:
+                out = self.reader.read1(self.chunk_size)
+                if not out:
+                    return
+                yield out
+        except zstandard.ZstdError as e:
+            raise DecodeError(f"invalid zstd data: {e}") from None
+
+
+def _snappy_length(data):
+    """Read the uncompressed length varint that starts a snappy block."""
+    length = shift = 0
+    for i, byte in enumerate(data[:5]):
+        length |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return length
+        shift += 7
+    raise DecodeError("invalid snappy data: bad length header")
+
+
+class _Unsnappy:
+    # Snappy block format (as sent by Prometheus remote write) cannot be
+    # decoded incrementally; the body is collected and its declared length
+    # is checked before inflating.
+    def __init__(self, chunk_size, max_size):
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.parts = []
+
+    def decompress(self, data):
+        self.parts.append(bytes(data))
+        return ()
+
+    def flush(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        if not data:
+            return
+        if _snappy_length(data) > self.max_size:
+            raise BodyTooLarge(self.max_size)
+        try:
+            out = snappy.uncompress(data)
+        except Exception as e:
+            raise DecodeError(f"invalid snappy data: {str(e) or type(e).__name__}") from None
+        view = memoryview(out)
+        for start in range(0, len(view), self.chunk_size):
+            yield bytes(view[start:start + self.chunk_size])
+
+
+# Content-Encoding -> decoder(chunk_size, max_size) returning an object whose
+# decompress(data) and flush() return iterables of decoded chunks.
+DECODERS = {IDENTITY: _Identity, "gzip": _gunzip, "deflate": _deflate}
+if zstandard is not None:
+    DECODERS["zstd"] = _Unzstd
+if snappy is not None:
+    DECODERS["snappy"] = _Unsnappy
+
+
+def register_decoder(encoding, decoder):
+    """Add or replace the decoder used for a Content-Encoding."""
+    DECODERS[encoding.lower()] = decoder
+
+
+class DecodeStats:
+    """Per-encoding request, byte and time totals."""
+    __slots__ = ("requests", "errors", "bytes_in", "bytes_out", "seconds")
+
+    def __init__(self):
+        self.requests = self.errors = self.bytes_in = self.bytes_out = 0
+        self.seconds = 0.0
+
+
+STATS = {}
+_stats_lock = threading.Lock()
+
+
+def _record(encoding, bytes_in, bytes_out, seconds, failed):
+    with _stats_lock:
+        stats = STATS.get(encoding)
+        if stats is None:
+            stats = STATS[encoding] = DecodeStats()
+        stats.requests += 1
+        stats.errors += failed
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.seconds += seconds
+
+
+class BodyStats:
+    """Totals of one decoded body, filled in once decoding ends.
+
+    ``read_seconds`` is the time spent waiting for the raw body and
+    ``seconds`` the decompressor's own time.
+    """
+    __slots__ = ("bytes_in", "bytes_out", "seconds", "read_seconds")
+
+    def __init__(self):
+        self.bytes_in = self.bytes_out = 0
+        self.seconds = self.read_seconds = 0.0
+
+
+class BodyDecoder:
+    """Decodes one request body pushed to it as it arrives.
+
+    ``decode`` takes the next piece of the raw body and ``finish`` marks its
+    end; both return an iterator over the decoded output in chunks of at most
+    ``chunk_size`` bytes, and ``max_size`` applies to the raw and the decoded
+    bytes alike. Raises ``UnsupportedEncoding`` immediately, and
+    ``BodyTooLarge`` or ``DecodeError`` while iterating. ``close`` records the
+    totals per encoding and in ``stats``, and must be called once decoding
+    stops, successfully or not.
+    """
+    def __init__(self, content_encoding, max_size, chunk_size=64 * 1024, stats=None):
+        self.encoding = (content_encoding or IDENTITY).strip().lower()
+        factory = DECODERS.get(self.encoding)
+        if factory is None:
+            raise UnsupportedEncoding(self.encoding)
+        self._decoder = factory(chunk_size, max_size)
+        self.max_size = max_size
+        self.stats = stats
+        self.bytes_in = self.bytes_out = 0
+        self.seconds = 0.0
+        self.failed = False
+        self._closed = False
+
+    def decode(self, data):
+        self.bytes_in += len(data)
+        if self.bytes_in > self.max_size:
+            self.failed = True
+            raise BodyTooLarge(self.max_size)
+        return self._run(self._decoder.decompress(data))
+
+    def finish(self):
+        return self._run(self._decoder.flush())
+
+    def _run(self, pieces):
+        clock = time.perf_counter
+        pieces = iter(pieces)
+        while True:
+            start = clock()
+            try:
+                data = next(pieces)
+            except StopIteration:
+                return
+            except (DecodeError, BodyTooLarge):
+                self.failed = True
+                raise
+            finally:
+                self.seconds += clock() - start
+            self.bytes_out += len(data)
+            if self.bytes_out > self.max_size:
+                self.failed = True
+                raise BodyTooLarge(self.max_size)
+            yield data
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        _record(self.encoding, self.bytes_in, self.bytes_out, self.seconds, self.failed)
+        if self.stats is not None:
+            self.stats.bytes_in = self.bytes_in
+            self.stats.bytes_out = self.bytes_out
+            self.stats.seconds = self.seconds
+
+
+class _Meter:
+    """Wraps the raw chunk iterator, counting the time spent reading it."""
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.seconds = 0.0
+
+    def __iter__(self):
+        clock = time.perf_counter
+        chunks = iter(self._chunks)
+        while True:
+            start = clock()
+            chunk = next(chunks, None)
+            self.seconds += clock() - start
+            if chunk is None:
+                return
+            yield chunk
+
+
+def _decoded(decoder, meter, stats):
+    try:
+        for chunk in meter:
+            yield from decoder.decode(chunk)
+        yield from decoder.finish()
+    finally:
+        decoder.close()
+        if stats is not None:
+            stats.read_seconds = meter.seconds
+
+
+def iter_decoded(body, content_encoding, max_size, chunk_size=64 * 1024, stats=None):
+    """Yield the decoded request body in chunks, enforcing ``max_size``.
+
+    ``body`` is read with ``iter_chunks`` and pushed through a
+    ``BodyDecoder``, so peak memory per request stays bounded by
+    ``chunk_size`` plus the longest line regardless of the body size
+    (snappy, which has no streaming block format, excepted). Raises
+    ``UnsupportedEncoding`` immediately, and ``BodyTooLarge`` or
+    ``DecodeError`` while iterating. A ``BodyStats`` passed as ``stats``
+    receives this body's byte counts and timings.
+    """
+    decoder = BodyDecoder(content_encoding, max_size, chunk_size, stats)
+    return _decoded(decoder, _Meter(iter_chunks(body, chunk_size)), stats)
+
+
+class DecodeCollector:
+    """Exports per-encoding totals of the /write body decoders."""
+    def collect(self):
+        with _stats_lock:
+            stats = [(encoding, s.requests, s.errors, s.bytes_in, s.bytes_out, s.seconds)
+                     for encoding, s in sorted(STATS.items())]
+        families = [
+            CounterMetricFamily("influxdb_write_decode_requests", "Write requests decoded per content encoding.",
+                                labels=["encoding"]),
+            CounterMetricFamily("influxdb_write_decode_errors", "Write bodies that failed to decode per content encoding.",
+                                labels=["encoding"]),
+            CounterMetricFamily("influxdb_write_decode_bytes_in", "Encoded write body bytes read per content encoding.",
+                                labels=["encoding"]),
+            CounterMetricFamily("influxdb_write_decode_bytes_out", "Decoded write body bytes produced per content encoding.",
+                                labels=["encoding"]),
+            CounterMetricFamily("influxdb_write_decode_seconds", "Time spent decoding write bodies per content encoding.",
+                                labels=["encoding"]),
+        ]
+        for encoding, *values in stats:
+            for family, value in zip(families, values):
+                family.add_metric([encoding], value)
+        yield from families
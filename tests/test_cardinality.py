@@ -0,0 +1,73 @@
+from cardinality import SpaceSaving, CardinalityLimiter, LimiterCollector
+from samplestore import ShardedSampleStore
+from series import InfluxDBSample
+
+
+def test_space_saving_keeps_heavy_hitters():
+    """
+    Test case for the space-saving counter keeping frequent items among many rare ones.
+    """
+    top = SpaceSaving(3)
+    for i in range(300):
+        top.add("hot")
+        top.add(f"rare{i}")
+        if i % 2:
+            top.add("warm")
+    (item, count, error), *_ = top.top()
+    assert item == "hot"
+    assert count - error <= 300 <= count
+    assert "warm" in dict((i, c) for i, c, _ in top.top())
+    assert len(top.counts) == 3
+
+
+def admit_all(limiter, store, name, labelsets):
+    """Admit series one by one, landing each in the store like the ingest workers would."""
+    admitted = []
+    for labels in labelsets:
+        if limiter.admit(name, labels, "m"):
+            store.upsert_many([InfluxDBSample(name, 0, 1.0, labels, 300)])
+            limiter.reset_pending()
+            admitted.append(labels)
+    return admitted
+
+
+def test_limiter_per_metric_and_override():
+    """
+    Test case for per-metric limits, overrides and existing series always being admitted.
+    """
+    store = ShardedSampleStore(4)
+    limiter = CardinalityLimiter(store, per_metric=3, overrides={"big": 5}, top_k=0)
+    labelsets = [(("id", str(i)),) for i in range(10)]
+    assert len(admit_all(limiter, store, "small", labelsets)) == 3
+    assert len(admit_all(limiter, store, "big", labelsets)) == 5
+    assert limiter.admit("small", labelsets[0], "m")
+    assert limiter.rejected == {"metric": 12, "global": 0}
+
+
+def test_limiter_counts_series_not_yet_stored():
+    """
+    Test case for counting admitted series that are still on their way to the store.
+    """
+    store = ShardedSampleStore(2)
+    limiter = CardinalityLimiter(store, per_metric=2, top_k=0)
+    labelsets = [(("id", str(i)),) for i in range(4)]
+    assert [limiter.admit("m", labels, "m") for labels in labelsets] == [True, True, False, False]
+    assert limiter.admit("m", labelsets[1], "m")
+    limiter.reset_pending()
+    assert limiter.admit("m", labelsets[2], "m")
+
+
+def test_limiter_global_limit_and_collector():
+    """
+    Test case for the global limit and the exported counters and heavy hitters.
+    """
+    store = ShardedSampleStore(2)
+    limiter = CardinalityLimiter(store, global_limit=4, top_k=5)
+    for i in range(3):
+        admit_all(limiter, store, f"m{i}", [(("host", "a"), ("req", f"{i}-{j}")) for j in range(2)])
+    assert len(store) == 4
+    values = {m.name: {tuple(s.labels.values()): s.value for s in m.samples} for m in LimiterCollector(limiter).collect()}
+    assert values["influxdb_cardinality_rejected_samples"] == {("metric",): 0, ("global",): 2}
+    assert values["influxdb_cardinality_top_measurement_new_series"] == {("m",): 6}
+    # "host=a" repeats, so only the request ID tag is credited with new values.
+    assert values["influxdb_cardinality_top_tag_key_new_values"] == {("req",): 6, ("host",): 1}
@@ -0,0 +1,90 @@
+import pytest
+from columnar import ColumnParser
+from lineprotocol import LineProtocolError, parse_points
+from relabel import Relabeler
+from series import LabelSetTable
+
+
+def sanitize(s):
+    return s.replace("-", "_")
+
+
+def parse(parser, buf, multiplier=1, now=7):
+    batch, _ = parser.parse(buf, multiplier, now, 300, {"short": 10})
+    return batch
+
+
+def expected(buf, multiplier=1, now=7):
+    """The (name, labels, value, timestamp) of each sample the point parser gives for ``buf``."""
+    precision = {1: "ns", 10**9: "s"}[multiplier]
+    samples = []
+    for measurement, tags, fields, ts in parse_points(buf, precision, now):
+        for field, v in fields.items():
+            if isinstance(v, str):
+                continue
+            name = sanitize(measurement if field == "value" else measurement + "_" + field)
+            samples.append((name, tuple(sorted(tags)), float(v), ts / 1e9))
+    return samples
+
+
+def test_columns_match_point_parser():
+    """
+    Test case for the fast path and the first-seen path giving the samples the point parser gives.
+    """
+    buf = (b"cpu,host=a value=1.5,idle=2i 1633085189\n"
+           b"cpu,host=a value=-3,idle=+4i 1633085190\n"
+           b"# comment\n"
+           b"mem-x,host=b free=1e3\n"
+           b'cpu,host=a value=5,note="x y" 1633085191\n')
+    parser = ColumnParser(LabelSetTable(sanitize), sanitize)
+    batch = parse(parser, buf, 10**9)
+    samples = batch.samples()
+    assert [(s.name, s.labels, s.value, s.timestamp) for s in samples] == expected(buf, 10**9)
+    assert [s.expires - s.timestamp for s in samples] == [300.0] * len(samples)
+    assert batch.points == 4
+    assert samples[0].labels is samples[2].labels
+
+
+def test_expiry_overrides_per_measurement():
+    """
+    Test case for expiry overrides applying to the measurement of each point.
+    """
+    parser = ColumnParser(LabelSetTable(sanitize), sanitize)
+    batch = parse(parser, b"short v=1 1000000000\nshort v=2 2000000000\nlong v=3 1000000000\n")
+    assert list(batch.expires) == [11.0, 12.0, 301.0]
+
+
+@pytest.mark.parametrize("line", [
+    b"m b=t 1", b"m u=3u 1", b"m f=1.5i 1", b"m f=inf 1", b"m f=99999999999999999999i 1", b"m f=1 9223372036854775808",
+])
+def test_unconverted_values_fall_back(line):
+    """
+    Test case for buffers with values the bulk conversion does not take being handed back.
+    """
+    parser = ColumnParser(LabelSetTable(sanitize), sanitize)
+    batch, lineno = parser.parse(b"m f=1 1\n" + line + b"\n", 1, 0, 300, {})
+    assert batch is None
+    assert lineno == 2
+
+
+def test_errors_report_line_numbers():
+    """
+    Test case for lines the point parser rejects raising with their line number.
+    """
+    parser = ColumnParser(LabelSetTable(sanitize), sanitize)
+    with pytest.raises(LineProtocolError) as e:
+        parser.parse(b"m f=1 1\nm f=1=2 1\n", 1, 0, 300, {}, lineno=10)
+    assert e.value.lineno == 12
+
+
+def test_relabel_drops_are_cached():
+    """
+    Test case for points dropped by relabel rules being skipped from the series cache.
+    """
+    relabeler = Relabeler([{"action": "drop", "source_labels": ["host"], "regex": "b"}])
+    parser = ColumnParser(LabelSetTable(sanitize), sanitize, relabeler)
+    batch = parse(parser, b"m,host=a f=1 1\nm,host=b f=2 1\nm,host=b f=3 2\n")
+    assert [s.value for s in batch.samples()] == [1.0]
+    assert batch.points == 3
+    assert relabeler.dropped == 2
+    assert relabeler.misses == 2
@@ -0,0 +1,83 @@
+import socket
+import pytest
+from connections import BufferPool, UDPConn, listen_udp
+
+
+@pytest.fixture
+def conn():
+    conn = UDPConn(("127.0.0.1", 0))
+    yield conn
+    conn.close()
+
+
+def send_all(conn, datagrams):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for datagram in datagrams:
+            s.sendto(datagram, conn.sock.getsockname())
+
+
+def test_receive_batch_drains_queued_datagrams(conn):
+    """
+    Test case for one call returning every queued datagram, sliced to its length.
+    """
+    datagrams = [b"a v=1", b"bb v=22\n", b"c" * 1000]
+    send_all(conn, datagrams)
+    pool = BufferPool(8, size=2048)
+    batch = conn.receive_batch(pool)
+    assert [len(view) for view in batch] == [len(d) for d in datagrams]
+    assert [bytes(view) for view in batch] == datagrams
+
+
+def test_receive_batch_reuses_pool_buffers(conn):
+    """
+    Test case for batches landing in the same preallocated buffers, at most len(pool) per call.
+    """
+    pool = BufferPool(2, size=64)
+    send_all(conn, [b"one", b"two", b"three"])
+    first = conn.receive_batch(pool)
+    assert [bytes(view) for view in first] == [b"one", b"two"]
+    assert [view.obj for view in first] == pool.buffers
+    second = conn.receive_batch(pool)
+    assert [bytes(view) for view in second] == [b"three"]
+    assert second[0].obj is pool.buffers[0]
+    # Slices of an earlier batch see the buffers being overwritten.
+    assert bytes(first[0]) == b"thr"
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="platform has no SO_REUSEPORT")
+def test_listen_udp_shares_the_port_with_reuseport():
+    """
+    Test case for several sockets bound to one address with SO_REUSEPORT, and a single one without it.
+    """
+    port = free_udp_port()
+    conns = listen_udp(f"127.0.0.1:{port}", 3)
+    try:
+        assert len(conns) == 3
+        assert {conn.sock.getsockname() for conn in conns} == {("127.0.0.1", port)}
+        assert all(conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT) for conn in conns)
+    finally:
+        for conn in conns:
+            conn.close()
+    [conn] = listen_udp(f"127.0.0.1:{port}")
+    try:
+        assert not conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+    finally:
+        conn.close()
+
+
+def test_listen_udp_falls_back_to_one_socket(monkeypatch):
+    """
+    Test case for platforms without SO_REUSEPORT getting a single socket.
+    """
+    monkeypatch.delattr(socket, "SO_REUSEPORT", raising=False)
+    conns = listen_udp(f"127.0.0.1:{free_udp_port()}", 4, reuse_port=True)
+    try:
+        assert len(conns) == 1
+    finally:
+        conns[0].close()
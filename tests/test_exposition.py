@@ -0,0 +1,231 @@
+import gzip
+import time
+import pytest
+from samplestore import ShardedSampleStore
+from series import InfluxDBSample
+from exposition import (ExpositionCache, render_series, series_shard, negotiate_encoding, negotiate_format,
+                        ENCODERS, MAX_SHARD_LAYOUTS, TEXT, OPENMETRICS)
+
+
+@pytest.fixture
+def store():
+    return ShardedSampleStore(4, track_changes=True)
+
+
+def make_sample(name, value, labels=(("host", "a"),), timestamp=1633085189.5):
+    return InfluxDBSample(name, timestamp, value, labels, time.time() + 300)
+
+
+def test_render_series():
+    """
+    Test case for rendering a single series with escaped label values.
+    """
+    sample = make_sample("cpu", 1.5, (("host", 'a"b\\c\nd'),))
+    assert render_series(sample) == 'cpu{host="a\\"b\\\\c\\nd"} 1.5\n'
+    assert render_series(make_sample("up", 1.0, ()), export_timestamp=True).endswith("up 1.0 1633085189500\n")
+
+
+def test_render_tracks_store_changes(store):
+    """
+    Test case for the cache following inserts, updates and expiry.
+    """
+    cache = ExpositionCache(store)
+    assert cache.render() == b""
+    store.upsert_many([make_sample("cpu", 1.0), make_sample("mem", 2.0)])
+    body = cache.render().decode()
+    assert 'cpu{host="a"} 1.0\n' in body
+    assert 'mem{host="a"} 2.0\n' in body
+
+    store.upsert_many([make_sample("cpu", 3.0)])
+    body = cache.render().decode()
+    assert 'cpu{host="a"} 3.0\n' in body
+    assert 'cpu{host="a"} 1.0\n' not in body
+
+    store.expire(time.time() + 1000)
+    assert cache.render() == b""
+
+
+def test_render_rescans_shards_whose_removal_log_overflowed():
+    """
+    Test case for dropping expired series once a shard logged more removals than it keeps.
+    """
+    store = ShardedSampleStore(4, track_changes=True, removed_limit=2)
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample(f"old{i}", 1.0) for i in range(20)])
+    cache.render_selected(['{host="a"}'])
+    assert cache.series == 20
+    store.expire(time.time() + 1000)
+    store.upsert_many([make_sample(f"new{i}", 2.0) for i in range(5)])
+    body = cache.render().decode()
+    assert "old" not in body
+    assert all(f'new{i}{{host="a"}} 2.0\n' in body for i in range(5))
+    assert cache.series == 5
+    assert cache.render_selected(['{host="a"}'])[1] == 5
+
+
+def test_render_reuses_clean_body(store):
+    """
+    Test case for an unchanged store being served from the cached body.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample(f"m{i}", float(i)) for i in range(50)])
+    first = cache.render()
+    assert cache.refresh() == 0
+    assert cache.render() is first
+
+
+def test_render_groups_families(store):
+    """
+    Test case for one HELP/TYPE header per metric name across shards.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample("cpu", float(i), (("host", f"h{i}"),)) for i in range(20)])
+    store.upsert_many([make_sample("mem", 1.0)])
+    body = cache.render().decode()
+    assert body.count("# TYPE cpu untyped\n") == 1
+    assert body.count("# HELP mem InfluxDB Metric\n") == 1
+    cpu = body[body.index("# HELP cpu"):body.index("# HELP mem")]
+    assert cpu.count("\ncpu{") == 20
+
+    store.expire(time.time() + 1000)
+    assert cache.render() == b""
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", "identity"),
+    ("gzip", "gzip"),
+    ("gzip;q=0, identity", "identity"),
+    ("br, deflate", "identity"),
+    ("*", "zstd" if "zstd" in ENCODERS else "gzip"),
+])
+def test_negotiate_encoding(header, expected):
+    """
+    Test case for Accept-Encoding negotiation.
+    """
+    assert negotiate_encoding(header) == expected
+
+
+def test_negotiate_format():
+    """
+    Test case for choosing OpenMetrics only when the scraper accepts it.
+    """
+    assert negotiate_format("") == TEXT
+    assert negotiate_format("text/plain;version=0.0.4;q=0.5,*/*;q=0.1") == TEXT
+    assert negotiate_format("application/openmetrics-text;version=1.0.0,text/plain;q=0.5") == OPENMETRICS
+
+
+def test_payload_is_compressed_once_per_generation(store):
+    """
+    Test case for sharing one compressed payload until the store changes.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample("cpu", 1.0)])
+    first = cache.payload(TEXT, "gzip")
+    assert gzip.decompress(first) == cache.render()
+    assert cache.payload(TEXT, "gzip") is first
+
+    store.upsert_many([make_sample("cpu", 2.0)])
+    second = cache.payload(TEXT, "gzip")
+    assert second is not first
+    assert b'cpu{host="a"} 2.0' in gzip.decompress(second)
+
+
+def test_openmetrics_body(store):
+    """
+    Test case for OpenMetrics headers, timestamps in seconds and the EOF marker.
+    """
+    cache = ExpositionCache(store, export_timestamp=True)
+    store.upsert_many([make_sample("cpu", 1.0)])
+    body = cache.render(OPENMETRICS).decode()
+    assert body == '# HELP cpu InfluxDB Metric\n# TYPE cpu unknown\ncpu{host="a"} 1.0 1633085189.5\n# EOF\n'
+    assert cache.render(TEXT).decode().endswith('cpu{host="a"} 1.0 1633085189500\n')
+
+
+def test_snapshot_is_consistent_while_writers_continue(store):
+    """
+    Test case for a snapshot staying unchanged while the store keeps changing.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample("cpu", 1.0), make_sample("mem", 2.0)])
+    snapshot = cache.snapshot()
+    assert {name: [s.value for s in samples] for name, samples in snapshot.items()} == {"cpu": [1.0], "mem": [2.0]}
+
+    store.upsert_many([make_sample("cpu", 3.0), make_sample("cpu", 4.0, (("host", "b"),))])
+    store.expire(time.time() + 600)
+    assert [s.value for s in snapshot["cpu"]] == [1.0]
+    assert cache.snapshot() == {}
+
+    store.upsert_many([make_sample("cpu", 5.0)])
+    later = cache.snapshot()
+    assert [s.value for s in later["cpu"]] == [5.0]
+    # Unchanged families are shared between snapshots rather than copied.
+    assert cache.snapshot()["cpu"] is later["cpu"]
+
+
+def test_render_selected_follows_store_changes(store):
+    """
+    Test case for match[] selectors answered from an index kept up to date by later refreshes.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample("cpu", 1.0), make_sample("cpu", 2.0, (("host", "b"),)), make_sample("mem", 3.0)])
+    body, series = cache.render_selected(['cpu{host="b"}', "mem"])
+    assert series == 2
+    assert body.decode() == ('# HELP cpu InfluxDB Metric\n# TYPE cpu untyped\ncpu{host="b"} 2.0\n'
+                             '# HELP mem InfluxDB Metric\n# TYPE mem untyped\nmem{host="a"} 3.0\n')
+
+    store.upsert_many([InfluxDBSample("cpu", 1633085189.5, 4.0, (("host", "c"),), time.time() + 900)])
+    store.expire(time.time() + 600)
+    body, series = cache.render_selected(['{host=~"b|c"}'], OPENMETRICS)
+    assert series == 1
+    assert body.decode().endswith('cpu{host="c"} 4.0\n# EOF\n')
+    assert len(cache._index) == 1
+
+
+def series_lines(body):
+    return sorted(line for line in body.decode().splitlines() if not line.startswith("#"))
+
+
+def test_shards_partition_the_series(store):
+    """
+    Test case for hash partitions that together hold every series exactly once and follow later changes.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample(f"m{i % 3}", float(i), (("host", f"h{i}"),)) for i in range(60)])
+    shards = [series_lines(cache.render(shard=(i, 4))) for i in range(4)]
+    assert sorted(sum(shards, [])) == series_lines(cache.render())
+    assert all(shards)
+
+    store.upsert_many([make_sample("m0", 99.0, (("host", "h0"),))])
+    store.expire(time.time() + 600)
+    assert all(cache.render(shard=(i, 4)) == b"" for i in range(4))
+
+    store.upsert_many([make_sample("m0", 1.0, (("host", "h0"),))])
+    owner = series_shard("m0", (("host", "h0"),), 4)
+    assert cache.render(shard=(owner, 4)) == b'# HELP m0 InfluxDB Metric\n# TYPE m0 untyped\nm0{host="h0"} 1.0\n'
+    assert cache.payload(TEXT, "gzip", (owner, 4)) == cache.payload(TEXT, "gzip", (owner, 4))
+    assert gzip.decompress(cache.payload(TEXT, "gzip", (owner, 4))).endswith(b'm0{host="h0"} 1.0\n')
+    with pytest.raises(ValueError):
+        cache.render(shard=(4, 4))
+
+
+def test_shard_payload_not_reused_across_layouts(store):
+    """
+    Test case for a compressed shard payload stored for an evicted layout not being served by its replacement.
+    """
+    cache = ExpositionCache(store)
+    store.upsert_many([make_sample("cpu", float(i), (("host", f"h{i}"),)) for i in range(20)])
+    cache.payload(TEXT, "gzip", (0, 2))
+    evicted = cache._layouts[2][0]
+    for count in range(3, 3 + MAX_SHARD_LAYOUTS):
+        cache.render(shard=(0, count))
+    assert 2 not in cache._layouts
+    # A scrape that still held the evicted partition finishes compressing after the eviction.
+    cache._compressed[(TEXT, "gzip", (0, 2))] = (evicted, evicted.generation + 10, b"stale")
+    assert gzip.decompress(cache.payload(TEXT, "gzip", (0, 2))) == cache.render(shard=(0, 2))
+
+
+def test_series_shard_is_stable():
+    """
+    Test case for the partition of a series not depending on the process's hash seed.
+    """
+    assert series_shard("cpu", (("host", "a"),), 1000) == 710
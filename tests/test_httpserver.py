@@ -0,0 +1,198 @@
+import asyncio
+import concurrent.futures
+from unittest.mock import MagicMock
+import pytest
+from httpserver import HTTPServer, ServerCollector
+
+
+def echo(w, r):
+    w.headers["Content-Type"] = "text/plain"
+    w.write(r.form.get("prefix", "") + r.body.read().decode())
+
+
+async def serve(server, client):
+    """Run ``client(reader, writer)`` against ``server`` on an ephemeral port."""
+    srv = await server.start("127.0.0.1", 0)
+    port = srv.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            return await client(reader, writer)
+        finally:
+            writer.close()
+    finally:
+        srv.close()
+        await srv.wait_closed()
+
+
+async def read_response(reader):
+    status = (await reader.readline()).decode().split(" ", 2)[1]
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        key, _, value = line.partition(":")
+        headers[key.lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return int(status), headers, body
+
+
+def make_server(**kwargs):
+    server = HTTPServer(MagicMock(), executor=concurrent.futures.ThreadPoolExecutor(2), **kwargs)
+    server.route("/echo", echo)
+    return server
+
+
+def test_keep_alive_and_query_parameters():
+    """
+    Test case for serving several requests over one connection.
+    """
+    async def client(reader, writer):
+        writer.write(b"POST /echo?prefix=a HTTP/1.1\r\nContent-Length: 3\r\n\r\nxyz")
+        first = await read_response(reader)
+        writer.write(b"GET /missing HTTP/1.1\r\n\r\n")
+        second = await read_response(reader)
+        return first, second
+
+    first, second = asyncio.run(serve(make_server(), client))
+    assert first[0] == 200 and first[2] == b"axyz"
+    assert first[1]["connection"] == "keep-alive"
+    assert second[0] == 404
+
+
+def test_chunked_body_with_continue():
+    """
+    Test case for a chunked request body sent after 100 Continue.
+    """
+    async def client(reader, writer):
+        writer.write(b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\nExpect: 100-continue\r\n\r\n")
+        assert await reader.readline() == b"HTTP/1.1 100 Continue\r\n"
+        await reader.readline()
+        writer.write(b"4;ext=1\r\nline\r\n6\r\n-feed\n\r\n0\r\nX-Trailer: 1\r\n\r\n")
+        return await read_response(reader)
+
+    status, _, body = asyncio.run(serve(make_server(), client))
+    assert status == 200
+    assert body == b"line-feed\n"
+
+
+def test_unread_body_closes_connection():
+    """
+    Test case for closing the connection instead of parsing an unread body as a request.
+    """
+    server = make_server()
+    server.route("/reject", lambda w, r: setattr(w, "status", 413))
+
+    async def client(reader, writer):
+        writer.write(b"POST /reject HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello")
+        response = await read_response(reader)
+        return response, await reader.read()
+
+    (status, headers, _), rest = asyncio.run(serve(server, client))
+    assert status == 413
+    assert headers["connection"] == "close"
+    assert rest == b""
+
+
+def test_route_executor_is_not_starved_by_slow_uploads():
+    """
+    Test case for a route with its own executor answering while a slow upload holds the shared one.
+    """
+    server = HTTPServer(MagicMock(), executor=concurrent.futures.ThreadPoolExecutor(1))
+    server.route("/echo", echo)
+    server.route("/fast", lambda w, r: w.write("ok"), executor=concurrent.futures.ThreadPoolExecutor(1))
+
+    async def client(reader, writer):
+        writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 4\r\n\r\nx")
+        await asyncio.sleep(0.1)
+        port = writer.get_extra_info("peername")[1]
+        fast_reader, fast_writer = await asyncio.open_connection("127.0.0.1", port)
+        fast_writer.write(b"GET /fast HTTP/1.1\r\n\r\n")
+        fast = await asyncio.wait_for(read_response(fast_reader), 2)
+        fast_writer.close()
+        writer.write(b"yz!")
+        return fast, await read_response(reader)
+
+    fast, slow = asyncio.run(serve(server, client))
+    assert fast[2] == b"ok"
+    assert slow[2] == b"xyz!"
+
+
+def test_coroutine_handler_holds_no_thread_while_reading():
+    """
+    Test case for a coroutine handler reading a slow upload on the loop and parsing in r.executor.
+    """
+    server = HTTPServer(MagicMock(), executor=concurrent.futures.ThreadPoolExecutor(1))
+
+    async def upper(w, r):
+        chunks = []
+        while True:
+            data = await r.body.read(2)
+            if not data:
+                break
+            chunks.append(await asyncio.get_running_loop().run_in_executor(r.executor, data.upper))
+        w.write(b"".join(chunks).decode())
+
+    server.route("/upper", upper)
+    server.route("/fast", lambda w, r: w.write("ok"))
+
+    async def client(reader, writer):
+        port = writer.get_extra_info("peername")[1]
+        slow = []
+        for _ in range(3):
+            slow_reader, slow_writer = await asyncio.open_connection("127.0.0.1", port)
+            slow_writer.write(b"POST /upper HTTP/1.1\r\nContent-Length: 4\r\n\r\nx")
+            slow.append((slow_reader, slow_writer))
+        await asyncio.sleep(0.1)
+        writer.write(b"GET /fast HTTP/1.1\r\n\r\n")
+        fast = await asyncio.wait_for(read_response(reader), 2)
+        responses = []
+        for slow_reader, slow_writer in slow:
+            slow_writer.write(b"yz!")
+            responses.append(await read_response(slow_reader))
+            slow_writer.close()
+        return fast, responses
+
+    fast, responses = asyncio.run(serve(server, client))
+    assert fast[2] == b"ok"
+    assert [r[2] for r in responses] == [b"XYZ!"] * 3
+
+
+def test_connection_limit_and_collector():
+    """
+    Test case for answering connections beyond the limit with 503.
+    """
+    server = make_server(max_connections=1)
+
+    async def client(reader, writer):
+        writer.write(b"GET /echo HTTP/1.1\r\n\r\n")
+        await read_response(reader)
+        port = writer.get_extra_info("peername")[1]
+        reader2, writer2 = await asyncio.open_connection("127.0.0.1", port)
+        writer2.write(b"GET /echo HTTP/1.1\r\n\r\n")
+        response = await read_response(reader2)
+        writer2.close()
+        return response
+
+    status, _, _ = asyncio.run(serve(server, client))
+    assert status == 503
+    values = {m.name: m.samples for m in ServerCollector(server).collect()}
+    assert values["influxdb_http_connections_rejected"][0].value == 1
+    assert {s.labels["code"]: s.value for s in values["influxdb_http_responses"]} == {"200": 1, "503": 1}
+
+
+@pytest.mark.parametrize("head, status", [
+    (b"NONSENSE\r\n\r\n", 400),
+    (b"POST /echo HTTP/1.1\r\nContent-Length: x\r\n\r\n", 400),
+    (b"POST /echo HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n", 501),
+])
+def test_malformed_requests(head, status):
+    """
+    Test case for rejecting malformed request heads.
+    """
+    async def client(reader, writer):
+        writer.write(head)
+        return await read_response(reader)
+
+    assert asyncio.run(serve(make_server(), client))[0] == status
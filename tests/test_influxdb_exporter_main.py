@@ -1,10 +1,22 @@
 # Import the functions/classes you want to test
+import asyncio
+import gzip
+import os
+import socket
+import subprocess
+import sys
 import time
+import urllib.request
 from unittest import mock
 import pytest
 from unittest.mock import MagicMock, patch
 from http import HTTPStatus
-from influxdb_exporter_main import InfluxDBCollector, influxDBSample, replace_invalid_chars
+from influxdb_exporter_main import InfluxDBCollector, InfluxDBSample, replace_invalid_chars, udpSocketErrors
+from cardinality import CardinalityLimiter
+from preaggregate import RuleSet
+from relabel import Relabeler
+from columnar import ColumnParser
+from httpserver import Headers
 
 @pytest.fixture
 def influxdb_collector():
@@ -15,21 +27,41 @@ def influxdb_collector():
     return InfluxDBCollector.new_influxdb_collector(logger_mock)
 
 
+class AsyncBody:
+    """
+    Request body read the way the HTTP server hands it to coroutine handlers.
+    """
+    def __init__(self, data, chunk=None):
+        self.data = data
+        self.chunk = chunk
+
+    async def read(self, n):
+        n = min(n, self.chunk or n)
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+
+def post(collector, body, form=None, headers=None):
+    """
+    Run influxdb_post on ``body`` and return the response mock.
+    """
+    request = MagicMock()
+    request.headers = Headers(headers or {})
+    request.form = form or {}
+    request.body = body if isinstance(body, AsyncBody) else AsyncBody(body)
+    request.executor = None
+    response = MagicMock()
+    asyncio.run(collector.influxdb_post(response, request))
+    return response
+
+
 def test_influxdb_post_success(influxdb_collector):
     """
     Test case for successful InfluxDB POST request handling.
     """
-    # Mock the necessary objects for the test
-    request_mock = MagicMock()
-    request_mock.headers.get.return_value = None
-    request_mock.body = b'{"metric_name": "value"}'
-    response_mock = MagicMock()
+    with patch.object(influxdb_collector, 'parse_points_to_sample', return_value=(0, 0)) as mock_parse_points:
+        response_mock = post(influxdb_collector, b'{"metric_name": "value"}')
 
-    with patch.object(influxdb_collector, 'parse_points_to_sample') as mock_parse_points:
-        # Call the function to be tested
-        influxdb_collector.influxdb_post(response_mock, request_mock)
-    
-    # Assert that the necessary methods were called
     assert response_mock.status == HTTPStatus.NO_CONTENT
     assert response_mock.send_response.call_count == 1
     mock_parse_points.assert_called_once()
@@ -39,41 +71,154 @@ def test_influxdb_post_invalid_request(influxdb_collector):
     """
     Test case for handling invalid InfluxDB POST request.
     """
-    # Mock the necessary objects for the test
-    request_mock = MagicMock()
-    request_mock.headers.get.return_value = None
-    request_mock.body = b'{"invalid_json"}'
-    response_mock = MagicMock()
+    response_mock = post(influxdb_collector, b'{"invalid_json"}')
 
-    with patch.object(influxdb_collector, 'json_error_response') as mock_error_response:
-        # Call the function to be tested
-        influxdb_collector.influxdb_post(response_mock, request_mock)
-
-    # Assert that the necessary methods were called
     assert response_mock.status == HTTPStatus.BAD_REQUEST
     assert response_mock.write.call_count == 1
-    mock_error_response.assert_called_once()
+    assert "line 1" in response_mock.write.call_args[0][0]
+    response_mock = post(influxdb_collector, b'', form={"precision": "x"})
+    assert response_mock.status == HTTPStatus.BAD_REQUEST
+
+
+def test_influxdb_post_reads_body_in_pieces():
+    """
+    Test case for a gzip body arriving in small reads, with lines split across them.
+    """
+    influxdb_collector = InfluxDBCollector(MagicMock())
+    data = b"".join(b"cpu,host=h%d value=%d\n" % (i, i) for i in range(2000))
+    body = AsyncBody(gzip.compress(data), chunk=100)
+    response_mock = post(influxdb_collector, body, headers={"content-encoding": "gzip"})
+
+    assert response_mock.status == HTTPStatus.NO_CONTENT
+    batches = []
+    while len(influxdb_collector.ch):
+        batches.extend(influxdb_collector.ch.get_batch(10000))
+    assert sorted(s.value for s in batches) == [float(i) for i in range(2000)]
+    response_mock = post(influxdb_collector, b"x", headers={"content-encoding": "br"})
+    assert response_mock.status == HTTPStatus.UNSUPPORTED_MEDIA_TYPE
 
 
 def test_parse_points_to_sample(influxdb_collector):
     """
     Test case for parsing InfluxDB points to samples.
     """
-    # Mock the necessary objects for the test
-    point_mock = MagicMock()
-    point_mock.name = 'metric_name'
-    point_mock.time = 1633085189.123
-    point_mock.fields.return_value = {'value': 42}
-    point_mock.tags = [{'key': 'tag_name', 'value': 'tag_value'}]
+    # Points as yielded by lineprotocol.parse_points
+    point = ('metric_name', [('tag_name', 'tag_value')], {'value': 42}, 1633085189123000000)
 
     influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
 
     # Call the function to be tested
-    influxdb_collector.parse_points_to_sample([point_mock])
+    counts = influxdb_collector.parse_points_to_sample([point])
 
     # Assert that the necessary methods were called
-    assert influxdb_collector.ch.put.call_count == 1
-    assert isinstance(influxdb_collector.ch.put.call_args[0][0], influxDBSample)
+    assert counts == (1, 1)
+    assert influxdb_collector.ch.put_many.call_count == 1
+    assert isinstance(influxdb_collector.ch.put_many.call_args[0][0][0], InfluxDBSample)
+
+
+def test_parse_points_to_sample_series_limit(influxdb_collector):
+    """
+    Test case for rejecting new series beyond the per-metric limit before queueing them.
+    """
+    influxdb_collector.limiter = CardinalityLimiter(influxdb_collector.samples, per_metric=1, top_k=0)
+    influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
+    points = [('m', [('req', str(i))], {'value': 1.0}, 1633085189123000000) for i in range(3)]
+
+    assert influxdb_collector.parse_points_to_sample(points) == (3, 1)
+    assert len(influxdb_collector.ch.put_many.call_args[0][0]) == 1
+    assert influxdb_collector.limiter.rejected["metric"] == 2
+
+
+def test_parse_points_to_sample_aggregation(influxdb_collector):
+    """
+    Test case for aggregation rules replacing raw series with their aggregate.
+    """
+    influxdb_collector.rules = RuleSet([{"op": "sum", "measurement": "cpu", "without": ["pod"], "drop_raw": True}])
+    influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
+    points = [('cpu', [('pod', p)], {'usage': 2.0}, 1633085189123000000) for p in "abc"]
+    points.append(('mem', [('pod', 'a')], {'value': 1.0}, 1633085189123000000))
+
+    assert influxdb_collector.parse_points_to_sample(points) == (4, 4)
+    queued = influxdb_collector.ch.put_many.call_args[0][0]
+    assert [(s.name, s.labels, s.value) for s in queued] == [
+        ("cpu_usage:sum", (), 2.0), ("cpu_usage:sum", (), 4.0), ("cpu_usage:sum", (), 6.0), ("mem", (("pod", "a"),), 1.0)]
+
+
+def test_parse_points_to_sample_relabel(influxdb_collector):
+    """
+    Test case for relabel rules dropping and rewriting points before samples are built.
+    """
+    influxdb_collector.relabeler = Relabeler([
+        {"action": "drop", "source_labels": ["__measurement__"], "regex": "debug"},
+        {"action": "labeldrop", "regex": "pod"},
+    ])
+    influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
+    points = [('debug', [('pod', 'a')], {'value': 1.0}, 1633085189123000000),
+              ('cpu', [('pod', 'a'), ('host', 'h')], {'value': 2.0}, 1633085189123000000)]
+
+    assert influxdb_collector.parse_points_to_sample(points) == (2, 1)
+    queued = influxdb_collector.ch.put_many.call_args[0][0]
+    assert [(s.name, s.labels) for s in queued] == [("cpu", (("host", "h"),))]
+
+
+def test_parse_points_to_sample_relabel_fields(influxdb_collector):
+    """
+    Test case for relabel rules on __field__ dropping and renaming single fields.
+    """
+    influxdb_collector.relabeler = Relabeler([
+        {"action": "drop", "source_labels": ["__field__"], "regex": "debug"},
+        {"source_labels": ["__field__"], "regex": "usage", "target_label": "__field__", "replacement": "value"},
+    ])
+    influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
+    points = [('cpu', [('host', 'h')], {'usage': 1.0, 'debug': 2.0, 'idle': 3.0}, 1633085189123000000)]
+
+    assert influxdb_collector.parse_points_to_sample(points) == (1, 2)
+    queued = influxdb_collector.ch.put_many.call_args[0][0]
+    assert [(s.name, s.value) for s in queued] == [("cpu", 1.0), ("cpu_idle", 3.0)]
+
+
+def test_parse_buffers_to_samples(influxdb_collector):
+    """
+    Test case for columnar parsing, with a buffer it cannot convert going to the point parser.
+    """
+    influxdb_collector.columns = ColumnParser(influxdb_collector.labelsets, replace_invalid_chars)
+    influxdb_collector.limiter = CardinalityLimiter(influxdb_collector.samples, per_metric=2, top_k=0)
+    influxdb_collector.ch = MagicMock()
+    influxdb_collector.ch.put_many.return_value = 0
+    buffers = [b"cpu,host=a value=1,idle=2i 1633085189123000000\ncpu,host=b value=3 1633085189123000000\n",
+               b"cpu,host=c value=4 1633085189123000000\nflag,host=a on=t 1633085189123000000\n"]
+
+    assert influxdb_collector.parse_buffers_to_samples(buffers, "ns", 0) == (4, 4)
+    queued = [s for call in influxdb_collector.ch.put_many.call_args_list for s in call[0][0]]
+    assert [(s.name, s.labels, s.value) for s in queued] == [
+        ("cpu", (("host", "a"),), 1.0), ("cpu_idle", (("host", "a"),), 2.0), ("cpu", (("host", "b"),), 3.0),
+        ("flag_on", (("host", "a"),), 1.0)]
+    assert influxdb_collector.limiter.rejected["metric"] == 1
+
+
+class StopServing(BaseException):
+    pass
+
+
+def test_serve_udp_survives_unexpected_errors(influxdb_collector):
+    """
+    Test case for a datagram failing with an unexpected error being counted without stopping the socket.
+    """
+    conn = MagicMock()
+    conn.receive_batch.side_effect = [[b"a v=1"], [b"b v=1"], StopServing()]
+    before = udpSocketErrors.labels("t")._value.get()
+    with patch.object(influxdb_collector, 'parse_points_to_sample',
+                      side_effect=[RuntimeError("boom"), (1, 1)]) as mock_parse_points:
+        with pytest.raises(StopServing):
+            influxdb_collector.serve_udp(conn, "t")
+    assert mock_parse_points.call_count == 2
+    assert udpSocketErrors.labels("t")._value.get() == before + 1
+    influxdb_collector.logger.error.assert_called_once()
 
 
 def test_replace_invalid_chars():
@@ -111,40 +256,64 @@ def test_influxdb_collector():
     assert isinstance(collector, InfluxDBCollector)
 
     # Test influxdb_post method with valid data
-    request = mock.Mock()
-    request.headers.get.return_value = None
-    request.body = b'metric1,value=10 1633012345'
-    collector.influxdb_post(mock.Mock(), request)
-    assert len(collector.samples) == 1
+    response = post(collector, b'metric1,host=a value=10 1633012345000000000')
+    assert response.status == 204
 
     # Test influxdb_post method with invalid data
-    request.body = b'invalid data'
-    response = mock.Mock()
-    collector.influxdb_post(response, request)
+    response = post(collector, b'invalid data')
     assert response.status == 400
 
     # Test parse_points_to_sample method
-    sample = InfluxDBSample()
-    sample.name = 'metric1'
-    sample.timestamp = time.time()
-    sample.value = 10.0
-    sample.labels = {}
-    points = [sample]
-    collector.parse_points_to_sample(points)
-    assert len(collector.ch) == 1
-
-    # Test process_samples method
-    collector.samples = {'metric1': sample}
-    collector.process_samples()
-    assert len(collector.samples) == 1
+    assert collector.parse_points_to_sample([('metric2', [], {'value': 5}, 1633012345000000000)]) == (1, 1)
+
+    # The process_samples threads move both samples into the store
+    deadline = time.time() + 5
+    while len(collector.samples) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(collector.samples) == 2
 
     # Test collect method
-    metrics = list(collector.collect())
-    assert len(metrics) == 1
+    metrics = {m.name: m for m in collector.collect()}
+    assert [s.value for s in metrics['metric1'].samples] == [10.0]
+    assert [s.value for s in metrics['metric2'].samples] == [5.0]
 
     # Test describe method
-    descriptions = list(collector.describe())
-    assert len(descriptions) == 1
+    assert list(collector.describe())
+
+def _free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_main_serves_udp_and_http():
+    """
+    Test case for main() starting the HTTP server and UDP listener from the command line.
+    """
+    http_port, udp_port = _free_port(socket.SOCK_STREAM), _free_port(socket.SOCK_DGRAM)
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(src, "influxdb_exporter_main.py"),
+         "--web.listen-address", f"127.0.0.1:{http_port}", "--udp.bind-address", f"127.0.0.1:{udp_port}",
+         "--udp.listeners", "1", "--log.level", "error"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        body = b""
+        deadline = time.monotonic() + 20
+        while b"smoke{" not in body and time.monotonic() < deadline:
+            assert proc.poll() is None, proc.stdout.read()
+            time.sleep(0.2)
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.sendto(b"smoke,host=a value=1", ("127.0.0.1", udp_port))
+            try:
+                body = urllib.request.urlopen(f"http://127.0.0.1:{http_port}/metrics", timeout=2).read()
+            except OSError:
+                continue
+        assert b'smoke{host="a"} 1.0' in body
+    finally:
+        proc.kill()
+        proc.wait()
+
 
 # Run the tests
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+import threading
+import pytest
+from ingestqueue import IngestQueue, BLOCK, DROP_NEWEST, DROP_OLDEST
+
+
+def test_get_batch_respects_max_items():
+    """
+    Test case for draining the queue in bounded batches.
+    """
+    q = IngestQueue(10)
+    q.put_many([1, 2, 3, 4, 5])
+    assert q.get_batch(3) == [1, 2, 3]
+    assert q.get_batch(3) == [4, 5]
+    assert q.get_batch(3, timeout=0) == []
+    assert q.high_water == 5
+
+
+def test_numbered_batches():
+    """
+    Test case for numbering the non-empty batches taken from the queue in order.
+    """
+    q = IngestQueue(10)
+    q.put_many([1, 2, 3])
+    assert q.get_numbered_batch(2) == (0, [1, 2])
+    assert q.get_batch(1) == [3]
+    assert q.get_numbered_batch(2, timeout=0) == (None, [])
+    q.put_many([4])
+    assert q.get_numbered_batch(2) == (1, [4])
+
+
+def test_drop_newest():
+    """
+    Test case for the drop-newest overflow policy.
+    """
+    q = IngestQueue(3, DROP_NEWEST)
+    assert q.put_many([1, 2]) == 0
+    assert q.put_many([3, 4, 5]) == 2
+    assert q.get_batch(10) == [1, 2, 3]
+    assert q.dropped == 2
+
+
+@pytest.mark.parametrize("first, second, expected", [
+    ([1, 2], [3, 4], [2, 3, 4]),
+    ([1], [2, 3, 4, 5], [3, 4, 5]),
+])
+def test_drop_oldest(first, second, expected):
+    """
+    Test case for the drop-oldest overflow policy.
+    """
+    q = IngestQueue(3, DROP_OLDEST)
+    q.put_many(first)
+    q.put_many(second)
+    assert q.get_batch(10) == expected
+    assert q.dropped == len(first) + len(second) - 3
+
+
+def test_block_waits_for_consumer():
+    """
+    Test case for producers blocking until the consumer frees room.
+    """
+    q = IngestQueue(2, BLOCK)
+    producer = threading.Thread(target=q.put_many, args=([1, 2, 3, 4, 5],))
+    producer.start()
+    drained = []
+    while len(drained) < 5:
+        drained.extend(q.get_batch(2, timeout=1))
+    producer.join(1)
+    assert drained == [1, 2, 3, 4, 5]
+    assert q.dropped == 0
+    assert q.high_water == 2
+
+
+def test_invalid_policy():
+    """
+    Test case for rejecting unknown overflow policies.
+    """
+    with pytest.raises(ValueError):
+        IngestQueue(10, "drop-everything")
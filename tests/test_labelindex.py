@@ -0,0 +1,83 @@
+import pytest
+from labelindex import LabelIndex, SelectorError, parse_selector
+
+
+@pytest.fixture
+def index():
+    index = LabelIndex()
+    index.add(1, "cpu", (("dc", "eu-1"), ("host", "a")))
+    index.add(2, "cpu", (("dc", "eu-2"), ("host", "b")))
+    index.add(3, "cpu", (("dc", "us-1"), ("host", "c")))
+    index.add(4, "mem", (("dc", "eu-1"), ("host", "a")))
+    return index
+
+
+@pytest.mark.parametrize("selector, expected", [
+    ("cpu", {1, 2, 3}),
+    ('cpu{host="a"}', {1}),
+    ('{host="a"}', {1, 4}),
+    ('{__name__="mem"}', {4}),
+    ('cpu{dc=~"eu-.*"}', {1, 2}),
+    ('cpu{dc=~"eu"}', set()),
+    ('cpu{dc!~"eu-.*", host!="x"}', {3}),
+    ('{dc="eu-1", host="a", zone=""}', {1, 4}),
+    ('{__name__=~"cpu|mem", host=\'a\'}', {1, 4}),
+    ('disk', set()),
+    ('{host!=""}', {1, 2, 3, 4}),
+    ('{host!~""}', {1, 2, 3, 4}),
+    ('{host!~"a|"}', {2, 3}),
+    ('{zone!=""}', set()),
+])
+def test_select(index, selector, expected):
+    """
+    Test case for answering selectors from the posting lists.
+    """
+    assert index.select(parse_selector(selector)) == expected
+
+
+def test_select_non_empty_excludes_missing_labels(index):
+    """
+    Test case for != and !~ matchers that cannot match the empty string skipping series without the label.
+    """
+    index.add(5, "disk", (("dc", "eu-1"),))
+    assert index.select(parse_selector('{host!=""}')) == {1, 2, 3, 4}
+    assert index.select(parse_selector('{host!~"b|c|"}')) == {1, 4}
+    assert index.select(parse_selector('{dc="eu-1", host!=""}')) == {1, 4}
+
+
+def test_remove_drops_empty_postings(index):
+    """
+    Test case for keeping the postings in step with removed series.
+    """
+    index.remove(4, "mem", (("dc", "eu-1"), ("host", "a")))
+    index.remove(4, "mem", (("dc", "eu-1"), ("host", "a")))
+    assert "mem" not in index.postings["__name__"]
+    assert index.postings["dc"]["eu-1"] == {1}
+    assert len(index) == 3
+    assert index.select(parse_selector('{host="a"}')) == {1}
+
+
+@pytest.mark.parametrize("selector", [
+    '{host!="a"}',
+    '{host=~".*"}',
+    "",
+    'cpu{host="a"',
+    'cpu{host=a}',
+    'cpu{host=~"("}',
+    'cpu host',
+])
+def test_invalid_selectors(selector):
+    """
+    Test case for rejecting malformed selectors and selectors matching everything.
+    """
+    with pytest.raises(SelectorError):
+        parse_selector(selector)
+
+
+def test_parse_selector_unescapes_values():
+    """
+    Test case for escaped quotes and backslashes in matcher values.
+    """
+    name, path = parse_selector(r'up{path="C:\\x\"y\""}')
+    assert name.value == "up"
+    assert path.value == 'C:\\x"y"'
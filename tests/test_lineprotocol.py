@@ -0,0 +1,153 @@
+import pytest
+from lineprotocol import line_buffers, parse_points, parse_stream, LineProtocolError
+
+
+def test_parse_points_simple():
+    """
+    Test case for parsing a plain point with tags, fields and a timestamp.
+    """
+    points = list(parse_points(b'cpu,host=a,region=us value=1.5,n=3i 1633085189', "s"))
+    assert points == [('cpu', [('host', 'a'), ('region', 'us')], {'value': 1.5, 'n': 3}, 1633085189000000000)]
+
+
+def test_parse_points_field_types():
+    """
+    Test case for every field type the line protocol supports.
+    """
+    (_, _, fields, _), = parse_points(b'm f=1e3,i=-4i,u=7u,t=t,b=FALSE,s="x y" 1')
+    assert fields == {'f': 1000.0, 'i': -4, 'u': 7, 't': True, 'b': False, 's': 'x y'}
+
+
+def test_parse_points_escaping():
+    """
+    Test case for escaped measurement names, tag keys/values and string fields.
+    """
+    buf = b'my\\ m\\,x,t\\=k=a\\ b\\,c s="say \\"hi\\", ok",v=1 5'
+    (name, tags, fields, ts), = parse_points(memoryview(buf))
+    assert name == 'my m,x'
+    assert tags == [('t=k', 'a b,c')]
+    assert fields == {'s': 'say "hi", ok', 'v': 1.0}
+    assert ts == 5
+
+
+@pytest.mark.parametrize("precision, multiplier", [
+    ("ns", 1), ("n", 1), ("us", 1000), ("u", 1000), ("ms", 10**6),
+    ("s", 10**9), ("m", 60 * 10**9), ("h", 3600 * 10**9),
+])
+def test_parse_points_precision(precision, multiplier):
+    """
+    Test case for timestamp normalisation to nanoseconds.
+    """
+    (_, _, _, ts), = parse_points(b'm v=1 2', precision)
+    assert ts == 2 * multiplier
+
+
+def test_parse_points_defaults_and_comments():
+    """
+    Test case for comments, blank lines and points without a timestamp.
+    """
+    points = list(parse_points(b'# comment\n\nm v=1\r\n', now=42))
+    assert points == [('m', [], {'v': 1.0}, 42)]
+
+
+@pytest.mark.parametrize("buf", [
+    b'cpu', b'cpu value=', b'cpu,host value=1', b'cpu value=1 1 2', b'cpu s="abc', b'cpu v=abc',
+])
+def test_parse_points_invalid(buf):
+    """
+    Test case for malformed lines.
+    """
+    with pytest.raises(LineProtocolError):
+        list(parse_points(buf))
+
+
+@pytest.mark.parametrize("buf, precision", [
+    (b'm v=1 ' + b'9' * 400, "ns"),
+    (b'm v=1 9223372036854775808', "ns"),
+    (b'm v=1 -9223372036854775809', "ns"),
+    (b'm v=1 9223372037', "s"),
+])
+def test_parse_points_timestamp_out_of_range(buf, precision):
+    """
+    Test case for timestamps outside the int64 nanosecond range.
+    """
+    with pytest.raises(LineProtocolError):
+        list(parse_points(buf, precision))
+
+
+@pytest.mark.parametrize("buf", [
+    b'm v=9223372036854775808i', b'm v=-9223372036854775809i', b'm v=' + b'9' * 400 + b'i',
+    b'm v=18446744073709551616u', b'm v=-1u',
+])
+def test_parse_points_integer_out_of_range(buf):
+    """
+    Test case for integer fields that do not fit 64 bits.
+    """
+    with pytest.raises(LineProtocolError):
+        list(parse_points(buf))
+
+
+def test_parse_points_integer_limits():
+    """
+    Test case for the int64 and uint64 limits being accepted.
+    """
+    points = list(parse_points(b'm a=-9223372036854775808i,b=18446744073709551615u 9223372036854775807'))
+    assert points == [('m', [], {'a': -2 ** 63, 'b': 2 ** 64 - 1}, 2 ** 63 - 1)]
+
+
+def test_parse_points_invalid_precision():
+    """
+    Test case for an unknown precision being rejected before parsing.
+    """
+    with pytest.raises(LineProtocolError):
+        parse_points(b'm v=1', "d")
+
+
+def test_parse_stream_lines_split_across_chunks():
+    """
+    Test case for streamed parsing where chunk boundaries fall inside lines.
+    """
+    buf = b"cpu,host=a value=1 1\n# comment\nmem v=2i 2\ndisk free=3 3"
+    expected = list(parse_points(buf))
+    for size in (1, 3, 7, len(buf)):
+        chunks = [buf[i:i + size] for i in range(0, len(buf), size)]
+        assert list(parse_stream(chunks)) == expected
+
+
+def test_parse_stream_reports_line_numbers():
+    """
+    Test case for error line numbers counting across chunks.
+    """
+    with pytest.raises(LineProtocolError) as e:
+        list(parse_stream([b"a v=1\nb v=", b"1\nc\n"]))
+    assert e.value.lineno == 3
+
+
+def test_line_buffers_hold_whole_lines():
+    """
+    Test case for regrouping chunks into buffers that end on line boundaries.
+    """
+    chunks = [b"a v=1\nb v", b"=2\n", b"c v=3"]
+    assert [bytes(buf) for buf in line_buffers(chunks)] == [b"a v=1\n", b"b v=2\n", b"c v=3"]
+
+
+def test_line_buffers_join_long_lines_once():
+    """
+    Test case for a line spread over many chunks being joined into one buffer.
+    """
+    chunks = [b"a v=1\nb v="] + [b"1"] * 1000 + [b"\nc v=2\n"]
+    assert [bytes(buf) for buf in line_buffers(chunks)] == [b"a v=1\n", b"b v=" + b"1" * 1000 + b"\nc v=2\n"]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b"a v=1\nb v=", b"1" * 20],
+    [b"a v=1\nb v=", b"1" * 20 + b"\n"],
+    [b"a v=1\nb v=" + b"1" * 20],
+])
+def test_line_buffers_reject_long_lines(chunks):
+    """
+    Test case for a line longer than the limit failing with its line number.
+    """
+    with pytest.raises(LineProtocolError) as e:
+        list(line_buffers(chunks, max_line=16))
+    assert e.value.lineno == 2
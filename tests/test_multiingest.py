@@ -0,0 +1,101 @@
+import multiprocessing
+import time
+from unittest.mock import MagicMock
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from series import InfluxDBSample
+from multiingest import (encode_batch, decode_batch, decode_metrics, ShippingQueue, Aggregator, AggregatorCollector,
+                         WorkerMetricsCollector)
+
+
+def make_samples(n):
+    labels = [(("host", f"h{i}"),) for i in range(3)]
+    return [InfluxDBSample(f"m{i % 2}", 100.0 + i, float(i), labels[i % 3], 400.0 + i) for i in range(n)]
+
+
+def test_encode_decode_roundtrip():
+    """
+    Test case for packing samples with shared names and label sets.
+    """
+    samples = make_samples(10)
+    interned = []
+    worker, seq, first_at, decoded = decode_batch(encode_batch(samples, 3, 7, 1.5), lambda l: interned.append(l) or l)
+    assert (worker, seq, first_at) == (3, 7, 1.5)
+    assert len(interned) == 3
+    assert [(s.name, s.labels, s.value, s.timestamp, s.expires) for s in decoded] == \
+        [(s.name, s.labels, s.value, s.timestamp, s.expires) for s in samples]
+    assert decoded[0].labels is decoded[3].labels
+
+
+def test_shipping_queue_batches_and_linger():
+    """
+    Test case for shipping once batch_size samples are buffered, and on linger.
+    """
+    recv, send = multiprocessing.Pipe(duplex=False)
+    queue = ShippingQueue(send, 1, batch_size=5, linger=0.05)
+    assert queue.put_many(make_samples(3)) == 0
+    assert not recv.poll()
+    queue.put_many(make_samples(3))
+    _, seq, _, samples = decode_batch(recv.recv_bytes())
+    assert (seq, len(samples)) == (1, 6)
+    queue.put_many(make_samples(2))
+    assert recv.poll(2)
+    _, seq, _, samples = decode_batch(recv.recv_bytes())
+    assert (seq, len(samples)) == (2, 2)
+
+
+def test_aggregator_feeds_sink_and_reports_workers():
+    """
+    Test case for the aggregator handing batches to the sink and tracking worker state.
+    """
+    received = []
+    aggregator = Aggregator(received.extend, logger=MagicMock())
+    recv, send = multiprocessing.Pipe(duplex=False)
+    aggregator.attach(0, recv)
+    send.send_bytes(encode_batch(make_samples(4), 0, 1, time.time()))
+    send.close()
+    deadline = time.time() + 2
+    while aggregator.stats[0].up and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(received) == 4
+    values = {m.name: m.samples[0].value for m in AggregatorCollector(aggregator).collect()}
+    assert values["influxdb_ingest_worker_up"] == 0
+    assert values["influxdb_ingest_worker_batches"] == 1
+    assert values["influxdb_ingest_worker_samples"] == 4
+    assert values["influxdb_ingest_worker_lag_seconds"] >= 0
+    aggregator.logger.error.assert_called_once()
+
+
+def test_worker_metrics_are_shipped_and_served_per_worker():
+    """
+    Test case for worker self-metrics reaching the main process under a worker label.
+    """
+    registry = CollectorRegistry()
+    errors = Counter("udp_errors_total", "Errors.", ["socket"], registry=registry)
+    seconds = Histogram("write_seconds", "Writes.", buckets=(1,), registry=registry)
+    errors.labels("0").inc(3)
+    recv, send = multiprocessing.Pipe(duplex=False)
+    queue = ShippingQueue(send, 2, batch_size=100, linger=0.01,
+                          metrics=lambda: [f for m in (errors, seconds) for f in m.collect()])
+    queue.put_many(make_samples(1))
+    messages = [recv.recv_bytes() for _ in range(2)]
+    shipped = decode_metrics(next(m for m in messages if m.startswith(b"M")))
+    assert [f.name for f in shipped] == ["udp_errors", "write_seconds"]
+
+    received = []
+    aggregator = Aggregator(received.extend)
+    recv, send = multiprocessing.Pipe(duplex=False)
+    aggregator.attach(2, recv)
+    for message in messages:
+        send.send_bytes(message)
+    deadline = time.time() + 2
+    while 2 not in aggregator.metrics and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(received) == 1
+    seconds.observe(0.5)
+    families = {f.name: f for f in WorkerMetricsCollector(aggregator, (errors, seconds)).collect()}
+    totals = {(s.name, tuple(sorted(s.labels.items()))): s.value
+              for f in families.values() for s in f.samples if not s.name.endswith("_created")}
+    assert totals[("udp_errors_total", (("socket", "0"),))] == 3
+    assert totals[("udp_errors_total", (("socket", "0"), ("worker", "2")))] == 3
+    assert totals[("write_seconds_count", ())] == 1
+    assert totals[("write_seconds_count", (("worker", "2"),))] == 0
@@ -0,0 +1,99 @@
+import math
+import random
+import pytest
+from preaggregate import Rule, RuleCollector, RuleError, RuleSet, parse_rule
+
+
+def labels(pod, node="n1"):
+    return (("node", node), ("pod", pod))
+
+
+@pytest.mark.parametrize("op, expected", [("sum", 9.0), ("max", 5.0), ("min", 1.0), ("count", 3.0)])
+def test_rule_updates_incrementally(op, expected):
+    """
+    Test case for each aggregation following updates to its input series.
+    """
+    rule = parse_rule(f"{op} cpu without (pod)")
+    for pod, value in (("a", 1.0), ("b", 2.0), ("c", 3.0)):
+        rule.add("cpu_usage", labels(pod), value, 10.0, 100.0)
+    out = rule.add("cpu_usage", labels("b"), 5.0, 11.0, 101.0)
+    assert out.name == "cpu_usage:" + op
+    assert out.labels == (("node", "n1"),)
+    assert out.value == expected
+    assert (out.timestamp, out.expires) == (11.0, 101.0)
+
+
+def test_max_rescans_when_extreme_drops():
+    """
+    Test case for max recomputing its group when the current maximum falls.
+    """
+    rule = Rule("max", "cpu", ["pod"])
+    rule.add("cpu", labels("a"), 7.0, 1.0, 100.0)
+    rule.add("cpu", labels("b"), 4.0, 1.0, 100.0)
+    assert rule.add("cpu", labels("a"), 1.0, 2.0, 100.0).value == 4.0
+
+
+def test_sum_does_not_drift():
+    """
+    Test case for the running sum staying exact while large values come and go.
+    """
+    rule = Rule("sum", "cpu", ["pod"])
+    rule.add("cpu", labels("small"), 1.0, 1.0, 100.0)
+    for i in range(1000):
+        out = rule.add("cpu", labels("big"), 1e16 if i % 2 == 0 else 0.0, 1.0, 100.0)
+    assert out.value == 1.0
+    rng = random.Random(7)
+    values = {}
+    for _ in range(20000):
+        pod = f"p{rng.randrange(50)}"
+        values[pod] = rng.choice((1e12, 1.0, 0.1)) * rng.uniform(-1, 1)
+        out = rule.add("cpu", labels(pod), values[pod], 1.0, 100.0)
+    assert out.value == pytest.approx(math.fsum(values.values()) + 1.0, abs=1e-3)
+
+
+def test_expire_forgets_stale_inputs():
+    """
+    Test case for expired input series leaving the aggregate.
+    """
+    rule = Rule("sum", "cpu", ["pod"], drop_raw=True)
+    rule.add("cpu", labels("a"), 1.0, 1.0, 50.0)
+    rule.add("cpu", labels("b"), 2.0, 1.0, 150.0)
+    rule.add("cpu", labels("c", "n2"), 4.0, 1.0, 50.0)
+    assert rule.series() == (3, 2)
+    changed = rule.expire(100.0)
+    assert [(s.labels, s.value) for s in changed] == [((("node", "n1"),), 2.0)]
+    assert rule.series() == (1, 1)
+
+
+def test_by_and_name_matching():
+    """
+    Test case for by-grouping and the metric names a rule covers.
+    """
+    rule = parse_rule({"op": "count", "measurement": "disk", "by": ["node"]})
+    assert rule.matches("disk") and rule.matches("disk_free")
+    assert not rule.matches("diskio_reads") and not rule.matches("dis")
+    out = rule.add("disk_free", (("device", "sda"), ("node", "n1"), ("pod", "a")), 1.0, 1.0, 10.0)
+    assert out.labels == (("node", "n1"),)
+
+
+@pytest.mark.parametrize("spec", ["avg cpu without (pod)", "sum cpu", {"measurement": "cpu"}])
+def test_invalid_rules(spec):
+    """
+    Test case for rejecting malformed aggregation rules.
+    """
+    with pytest.raises(RuleError):
+        parse_rule(spec)
+
+
+def test_rule_collector_reports_reduction():
+    """
+    Test case for exporting per-rule input and output series and their ratio.
+    """
+    rules = RuleSet(["sum cpu without (pod)"])
+    for pod in "abcd":
+        rules.rules_for("cpu")[0].add("cpu", labels(pod), 1.0, 1.0, 10.0)
+    assert rules.rules_for("mem") == ()
+    values = {m.name: m.samples[0].value for m in RuleCollector(rules).collect()}
+    assert values["influxdb_aggregation_input_series"] == 4
+    assert values["influxdb_aggregation_output_series"] == 1
+    assert values["influxdb_aggregation_reduction_ratio"] == 4.0
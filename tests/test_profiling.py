@@ -0,0 +1,103 @@
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+import pytest
+from httpserver import HTTPError
+from profiling import CPUProfile, HeapTracer, sample_cpu
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_cpu_collapsed_and_pstats(tmp_path):
+    """
+    Test case for sampling another thread's stacks into collapsed and pstats output.
+    """
+    stop = threading.Event()
+    thread = threading.Thread(target=busy, args=(stop,), name="busy")
+    thread.start()
+    try:
+        profile = sample_cpu(0.2, 0.005)
+    finally:
+        stop.set()
+        thread.join()
+    assert profile.samples > 0
+
+    lines = profile.collapsed().decode().splitlines()
+    assert any(line.startswith("busy;") and ";busy (test_profiling.py:" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    path = tmp_path / "cpu.pstats"
+    path.write_bytes(profile.pstats())
+    stats = pstats.Stats(str(path))
+    busy_keys = [key for key in stats.stats if key[2] == "busy"]
+    assert busy_keys
+    cc, nc, tt, ct, callers = stats.stats[busy_keys[0]]
+    assert nc > 0 and ct >= tt
+
+
+def test_pstats_counts_recursion_once():
+    """
+    Test case for cumulative time not double counting recursive frames.
+    """
+    profile = CPUProfile(0.01)
+    f, g = ("a.py", 1, "f"), ("a.py", 5, "g")
+    profile.stacks[("main", (f, g, f))] = 3
+    stats = marshal.loads(profile.pstats())
+    assert stats[f][1] == 3
+    assert stats[f][2] == pytest.approx(0.03)
+    assert stats[f][3] == pytest.approx(0.03)
+    assert stats[g][2] == 0.0
+    assert stats[f][4][g][0] == 3
+
+
+def test_one_cpu_profile_at_a_time():
+    """
+    Test case for rejecting a second concurrent CPU profile with 409.
+    """
+    thread = threading.Thread(target=sample_cpu, args=(0.3,))
+    thread.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(HTTPError) as e:
+            sample_cpu(0.1)
+        assert e.value.status == 409
+    finally:
+        thread.join()
+
+
+def test_heap_tracer_snapshot_diff_and_stop():
+    """
+    Test case for a tracemalloc session reporting growth by allocation site.
+    """
+    heap = HeapTracer(60)
+    with pytest.raises(HTTPError):
+        heap.snapshot()
+    heap.start()
+    try:
+        assert tracemalloc.is_tracing()
+        kept = [bytearray(1024) for _ in range(200)]
+        diff = heap.diff().decode()
+        assert diff.startswith("# traced memory change: +")
+        assert "test_profiling.py" in diff.splitlines()[1]
+        assert "test_profiling.py" in heap.snapshot(top=5).decode()
+        del kept
+    finally:
+        heap.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_heap_tracer_stops_on_its_own():
+    """
+    Test case for a forgotten tracemalloc session stopping after max_seconds.
+    """
+    heap = HeapTracer(0.05)
+    heap.start()
+    deadline = time.monotonic() + 2
+    while tracemalloc.is_tracing() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not tracemalloc.is_tracing()
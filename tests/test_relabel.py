@@ -0,0 +1,113 @@
+import pytest
+from relabel import Relabeler, RelabelCollector, RelabelError, RelabelRule
+
+
+def test_drop_and_keep():
+    """
+    Test case for dropping and keeping points by measurement and tag values.
+    """
+    relabeler = Relabeler([
+        {"action": "drop", "source_labels": ["__measurement__"], "regex": "debug_.*"},
+        {"action": "keep", "source_labels": ["env"], "regex": "prod|staging"},
+    ])
+    assert relabeler.relabel("debug_gc", (("env", "prod"),)) is None
+    assert relabeler.relabel("cpu", (("env", "dev"),)) is None
+    assert relabeler.relabel("cpu", (("env", "prod"),)) == ("cpu", (("env", "prod"),), None)
+    assert relabeler.dropped == 2
+
+
+def test_regex_is_anchored():
+    """
+    Test case for regexes having to match the whole joined value.
+    """
+    relabeler = Relabeler([{"action": "drop", "source_labels": ["__measurement__"], "regex": "cpu"}])
+    assert relabeler.relabel("cpu_total", ()) is not None
+    assert relabeler.relabel("cpu", ()) is None
+
+
+def test_replace_and_rename_measurement():
+    """
+    Test case for replace rules writing tags and the measurement from capture groups.
+    """
+    relabeler = Relabeler([
+        {"source_labels": ["host", "dc"], "regex": r"(\w+)\.example\.com;(.*)", "target_label": "instance",
+         "replacement": "$1@${2}"},
+        {"source_labels": ["__measurement__"], "regex": "legacy_(.*)", "target_label": "__measurement__"},
+        {"action": "labeldrop", "regex": "host|dc"},
+    ])
+    m, tags, _ = relabeler.relabel("legacy_mem", (("dc", "eu"), ("host", "web1.example.com")))
+    assert m == "mem"
+    assert tags == (("instance", "web1@eu"),)
+
+
+def test_named_group_replacement():
+    """
+    Test case for ${name} references to named groups.
+    """
+    relabeler = Relabeler([{"source_labels": ["host"], "regex": r"(?P<short>\w+)\..*", "target_label": "host",
+                            "replacement": "${short}-$0"}])
+    assert relabeler.relabel("cpu", (("host", "web1.example.com"),)) == (
+        "cpu", (("host", "web1-web1.example.com"),), None)
+
+
+def test_empty_replacement_removes_label_and_measurement_drops():
+    """
+    Test case for an empty replacement deleting the target, and an emptied measurement dropping the point.
+    """
+    relabeler = Relabeler([{"source_labels": ["pod"], "regex": "tmp-.*", "target_label": "pod", "replacement": ""}])
+    assert relabeler.relabel("cpu", (("pod", "tmp-1"),)) == ("cpu", (), None)
+    relabeler = Relabeler([{"source_labels": ["x"], "target_label": "__measurement__"}])
+    assert relabeler.relabel("cpu", ()) is None
+
+
+def test_labelkeep_and_private_labels():
+    """
+    Test case for labelkeep and the removal of labels starting with "__".
+    """
+    relabeler = Relabeler([
+        {"source_labels": ["host"], "target_label": "__tmp"},
+        {"action": "labelkeep", "regex": "host|__tmp"},
+    ])
+    assert relabeler.relabel("cpu", (("host", "a"), ("pod", "p"))) == ("cpu", (("host", "a"),), None)
+
+
+def test_field_rules_are_per_field():
+    """
+    Test case for rules on __field__ being evaluated per field.
+    """
+    relabeler = Relabeler([{"action": "drop", "source_labels": ["__field__"], "regex": "debug.*"}])
+    assert relabeler.per_field
+    assert relabeler.relabel("cpu", (), "debug_ns") is None
+    assert relabeler.relabel("cpu", (), "usage") == ("cpu", (), "usage")
+
+
+def test_cache_hits_and_bound():
+    """
+    Test case for outcomes being computed once per distinct input and the cache staying bounded.
+    """
+    relabeler = Relabeler([{"action": "drop", "source_labels": ["a"], "regex": "x"}], cache_size=2)
+    for _ in range(3):
+        relabeler.relabel("m", (("a", "x"),))
+        relabeler.relabel("m", (("a", "y"),))
+    assert relabeler.misses == 2
+    relabeler.relabel("m", (("a", "z"),))
+    assert len(relabeler._cache) == 1
+    families = {f.name: f.samples[0].value for f in RelabelCollector(relabeler).collect()}
+    assert families["influxdb_relabel_dropped"] == 3
+    assert families["influxdb_relabel_cache_misses"] == 3
+
+
+@pytest.mark.parametrize("rule", [
+    {"action": "hashmod"},
+    {"action": "replace", "source_labels": ["a"]},
+    {"action": "drop"},
+    {"action": "drop", "source_labels": ["a"], "regex": "("},
+    {"target_label": "a", "regex": "(x)(y)", "replacement": "$3"},
+    {"target_label": "a", "regex": "(?P<host>.*)", "replacement": "${hostname}"},
+])
+def test_invalid_rules(rule):
+    """
+    Test case for rejecting rules that cannot be compiled.
+    """
+    with pytest.raises(RelabelError):
+        RelabelRule(**rule)
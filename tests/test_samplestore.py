@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+import tracemalloc
+import pytest
+from ingestqueue import IngestQueue
+from samplestore import ShardedSampleStore, series_bytes
+from series import InfluxDBSample
+
+
+def make_sample(name, timestamp=None, value=1.0, ttl=300, labels=(("host", "h1"),)):
+    timestamp = time.time() if timestamp is None else timestamp
+    return InfluxDBSample(name, timestamp, value, labels, timestamp + ttl)
+
+
+@pytest.mark.parametrize("shards", [1, 8])
+def test_upsert_and_get(shards):
+    """
+    Test case for inserting and replacing samples across shards.
+    """
+    store = ShardedSampleStore(shards)
+    store.upsert_many([make_sample(f"m{i}") for i in range(100)])
+    replacement = make_sample("m1", value=2.0)
+    store.upsert_many([replacement])
+    assert len(store) == 100
+    assert store.lookup("m1", (("host", "h1"),)).value == 2.0
+    assert store.get(replacement.id) is replacement
+    assert store.lookup("m1", (("host", "h2"),)) is None
+    assert sorted(s.name for s in store.values()) == sorted(f"m{i}" for i in range(100))
+    assert len({s.id for s in store.values()}) == 100
+
+
+def test_series_handles_are_stable():
+    """
+    Test case for a series keeping its integer handle across updates.
+    """
+    store = ShardedSampleStore(4)
+    first, second = make_sample("m"), make_sample("m", value=3.0)
+    store.upsert_many([first])
+    store.upsert_many([second])
+    assert isinstance(first.id, int)
+    assert first.id == second.id
+    assert store.shard_for(first.id) is store.shards[first.id % 4]
+
+
+def test_expire():
+    """
+    Test case for dropping samples whose deadline has passed.
+    """
+    now = time.time()
+    store = ShardedSampleStore(4, bucket_seconds=5)
+    store.upsert_many([make_sample("old", now - 600), make_sample("new", now)])
+    assert store.expire(now) == 1
+    assert [s.name for s in store.values()] == ["new"]
+    assert store.expire(now + 310) == 1
+    assert len(store) == 0
+    assert not any(shard.buckets or shard.index for shard in store.shards)
+
+
+def test_expire_follows_updates():
+    """
+    Test case for a refreshed series moving to a later expiry bucket.
+    """
+    now = 1000000.0
+    store = ShardedSampleStore(1, bucket_seconds=5)
+    store.upsert_many([make_sample("a", now, ttl=60)])
+    store.upsert_many([make_sample("a", now + 50, ttl=60)])
+    assert store.expire(now + 70) == 0
+    assert store.lookup("a", (("host", "h1"),)).timestamp == now + 50
+    assert store.expire(now + 120) == 1
+
+
+def test_expire_per_sample_ttl():
+    """
+    Test case for samples carrying different expiry deadlines.
+    """
+    now = 1000000.0
+    store = ShardedSampleStore(2, bucket_seconds=5)
+    store.upsert_many([make_sample("short", now, ttl=10), make_sample("long", now, ttl=3600)])
+    assert store.expire(now + 20) == 1
+    assert [s.name for s in store.values()] == ["long"]
+
+
+def test_invalid_shard_count():
+    """
+    Test case for rejecting a store without shards.
+    """
+    with pytest.raises(ValueError):
+        ShardedSampleStore(0)
+
+
+def test_families():
+    """
+    Test case for grouping samples by metric name across shards.
+    """
+    store = ShardedSampleStore(4)
+    store.upsert_many([make_sample("cpu", labels=(("host", f"h{i}"),)) for i in range(10)])
+    store.upsert_many([make_sample("mem")])
+    families = store.families()
+    assert sorted(families) == ["cpu", "mem"]
+    assert len(families["cpu"]) == 10
+
+
+def test_estimated_bytes_follow_inserts_and_expiry():
+    """
+    Test case for the per-series footprint estimate growing on insert and shrinking on expiry.
+    """
+    store = ShardedSampleStore(4)
+    now = time.time()
+    store.upsert_many([make_sample(f"m{i}", now, ttl=10) for i in range(10)])
+    per_series = series_bytes("m0", (("host", "h1"),))
+    assert store.estimated_bytes == 10 * per_series
+    store.upsert_many([make_sample("m0", now, value=2.0, ttl=10)])
+    assert store.estimated_bytes == 10 * per_series
+    store.expire(now + 60)
+    assert store.estimated_bytes == 0
+
+
+def test_enforce_budget_evicts_least_recently_updated():
+    """
+    Test case for evicting the coldest series once the memory budget is exceeded.
+    """
+    per_series = series_bytes("m00", (("host", "h1"),))
+    store = ShardedSampleStore(1, track_changes=True, memory_budget=40 * per_series, low_water=0.5)
+    store.upsert_many([make_sample(f"m{i:02}") for i in range(40)])
+    assert store.enforce_budget() == 0
+    # Touch the first ten, then push the store over budget.
+    store.upsert_many([make_sample(f"m{i:02}", value=2.0) for i in range(10)])
+    store.upsert_many([make_sample(f"m{i:02}") for i in range(40, 50)])
+    assert store.enforce_budget() == 30
+    assert store.estimated_bytes == 20 * per_series
+    assert sorted(s.name for s in store.values()) == [f"m{i:02}" for i in list(range(10)) + list(range(40, 50))]
+    removed = store.shards[0].drain_changes()[1]
+    assert sorted(name for name, labels in removed.values()) == [f"m{i:02}" for i in range(10, 40)]
+    # Evicted series no longer sit in the expiry index.
+    assert store.expire(time.time() + 3600) == 20
+
+
+def test_removal_log_stays_bounded_without_reads():
+    """
+    Test case for expiry freeing memory while nobody drains the change logs.
+    """
+    store = ShardedSampleStore(2, track_changes=True, removed_limit=100)
+    tracemalloc.start()
+    try:
+        for round in range(5):
+            store.upsert_many([make_sample(f"m{round}_{i}") for i in range(5000)])
+            assert store.expire(time.time() + 3600) == 5000
+            if round == 0:
+                base = tracemalloc.get_traced_memory()[0]
+        grown = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    assert grown < 100 * 1024
+    assert all(shard.removed is None for shard in store.shards)
+    changes, removed, live = store.shards[0].drain_changes()
+    assert (changes, removed, live) == ({}, {}, set())
+    assert store.shards[0].removed == {}
+
+
+def test_enforce_budget_across_shards():
+    """
+    Test case for keeping a sharded store within its budget.
+    """
+    per_series = series_bytes("m000", (("host", "h1"),))
+    store = ShardedSampleStore(4, memory_budget=100 * per_series)
+    store.upsert_many([make_sample(f"m{i:03}") for i in range(300)])
+    evicted = store.enforce_budget()
+    assert len(store) == 300 - evicted
+    assert store.estimated_bytes <= 100 * per_series
+
+
+def test_contended_lock_waits_are_reported():
+    """
+    Test case for reporting how long writers waited for a busy shard lock.
+    """
+    waits = []
+    store = ShardedSampleStore(1, on_lock_wait=waits.append)
+    store.upsert_many([InfluxDBSample("cpu", 1.0, 1.0, (), time.time() + 60)])
+    assert waits == []
+
+    shard = store.shards[0]
+    held = threading.Event()
+
+    def hold():
+        with shard.lock:
+            held.set()
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    store.upsert_many([InfluxDBSample("cpu", 2.0, 2.0, (), time.time() + 60)])
+    thread.join()
+    assert len(waits) == 1 and waits[0] >= 0.02
+
+
+def test_numbered_writes_apply_in_order():
+    """
+    Test case for a numbered write that arrives first waiting for the writes numbered before it.
+    """
+    store = ShardedSampleStore(4)
+    later = threading.Thread(target=store.upsert_many, args=([make_sample("cpu", 1.0, 2.0)], 1))
+    later.start()
+    time.sleep(0.05)
+    assert store.lookup("cpu", (("host", "h1"),)) is None
+    store.upsert_many([make_sample("cpu", 1.0, 1.0)], 0)
+    later.join(1)
+    assert store.lookup("cpu", (("host", "h1"),)).value == 2.0
+
+
+def test_competing_queued_batches_keep_the_latest_value():
+    """
+    Test case for several consumers draining batches of the same series from the ingest queue.
+    """
+    store = ShardedSampleStore(4)
+    q = IngestQueue(100000)
+    for i in range(40):
+        q.put_many([make_sample(f"m{j}", 1.0, float(i)) for j in range(50)])
+
+    def consume():
+        while True:
+            number, batch = q.get_numbered_batch(50, timeout=0)
+            if not batch:
+                return
+            time.sleep(random.random() / 1000)
+            store.upsert_many(batch, number)
+
+    threads = [threading.Thread(target=consume) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert [s.value for s in store.values()] == [39.0] * 50
@@ -0,0 +1,34 @@
+import functools
+import pytest
+from sanitize import sanitize_name, replace_invalid_chars, CacheCollector
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("metric_name", "metric_name"),
+    ("metric name", "metric_name"),
+    ("metric.name-total", "metric_name_total"),
+    ("123metric", "_123metric"),
+    ("9", "_9"),
+    ("température", "temp_rature"),
+    ("rps😀", "rps_"),
+])
+def test_sanitize_name(raw, expected):
+    """
+    Test case for the translate-based sanitiser, cached and uncached.
+    """
+    assert sanitize_name(raw) == expected
+    assert replace_invalid_chars(raw) == expected
+
+
+def test_cache_collector_counts():
+    """
+    Test case for the hit/miss/eviction counters of a bounded cache.
+    """
+    cached = functools.lru_cache(maxsize=2)(sanitize_name)
+    for name in ["a.b", "a.b", "c.d", "e.f", "a.b"]:
+        cached(name)
+    values = {m.name: m.samples[0].value for m in CacheCollector(cached).collect()}
+    assert values["influxdb_sanitize_cache_hits"] == 1
+    assert values["influxdb_sanitize_cache_misses"] == 4
+    assert values["influxdb_sanitize_cache_evictions"] == 2
+    assert values["influxdb_sanitize_cache_entries"] == 2
@@ -0,0 +1,44 @@
+from series import InfluxDBSample, LabelSetTable
+
+
+def sanitize(s):
+    return s.replace("-", "_")
+
+
+def test_label_sets_are_shared():
+    """
+    Test case for identical tag sets sharing one canonical tuple.
+    """
+    table = LabelSetTable(sanitize)
+    a = table.intern([("region", "us"), ("host", "a")])
+    b = table.intern([("host", "a"), ("region", "us")])
+    assert a == (("host", "a"), ("region", "us"))
+    assert a is b
+    assert len(table) == 1
+
+
+def test_label_sets_are_sanitized():
+    """
+    Test case for sanitised label names and the reserved __name__ tag.
+    """
+    table = LabelSetTable(sanitize)
+    assert table.intern([("host-name", "a"), ("__name__", "x")]) == (("host_name", "a"),)
+
+
+def test_label_set_table_is_bounded():
+    """
+    Test case for the table being cleared once it reaches max_size.
+    """
+    table = LabelSetTable(sanitize, max_size=2)
+    for i in range(5):
+        table.intern([("host", str(i))])
+    assert len(table) <= 2
+
+
+def test_sample_has_no_instance_dict():
+    """
+    Test case for the slotted sample record.
+    """
+    sample = InfluxDBSample("m", 1.0, 2.0, ())
+    assert not hasattr(sample, "__dict__")
+    assert sample.id is None
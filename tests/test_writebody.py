@@ -0,0 +1,183 @@
+import gzip
+import io
+import zlib
+import pytest
+import writebody
+from writebody import iter_decoded, BodyTooLarge, DecodeError, UnsupportedEncoding
+
+BODY = b"".join(b"cpu,host=h%d value=%d\n" % (i, i) for i in range(5000))
+
+
+def test_iter_decoded_identity_from_stream():
+    """
+    Test case for reading an uncompressed body from a file-like object in chunks.
+    """
+    chunks = list(iter_decoded(io.BytesIO(BODY), None, len(BODY), 1000))
+    assert b"".join(chunks) == BODY
+    assert max(len(c) for c in chunks) <= 1000
+
+
+def test_iter_decoded_gzip_bounded_chunks():
+    """
+    Test case for gzip bodies being inflated at most chunk_size bytes at a time.
+    """
+    chunks = list(iter_decoded(gzip.compress(BODY), "gzip", len(BODY), 512))
+    assert b"".join(chunks) == BODY
+    assert max(len(c) for c in chunks) <= 512
+
+
+def test_iter_decoded_fills_body_stats():
+    """
+    Test case for the per-body byte counts handed back through BodyStats.
+    """
+    stats = writebody.BodyStats()
+    data = gzip.compress(BODY)
+    assert b"".join(iter_decoded(io.BytesIO(data), "gzip", len(BODY), 4096, stats)) == BODY
+    assert (stats.bytes_in, stats.bytes_out) == (len(data), len(BODY))
+    assert stats.seconds > 0 and stats.read_seconds >= 0
+
+
+def test_iter_decoded_gzip_multiple_members():
+    """
+    Test case for concatenated gzip members.
+    """
+    body = gzip.compress(BODY[:100]) + gzip.compress(BODY[100:])
+    assert b"".join(iter_decoded(body, "gzip", len(BODY), 64)) == BODY
+
+
+def test_iter_decoded_limits():
+    """
+    Test case for the size limit on raw and decompressed bytes.
+    """
+    with pytest.raises(BodyTooLarge):
+        list(iter_decoded(BODY, None, len(BODY) - 1, 1000))
+    # A small compressed body must not be allowed to expand past the limit.
+    with pytest.raises(BodyTooLarge):
+        list(iter_decoded(gzip.compress(BODY), "gzip", len(BODY) // 2, 1000))
+
+
+def test_iter_decoded_invalid_gzip():
+    """
+    Test case for corrupt and truncated gzip bodies.
+    """
+    with pytest.raises(DecodeError):
+        list(iter_decoded(b"not gzip", "gzip", 1000, 100))
+    with pytest.raises(DecodeError):
+        list(iter_decoded(gzip.compress(BODY)[:-10], "gzip", len(BODY), 100))
+
+
+def test_iter_decoded_deflate():
+    """
+    Test case for zlib-wrapped deflate bodies and a case-insensitive encoding name.
+    """
+    chunks = list(iter_decoded(zlib.compress(BODY), "Deflate", len(BODY), 512))
+    assert b"".join(chunks) == BODY
+    assert max(len(c) for c in chunks) <= 512
+    with pytest.raises(DecodeError):
+        list(iter_decoded(zlib.compress(BODY)[:-10], "deflate", len(BODY), 100))
+
+
+def test_iter_decoded_zstd():
+    """
+    Test case for streamed zstd bodies made of several frames.
+    """
+    zstandard = pytest.importorskip("zstandard")
+    compress = zstandard.ZstdCompressor().compress
+    body = compress(BODY[:100]) + compress(BODY[100:])
+    assert b"".join(iter_decoded(body, "zstd", len(BODY), 1000)) == BODY
+    with pytest.raises(DecodeError):
+        list(iter_decoded(body[:-10], "zstd", len(BODY), 1000))
+
+
+def test_iter_decoded_zstd_bounded_chunks():
+    """
+    Test case for a highly compressible zstd body being decoded chunk_size bytes at a time.
+    """
+    zstandard = pytest.importorskip("zstandard")
+    body = zstandard.ZstdCompressor(level=19).compress(b"\0" * (32 << 20))
+    chunks = iter_decoded(body, "zstd", 64 << 20, 4096)
+    assert max(len(next(chunks)) for _ in range(100)) <= 4096
+    with pytest.raises(BodyTooLarge):
+        list(iter_decoded(body, "zstd", 1 << 20, 4096))
+
+
+@pytest.mark.parametrize("cut", [3, 5, 9, 20])
+def test_iter_decoded_zstd_truncated_frame(cut):
+    """
+    Test case for zstd bodies cut inside a frame header, block header or block.
+    """
+    zstandard = pytest.importorskip("zstandard")
+    body = zstandard.ZstdCompressor(write_checksum=True).compress(BODY[:1000])
+    with pytest.raises(DecodeError):
+        list(iter_decoded(body[:cut], "zstd", len(BODY), 100))
+    with pytest.raises(DecodeError):
+        list(iter_decoded(body[:-cut], "zstd", len(BODY), 100))
+
+
+def test_iter_decoded_snappy():
+    """
+    Test case for snappy block bodies, checking the declared length against the limit.
+    """
+    snappy = pytest.importorskip("snappy")
+    assert b"".join(iter_decoded(snappy.compress(BODY), "snappy", len(BODY), 1000)) == BODY
+    with pytest.raises(BodyTooLarge):
+        list(iter_decoded(snappy.compress(BODY), "snappy", len(BODY) - 1, 1000))
+
+
+def test_iter_decoded_unsupported_and_registered(monkeypatch):
+    """
+    Test case for unknown encodings and plugging in a decoder.
+    """
+    with pytest.raises(UnsupportedEncoding):
+        iter_decoded(b"x", "br", 10, 10)
+    class Upper:
+        def __init__(self, chunk_size, max_size):
+            pass
+
+        def decompress(self, data):
+            return (data.upper(),)
+
+        def flush(self):
+            return ()
+
+    monkeypatch.setitem(writebody.DECODERS, "br", None)
+    writebody.register_decoder("BR", Upper)
+    assert b"".join(iter_decoded(b"abc", "br", 10, 2)) == b"ABC"
+
+
+def test_body_decoder_pushed_pieces():
+    """
+    Test case for feeding a body to BodyDecoder piece by piece as it arrives.
+    """
+    stats = writebody.BodyStats()
+    data = gzip.compress(BODY)
+    decoder = writebody.BodyDecoder("gzip", len(BODY), 512, stats)
+    chunks = []
+    for start in range(0, len(data), 100):
+        chunks.extend(decoder.decode(data[start:start + 100]))
+    chunks.extend(decoder.finish())
+    decoder.close()
+    assert b"".join(chunks) == BODY
+    assert max(len(c) for c in chunks) <= 512
+    assert (stats.bytes_in, stats.bytes_out) == (len(data), len(BODY))
+    decoder = writebody.BodyDecoder("gzip", len(BODY), 512)
+    list(decoder.decode(data[:-10]))
+    with pytest.raises(DecodeError):
+        list(decoder.finish())
+
+
+def test_decode_collector_counts_per_encoding(monkeypatch):
+    """
+    Test case for the per-encoding request, error and byte counters.
+    """
+    monkeypatch.setattr(writebody, "STATS", {})
+    list(iter_decoded(gzip.compress(BODY), "gzip", len(BODY), 1000))
+    with pytest.raises(DecodeError):
+        list(iter_decoded(b"garbage", "gzip", 100, 100))
+    values = {m.name: {s.labels["encoding"]: s.value for s in m.samples}
+              for m in writebody.DecodeCollector().collect()}
+    assert values["influxdb_write_decode_requests"] == {"gzip": 2}
+    assert values["influxdb_write_decode_errors"] == {"gzip": 1}
+    assert values["influxdb_write_decode_bytes_in"]["gzip"] == len(gzip.compress(BODY)) + 7
+    assert values["influxdb_write_decode_bytes_out"]["gzip"] == len(BODY)
+    assert values["influxdb_write_decode_seconds"]["gzip"] > 0